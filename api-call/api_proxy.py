@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Local caching proxy for the Mosaic API.
+
+Point any script at it with --base-url and identical polling from many
+processes collapses into far fewer upstream requests:
+  - one warm, pooled connection set to the upstream API
+  - identical in-flight GETs are coalesced (singleflight): one upstream call,
+    every waiter gets the same response
+  - /agent_run/{id} responses in a terminal state (completed/failed) are cached
+    until evicted; in-progress ones for --run-ttl seconds
+  - /agent/{id}/triggers responses are cached for --triggers-ttl seconds and
+    dropped when channels are added through the proxy
+  - POST /_proxy/webhook accepts Mosaic callbacks (forward them or point
+    callback_url here) and invalidates the run they mention
+
+Cache entries are keyed by path, query and Authorization header, so different
+API keys never see each other's responses.
+
+Usage:
+  python api_proxy.py [--port 8787] [--upstream https://api.mosaic.so]
+  python get_status.py --run-id RUN_ID --watch --base-url http://127.0.0.1:8787
+
+Endpoints:
+  GET  /_proxy/stats        cache/coalescing counters
+  POST /_proxy/webhook      Mosaic callback payload -> invalidate its run
+  POST /_proxy/invalidate   {"run_id": ...} or {"agent_id": ...}
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import requests
+from flask import Flask, Response, jsonify, request
+from requests.adapters import HTTPAdapter
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+
+DEFAULT_UPSTREAM = "https://api.mosaic.so"
+TERMINAL_STATUSES = ("completed", "failed")
+
+RUN_PATH = re.compile(r"^/agent_run/([^/]+)$")
+TRIGGERS_PATH = re.compile(r"^/agent/([^/]+)/triggers$")
+ADD_CHANNELS_PATH = re.compile(r"^/agent/([^/]+)/triggers/add_youtube_channels$")
+
+# Request headers not forwarded upstream (RFC 7230 section 6.1, plus ones requests recomputes)
+HOP_BY_HOP = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te",
+    "trailers", "transfer-encoding", "upgrade", "host", "content-length",
+}
+
+# Upstream response headers not copied onto ours: hop-by-hop, plus the body framing,
+# which no longer matches once requests has decoded the body
+RESPONSE_SKIP = HOP_BY_HOP | {"content-encoding", "content-type"}
+
+CacheKey = Tuple[str, str, str]
+
+
+class CachedResponse:
+    __slots__ = ("status", "content_type", "headers", "body", "expires_at")
+
+    def __init__(self, status: int, content_type: str, headers: List[Tuple[str, str]], body: bytes,
+                 expires_at: Optional[float]):
+        self.status = status
+        self.content_type = content_type
+        self.headers = headers  # end-to-end headers, e.g. Retry-After on a 429
+        self.body = body
+        self.expires_at = expires_at  # None = until evicted
+
+
+class ResponseCache:
+    """Thread-safe LRU of upstream responses with per-path invalidation."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[CacheKey, CachedResponse]" = OrderedDict()
+        self.by_path: Dict[str, set] = {}
+        self.lock = threading.Lock()
+
+    def get(self, key: CacheKey) -> Optional[CachedResponse]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at is not None and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key: CacheKey, entry: CachedResponse) -> None:
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self.by_path.setdefault(key[0], set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+
+    def invalidate(self, path: str) -> int:
+        with self.lock:
+            keys = list(self.by_path.get(path, ()))
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def _remove(self, key: CacheKey) -> None:
+        self.entries.pop(key, None)
+        keys = self.by_path.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.by_path[key[0]]
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class SingleFlight:
+    """Run one call per key at a time; concurrent callers share its result."""
+
+    def __init__(self):
+        self.calls: Dict[Any, dict] = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn) -> Tuple[Any, bool]:
+        """Return (result, shared) where shared is True for coalesced callers."""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = {"event": threading.Event(), "result": None, "error": None}
+                self.calls[key] = call
+
+        if not leader:
+            call["event"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"], True
+
+        try:
+            call["result"] = fn()
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["event"].set()
+        return call["result"], False
+
+
+cache = ResponseCache(max_entries=10000)
+flights = SingleFlight()
+session = requests.Session()
+stats_lock = threading.Lock()
+stats = {
+    "requests": 0,
+    "upstream_requests": 0,
+    "cache_hits": 0,
+    "coalesced": 0,
+    "upstream_errors": 0,
+    "invalidations": 0,
+}
+
+
+def count(name: str, amount: int = 1) -> None:
+    with stats_lock:
+        stats[name] += amount
+
+
+def forward_headers() -> Dict[str, str]:
+    return {k: v for k, v in request.headers.items() if k.lower() not in HOP_BY_HOP}
+
+
+def fetch_upstream(method: str, path: str, query: str, headers: Dict[str, str], body: bytes) -> CachedResponse:
+    url = f"{app.config['UPSTREAM']}{path}"
+    if query:
+        url = f"{url}?{query}"
+    count("upstream_requests")
+    resp = session.request(method, url, headers=headers, data=body or None,
+                           timeout=app.config["UPSTREAM_TIMEOUT"])
+    headers = [(k, v) for k, v in resp.headers.items() if k.lower() not in RESPONSE_SKIP]
+    return CachedResponse(resp.status_code, resp.headers.get("Content-Type", ""), headers, resp.content, None)
+
+
+def cache_ttl(path: str, entry: CachedResponse) -> Optional[float]:
+    """Seconds to cache a 200 response; None = until evicted, 0 = don't cache."""
+    if entry.status != 200:
+        return 0
+    if RUN_PATH.match(path):
+        try:
+            status = json.loads(entry.body).get("status")
+        except (ValueError, AttributeError):
+            return 0
+        return None if status in TERMINAL_STATUSES else app.config["RUN_TTL"]
+    if TRIGGERS_PATH.match(path):
+        return app.config["TRIGGERS_TTL"]
+    return 0
+
+
+def to_response(entry: CachedResponse, cache_state: str) -> Response:
+    resp = Response(entry.body, status=entry.status, content_type=entry.content_type or None)
+    for name, value in entry.headers:
+        resp.headers[name] = value
+    resp.headers["X-Proxy-Cache"] = cache_state
+    return resp
+
+
+def invalidate_run(run_id: Optional[str]) -> int:
+    if not run_id:
+        return 0
+    removed = cache.invalidate(f"/agent_run/{run_id}")
+    count("invalidations", removed)
+    return removed
+
+
+def invalidate_agent(agent_id: Optional[str]) -> int:
+    if not agent_id:
+        return 0
+    removed = cache.invalidate(f"/agent/{agent_id}/triggers")
+    count("invalidations", removed)
+    return removed
+
+
+@app.route('/_proxy/stats', methods=['GET'])
+def proxy_stats():
+    with stats_lock:
+        snapshot = dict(stats)
+    snapshot["cache_entries"] = len(cache)
+    snapshot["upstream"] = app.config["UPSTREAM"]
+    return jsonify(snapshot)
+
+
+@app.route('/_proxy/webhook', methods=['POST'])
+@app.route('/_proxy/webhook/<path:token>', methods=['POST'])
+def proxy_webhook(token: Optional[str] = None):
+    expected_secret = app.config.get('WEBHOOK_SECRET')
+    if expected_secret and request.headers.get('X-Mosaic-Signature') != expected_secret:
+        return jsonify({"error": "Invalid webhook secret"}), 401
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "No JSON"}), 400
+    removed = invalidate_run(data.get("run_id"))
+    return jsonify({"received": True, "invalidated": removed}), 200
+
+
+@app.route('/_proxy/invalidate', methods=['POST'])
+def proxy_invalidate():
+    data = request.get_json(silent=True) or {}
+    removed = invalidate_run(data.get("run_id")) + invalidate_agent(data.get("agent_id"))
+    return jsonify({"invalidated": removed}), 200
+
+
+@app.route('/', defaults={'path': ''}, methods=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+@app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'])
+def proxy(path: str):
+    count("requests")
+    path = f"/{path}"
+    query = request.query_string.decode()
+    headers = forward_headers()
+    auth = request.headers.get("Authorization", "")
+
+    if request.method != "GET":
+        try:
+            entry = fetch_upstream(request.method, path, query, headers, request.get_data())
+        except requests.RequestException as e:
+            count("upstream_errors")
+            return jsonify({"error": f"Upstream request failed: {e}"}), 502
+        match = ADD_CHANNELS_PATH.match(path)
+        if match and entry.status < 300:
+            invalidate_agent(match.group(1))
+        return to_response(entry, "BYPASS")
+
+    key = (path, query, auth)
+    cached = cache.get(key)
+    if cached is not None:
+        count("cache_hits")
+        return to_response(cached, "HIT")
+
+    try:
+        entry, shared = flights.do(key, lambda: fetch_upstream("GET", path, query, headers, b""))
+    except requests.RequestException as e:
+        count("upstream_errors")
+        return jsonify({"error": f"Upstream request failed: {e}"}), 502
+
+    if shared:
+        count("coalesced")
+        return to_response(entry, "COALESCED")
+
+    ttl = cache_ttl(path, entry)
+    if ttl != 0:
+        entry.expires_at = None if ttl is None else time.monotonic() + ttl
+        cache.put(key, entry)
+    return to_response(entry, "MISS")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Caching, coalescing local proxy for the Mosaic API")
+    parser.add_argument('--port', type=int, default=8787)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--upstream', default=DEFAULT_UPSTREAM, help=f'Upstream API (default: {DEFAULT_UPSTREAM})')
+    parser.add_argument('--run-ttl', type=float, default=2.0, help='Seconds to cache in-progress run status (default: 2)')
+    parser.add_argument('--triggers-ttl', type=float, default=30.0, help='Seconds to cache agent triggers (default: 30)')
+    parser.add_argument('--max-entries', type=int, default=10000, help='Cached responses kept (LRU, default: 10000)')
+    parser.add_argument('--pool-size', type=int, default=32, help='Upstream connections kept warm (default: 32)')
+    parser.add_argument('--timeout', type=float, default=60.0, help='Upstream request timeout (default: 60)')
+    parser.add_argument('--webhook-secret', help='Require X-Mosaic-Signature on /_proxy/webhook (or MOSAIC_WEBHOOK_SECRET)')
+    args = parser.parse_args()
+
+    app.config['UPSTREAM'] = args.upstream.rstrip('/')
+    app.config['RUN_TTL'] = args.run_ttl
+    app.config['TRIGGERS_TTL'] = args.triggers_ttl
+    app.config['UPSTREAM_TIMEOUT'] = args.timeout
+    app.config['WEBHOOK_SECRET'] = args.webhook_secret or os.environ.get('MOSAIC_WEBHOOK_SECRET')
+    cache.max_entries = args.max_entries
+
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=args.pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    print("\n🔁 Mosaic API proxy starting...")
+    print(f"   Upstream: {app.config['UPSTREAM']}")
+    print(f"   Local:    http://{args.host}:{args.port}  (use as --base-url)")
+    print(f"   Stats:    http://{args.host}:{args.port}/_proxy/stats")
+    print(f"   Webhook:  http://{args.host}:{args.port}/_proxy/webhook")
+    print(f"   Run TTL:  {args.run_ttl}s in progress, terminal runs until evicted")
+
+    app.run(host=args.host, port=args.port, threaded=True, use_reloader=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+"""
+Byte-budgeted, content-addressed local cache of run artifacts.
+
+Reviewers open the same output videos and thumbnails again and again; with
+--artifact-cache DIR the listeners keep a local copy and serve it:
+
+  GET /artifacts                        hit/miss counters, bytes used / budget
+  GET /artifacts/<run_id>               the run's outputs and which are cached
+  GET /artifacts/<run_id>/<n>           output n's video (1-based), Range requests supported
+  GET /artifacts/<run_id>/<n>/thumbnail output n's thumbnail
+
+Output URLs are learned from OUTPUTS_FINISHED / RUN_FINISHED events (or, for
+runs the listener hasn't seen, from the cluster's event log in cluster mode
+or GET /agent_run/{id} when an API key is available). Events can prefetch thumbnails or everything in the background;
+anything else is fetched on first access, once, however many reviewers ask
+for it at the same time.
+
+Files are stored under their SHA-256, so an artifact reachable through
+several URLs (or shared by several runs) is stored once. The least recently
+used files are deleted once the total exceeds the byte budget; a file larger
+than --artifact-max-object-mb is not cached and the request is redirected to
+its origin instead. The URL index survives restarts. One cache directory
+belongs to one listener process.
+
+Usage:
+  python webhook_listener.py --artifact-cache ~/.mosaic/artifacts --artifact-cache-mb 20480
+  python artifact_cache.py --dir ~/.mosaic/artifacts stats
+  python artifact_cache.py --dir ~/.mosaic/artifacts clear
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 10 * 1024 ** 3
+KINDS = ("video", "thumbnail")
+PREFETCH_MODES = ("none", "thumbnails", "all")
+MAX_RUNS = 10_000  # runs whose output URLs are remembered
+CHUNK = 1024 * 1024
+
+
+class ArtifactError(Exception):
+    """An artifact could not be fetched from its origin."""
+
+
+class TooLarge(ArtifactError):
+    """The artifact exceeds the per-object limit; serve it from its origin."""
+
+
+class CachedObject:
+    __slots__ = ("digest", "size", "content_type")
+
+    def __init__(self, digest: str, size: int, content_type: str):
+        self.digest = digest
+        self.size = size
+        self.content_type = content_type
+
+
+def output_urls(outputs: List[Dict[str, Any]]) -> List[Dict[str, Optional[str]]]:
+    """[{video, thumbnail}] from an event's or run's outputs list."""
+    urls = []
+    for out in outputs or []:
+        if isinstance(out, dict):
+            urls.append({"video": out.get("video_url") or out.get("url"), "thumbnail": out.get("thumbnail_url")})
+    return urls
+
+
+class ArtifactCache:
+    """Thread-safe cache directory: objects/<sha256[:2]>/<sha256>, index.jsonl and runs.jsonl."""
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES, max_object_bytes: Optional[int] = None,
+                 prefetch: str = "thumbnails", base_url: Optional[str] = None, api_key: Optional[str] = None,
+                 timeout: float = 300):
+        if prefetch not in PREFETCH_MODES:
+            raise ValueError(f"prefetch must be one of {', '.join(PREFETCH_MODES)}")
+        self.root = os.path.abspath(os.path.expanduser(root))
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes or max_bytes // 4
+        self.prefetch_mode = prefetch
+        self.base_url = base_url
+        self.api_key = api_key
+        self.timeout = timeout
+        # run_id -> its RUN_FINISHED payload from elsewhere (the cluster store), or None
+        self.event_source: Optional[Callable[[str], Optional[Dict[str, Any]]]] = None
+        self.objects: "OrderedDict[str, CachedObject]" = OrderedDict()  # digest -> object, LRU first
+        self.urls: Dict[str, str] = {}  # url -> digest
+        self.aliases: Dict[str, set] = {}  # digest -> urls
+        self.oversized: "OrderedDict[str, None]" = OrderedDict()  # urls known to be over the object limit
+        self.runs: "OrderedDict[str, List[Dict[str, Optional[str]]]]" = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.index_lock = threading.Lock()
+        self.flights: Dict[str, threading.Event] = {}
+        self.counters = {"hits": 0, "misses": 0, "coalesced": 0, "prefetched": 0, "prefetch_dropped": 0,
+                         "fetched_bytes": 0, "evictions": 0, "evicted_bytes": 0, "too_large": 0, "errors": 0}
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(pool_maxsize=8))
+        self.session.mount("http://", HTTPAdapter(pool_maxsize=8))
+        self.prefetch_queue: "queue.Queue[str]" = queue.Queue(maxsize=1000)
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+        self._load()
+
+    # --- persistence -----------------------------------------------------
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.root, "objects", digest[:2], digest)
+
+    def _load(self) -> None:
+        """Rebuild the LRU from the files on disk (oldest mtime first) and replay the indexes."""
+        shutil.rmtree(os.path.join(self.root, "tmp"), ignore_errors=True)
+        os.makedirs(os.path.join(self.root, "tmp"), exist_ok=True)
+        found = []
+        objects_dir = os.path.join(self.root, "objects")
+        for prefix in os.listdir(objects_dir):
+            directory = os.path.join(objects_dir, prefix)
+            if not os.path.isdir(directory):
+                continue
+            for digest in os.listdir(directory):
+                stat = os.stat(os.path.join(directory, digest))
+                found.append((stat.st_mtime, digest, stat.st_size))
+        types: Dict[str, str] = {}
+        for entry in self._read_jsonl("index.jsonl"):
+            self.urls[entry["url"]] = entry["digest"]
+            types[entry["digest"]] = entry.get("content_type") or "application/octet-stream"
+        for _, digest, size in sorted(found):
+            self.objects[digest] = CachedObject(digest, size, types.get(digest, "application/octet-stream"))
+            self.bytes += size
+        self.urls = {url: digest for url, digest in self.urls.items() if digest in self.objects}
+        for url, digest in self.urls.items():
+            self.aliases.setdefault(digest, set()).add(url)
+        for entry in self._read_jsonl("runs.jsonl"):
+            self.runs[entry["run_id"]] = entry["outputs"]
+            self.runs.move_to_end(entry["run_id"])
+        while len(self.runs) > MAX_RUNS:
+            self.runs.popitem(last=False)
+        # Compact both logs to what is still live
+        self._rewrite("index.jsonl", [{"url": u, "digest": d, "content_type": self.objects[d].content_type}
+                                      for u, d in self.urls.items()])
+        self._rewrite("runs.jsonl", [{"run_id": r, "outputs": o} for r, o in self.runs.items()])
+        self._evict()
+
+    def _read_jsonl(self, name: str) -> List[Dict[str, Any]]:
+        entries = []
+        try:
+            with open(os.path.join(self.root, name), "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue  # a torn last line from a crash
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _rewrite(self, name: str, entries: List[Dict[str, Any]]) -> None:
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=f".{name}.")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp, os.path.join(self.root, name))
+
+    def _append(self, name: str, entry: Dict[str, Any]) -> None:
+        with self.index_lock, open(os.path.join(self.root, name), "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    # --- runs ------------------------------------------------------------
+
+    def observe(self, data: Dict[str, Any]) -> None:
+        """Learn output URLs from an event and queue prefetches; never blocks."""
+        run_id = data.get("run_id")
+        flag = data.get("flag")
+        if flag == "RUN_FINISHED":
+            outputs = output_urls(data.get("outputs"))
+        elif flag == "OUTPUTS_FINISHED":
+            outputs = output_urls(data.get("output"))
+        else:
+            return
+        if not outputs:
+            return
+        if run_id:
+            with self.lock:
+                known = self.runs.get(run_id, []) if flag == "OUTPUTS_FINISHED" else []
+                # OUTPUTS_FINISHED adds outputs as they finish; RUN_FINISHED carries the full list
+                merged = known + [o for o in outputs if o not in known]
+                changed = merged != self.runs.get(run_id)
+                self.runs[run_id] = merged
+                self.runs.move_to_end(run_id)
+                while len(self.runs) > MAX_RUNS:
+                    self.runs.popitem(last=False)
+            if changed:
+                self._append("runs.jsonl", {"run_id": run_id, "outputs": merged})
+        if self.prefetch_mode == "none":
+            return
+        for out in outputs:
+            for kind in (KINDS if self.prefetch_mode == "all" else ("thumbnail",)):
+                url = out.get(kind)
+                if url and url not in self.urls:
+                    try:
+                        self.prefetch_queue.put_nowait(url)
+                    except queue.Full:
+                        self._count("prefetch_dropped")
+
+    def run_outputs(self, run_id: str) -> Optional[List[Dict[str, Optional[str]]]]:
+        """Output URLs of a run, asking the API when the listener never saw its events."""
+        with self.lock:
+            outputs = self.runs.get(run_id)
+        if outputs is None and self.event_source is not None:
+            data = self.event_source(run_id)
+            if data:
+                self.observe(data)
+                with self.lock:
+                    outputs = self.runs.get(run_id)
+        if outputs is not None or not self.api_key:
+            return outputs
+        from get_status import request_status
+
+        try:
+            run = request_status(self.session, self.base_url, {"Authorization": f"Bearer {self.api_key}"},
+                                 run_id, compact=True)
+        except (requests.RequestException, ValueError) as e:
+            logger.warning(f"Could not look up outputs of run {run_id}: {e}")
+            return None
+        outputs = [{"video": o.video_url, "thumbnail": o.thumbnail_url} for o in run.outputs]
+        if run.status == "completed" and outputs:
+            self.observe({"flag": "RUN_FINISHED", "run_id": run_id,
+                          "outputs": [{"video_url": o["video"], "thumbnail_url": o["thumbnail"]} for o in outputs]})
+        return outputs
+
+    def resolve(self, run_id: str, n: int, kind: str = "video") -> Optional[str]:
+        """URL of output n (1-based) of a run, or None."""
+        outputs = self.run_outputs(run_id)
+        if not outputs or not 1 <= n <= len(outputs):
+            return None
+        return outputs[n - 1].get(kind)
+
+    # --- objects ---------------------------------------------------------
+
+    def lookup(self, url: str) -> Optional[Tuple[str, CachedObject]]:
+        """(path, object) of a cached URL, marking it recently used; None on a miss."""
+        with self.lock:
+            digest = self.urls.get(url)
+            obj = self.objects.get(digest) if digest else None
+            if obj is None:
+                return None
+            self.objects.move_to_end(digest)
+        path = self._object_path(digest)
+        try:
+            # mtime carries the LRU order across restarts
+            os.utime(path)
+        except FileNotFoundError:
+            self._forget(digest)
+            return None
+        return path, obj
+
+    def get(self, url: str) -> Tuple[str, CachedObject, bool]:
+        """(path, object, hit) for a URL, fetching it on a miss. Raises ArtifactError / TooLarge."""
+        found = self.lookup(url)
+        if found:
+            self._count("hits")
+            return found[0], found[1], True
+        self._count("misses")
+        if url in self.oversized:
+            raise TooLarge(f"{url} is over the {self.max_object_bytes}-byte limit")
+        self.fill(url)
+        found = self.lookup(url)
+        if not found:
+            raise ArtifactError(f"{url} was evicted before it could be served; the cache budget is too small")
+        return found[0], found[1], False
+
+    def fill(self, url: str) -> bool:
+        """
+        Download a URL into the cache; concurrent calls for the same URL wait
+        for one download. True if this call downloaded it.
+        """
+        with self.lock:
+            if url in self.urls:
+                return False
+            flight = self.flights.get(url)
+            leader = flight is None
+            if leader:
+                flight = self.flights[url] = threading.Event()
+        if not leader:
+            self._count("coalesced")
+            flight.wait()
+            with self.lock:
+                if url in self.urls:
+                    return False
+            if url in self.oversized:
+                raise TooLarge(f"{url} is over the {self.max_object_bytes}-byte limit")
+            raise ArtifactError(f"fetching {url} failed (see the listener log)")
+        try:
+            self._download(url)
+            return True
+        except TooLarge:
+            with self.lock:
+                self.oversized[url] = None
+                if len(self.oversized) > MAX_RUNS:
+                    self.oversized.popitem(last=False)
+            raise
+        finally:
+            with self.lock:
+                del self.flights[url]
+            flight.set()
+
+    def _download(self, url: str) -> None:
+        try:
+            resp = self.session.get(url, stream=True, timeout=self.timeout)
+        except requests.RequestException as e:
+            self._count("errors")
+            raise ArtifactError(f"fetching {url} failed: {e}") from e
+        with resp:
+            if resp.status_code != 200:
+                self._count("errors")
+                raise ArtifactError(f"fetching {url} failed: HTTP {resp.status_code}")
+            length = int(resp.headers.get("Content-Length") or 0)
+            if length > self.max_object_bytes:
+                self._count("too_large")
+                raise TooLarge(f"{url} is {length} bytes (limit {self.max_object_bytes})")
+            content_type = resp.headers.get("Content-Type") or "application/octet-stream"
+            digest = hashlib.sha256()
+            size = 0
+            fd, tmp = tempfile.mkstemp(dir=os.path.join(self.root, "tmp"))
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    for chunk in resp.iter_content(CHUNK):
+                        size += len(chunk)
+                        if size > self.max_object_bytes:
+                            self._count("too_large")
+                            raise TooLarge(f"{url} is over the {self.max_object_bytes}-byte limit")
+                        digest.update(chunk)
+                        f.write(chunk)
+                self._count("fetched_bytes", size)
+                self._store(url, tmp, digest.hexdigest(), size, content_type)
+            except requests.RequestException as e:
+                self._count("errors")
+                raise ArtifactError(f"fetching {url} failed: {e}") from e
+            finally:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+    def _store(self, url: str, tmp: str, digest: str, size: int, content_type: str) -> None:
+        path = self._object_path(digest)
+        with self.lock:
+            if digest not in self.objects:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp, path)
+                self.objects[digest] = CachedObject(digest, size, content_type)
+                self.bytes += size
+            self.objects.move_to_end(digest)
+            self.urls[url] = digest
+            self.aliases.setdefault(digest, set()).add(url)
+        self._append("index.jsonl", {"url": url, "digest": digest, "content_type": content_type})
+        self._evict()
+
+    def _evict(self) -> None:
+        while True:
+            with self.lock:
+                # Always keep the newest object, even if it alone is over budget
+                if self.bytes <= self.max_bytes or len(self.objects) <= 1:
+                    return
+                digest, obj = self.objects.popitem(last=False)
+                self.bytes -= obj.size
+                for url in self.aliases.pop(digest, ()):
+                    self.urls.pop(url, None)
+                self.counters["evictions"] += 1
+                self.counters["evicted_bytes"] += obj.size
+            try:
+                # A response already streaming it keeps its open file
+                os.remove(self._object_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def _forget(self, digest: str) -> None:
+        with self.lock:
+            obj = self.objects.pop(digest, None)
+            if obj is not None:
+                self.bytes -= obj.size
+                for url in self.aliases.pop(digest, ()):
+                    self.urls.pop(url, None)
+
+    # --- prefetch --------------------------------------------------------
+
+    def start(self, workers: int = 2) -> None:
+        """Start the background workers that fill prefetched URLs."""
+        for index in range(workers):
+            threading.Thread(target=self._prefetch_loop, name=f"artifact-prefetch-{index}", daemon=True).start()
+
+    def _prefetch_loop(self) -> None:
+        while True:
+            url = self.prefetch_queue.get()
+            try:
+                if self.fill(url):
+                    self._count("prefetched")
+            except ArtifactError as e:
+                logger.warning(f"Prefetch skipped: {e}")
+            except OSError as e:
+                logger.warning(f"Prefetch of {url} failed: {e}")
+
+    # --- reporting -------------------------------------------------------
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self.lock:
+            self.counters[name] += amount
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+            return {
+                "dir": self.root,
+                "objects": len(self.objects),
+                "urls": len(self.urls),
+                "runs": len(self.runs),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "max_object_bytes": self.max_object_bytes,
+                "prefetch": self.prefetch_mode,
+                "prefetch_queued": self.prefetch_queue.qsize(),
+                "hit_ratio": round(self.counters["hits"] / lookups, 4) if lookups else None,
+                **self.counters,
+            }
+
+    def describe_run(self, run_id: str) -> Optional[List[Dict[str, Any]]]:
+        outputs = self.run_outputs(run_id)
+        if outputs is None:
+            return None
+        with self.lock:
+            return [{
+                "n": n,
+                "video_url": out.get("video"),
+                "thumbnail_url": out.get("thumbnail"),
+                "video_cached": out.get("video") in self.urls,
+                "thumbnail_cached": out.get("thumbnail") in self.urls,
+                "video": f"/artifacts/{run_id}/{n}",
+                "thumbnail": f"/artifacts/{run_id}/{n}/thumbnail",
+            } for n, out in enumerate(outputs, 1)]
+
+
+def serve_artifact(cache: ArtifactCache, run_id: str, n: int, kind: str):
+    """Flask response for GET /artifacts/<run_id>/<n>[/thumbnail], shared by both listeners."""
+    from flask import jsonify, redirect, send_file
+
+    url = cache.resolve(run_id, n, kind)
+    if not url:
+        return jsonify({"error": f"No {kind} for output {n} of run {run_id}"}), 404
+    for attempt in range(2):
+        try:
+            path, obj, hit = cache.get(url)
+            response = send_file(path, mimetype=obj.content_type, conditional=True, etag=obj.digest, max_age=3600)
+            break
+        except TooLarge:
+            return redirect(url, code=302)
+        except FileNotFoundError:
+            # Evicted between lookup and open: fetch it again, once
+            if attempt:
+                return jsonify({"error": f"{url} keeps being evicted; the cache budget is too small"}), 502
+        except ArtifactError as e:
+            return jsonify({"error": str(e)}), 502
+    response.headers["X-Cache"] = "HIT" if hit else "MISS"
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or clear a listener artifact cache")
+    parser.add_argument("--dir", required=True, help="Cache directory (the listener's --artifact-cache)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("stats", help="Objects and bytes on disk")
+    sub.add_parser("clear", help="Delete every cached file (stop the listener first)")
+    args = parser.parse_args()
+
+    root = os.path.abspath(os.path.expanduser(args.dir))
+    if not os.path.isdir(os.path.join(root, "objects")):
+        print(f"❌ {root} is not an artifact cache")
+        sys.exit(1)
+    if args.command == "clear":
+        for name in ("objects", "tmp", "index.jsonl", "runs.jsonl"):
+            target = os.path.join(root, name)
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            elif os.path.exists(target):
+                os.remove(target)
+        os.makedirs(os.path.join(root, "objects"))
+        print(f"🧹 Cleared {root}")
+        return
+    # Read-only: opening an ArtifactCache would compact the indexes under a running listener
+    files = total = 0
+    for directory, _, names in os.walk(os.path.join(root, "objects")):
+        for name in names:
+            files += 1
+            total += os.path.getsize(os.path.join(directory, name))
+    print(f"🗄️  {root}: {files} files, {total / 1024 ** 2:,.1f}MB "
+          f"(live hit/miss counters: GET /artifacts on the listener)")
+
+
+if __name__ == "__main__":
+    main()
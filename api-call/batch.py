@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Run many Mosaic API operations from NDJSON in one long-lived process.
+
+Each input line is a JSON command:
+  {"op": "run", "agent_id": "AGENT_ID", "video_ids": ["VID1"], "callback_url": "..."}
+  {"op": "status", "run_id": "RUN_ID"}
+
+An optional "id" field is echoed back. Commands share one pooled HTTP session
+(so TLS handshakes are reused), run with bounded concurrency, and one NDJSON
+result line is written per command in completion order:
+  {"line": 1, "id": "...", "op": "run", "ok": true, "run_id": "..."}
+  {"line": 2, "op": "status", "ok": false, "status_code": 404, "error": "..."}
+
+Usage:
+  python batch.py [--input commands.ndjson] [--output results.ndjson [--append]] [--concurrency 8]
+  cat commands.ndjson | python batch.py > results.ndjson
+  python batch.py --input commands.ndjson --profile batch.profile.json
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, Optional, TextIO, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from get_status import request_status
+from profiling import add_profile_arguments, start_profiler
+from run_agent import start_run
+
+
+DEFAULT_BASE_URL = "https://api.mosaic.so"
+
+
+def resolve_api_key(explicit_key: Optional[str]) -> str:
+    api_key = explicit_key or os.environ.get("MOSAIC_API_KEY")
+    if not api_key:
+        print("❌ Error: API key required. Use --api-key or set MOSAIC_API_KEY", file=sys.stderr)
+        sys.exit(1)
+    if not api_key.startswith("mk_"):
+        print("❌ Error: Invalid API key format (must start with 'mk_')", file=sys.stderr)
+        sys.exit(1)
+    return api_key
+
+
+def make_session(concurrency: int) -> requests.Session:
+    """Session whose connection pool is large enough for every worker."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(concurrency, 1))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def read_commands(stream: TextIO) -> Iterator[Tuple[int, Any]]:
+    """Yield (line_number, parsed_command_or_exception) for non-blank lines."""
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_no, json.loads(line)
+        except json.JSONDecodeError as e:
+            yield line_no, e
+
+
+def execute(session, base_url: str, headers: dict, command: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a single command and return its result fields."""
+    op = command.get("op")
+    if op == "run":
+        agent_id = command.get("agent_id")
+        video_ids = command.get("video_ids") or []
+        if isinstance(video_ids, str):
+            video_ids = [v.strip() for v in video_ids.split(",") if v.strip()]
+        if not agent_id or not video_ids:
+            raise ValueError("'run' requires agent_id and video_ids")
+        run_id = start_run(session, base_url, headers, agent_id, video_ids, command.get("callback_url"))
+        return {"run_id": run_id}
+    if op == "status":
+        run_id = command.get("run_id")
+        if not run_id:
+            raise ValueError("'status' requires run_id")
+        data = request_status(session, base_url, headers, run_id)
+        return {"run_id": run_id, "status": data.get("status"), "result": data}
+    raise ValueError(f"Unknown op: {op!r} (expected 'run' or 'status')")
+
+
+def run_batch(
+    commands: Iterator[Tuple[int, Any]],
+    out: TextIO,
+    session,
+    base_url: str,
+    headers: dict,
+    concurrency: int,
+) -> Dict[str, int]:
+    """Execute commands concurrently, writing one NDJSON result per command."""
+    counts = {"ok": 0, "failed": 0}
+    write_lock = threading.Lock()
+    # Bounds queued work so huge inputs are streamed instead of loaded up front
+    slots = threading.BoundedSemaphore(concurrency * 2)
+
+    def work(line_no: int, command: Any) -> None:
+        started = time.perf_counter()
+        result: Dict[str, Any] = {"line": line_no}
+        try:
+            if isinstance(command, Exception):
+                raise ValueError(f"Invalid JSON: {command}")
+            if not isinstance(command, dict):
+                raise ValueError("Command must be a JSON object")
+            if "id" in command:
+                result["id"] = command["id"]
+            result["op"] = command.get("op")
+            result.update(execute(session, base_url, headers, command))
+            result["ok"] = True
+        except requests.HTTPError as e:
+            result["ok"] = False
+            result["status_code"] = e.response.status_code if e.response is not None else None
+            result["error"] = e.response.text if e.response is not None and e.response.text else str(e)
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = str(e)
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+        line = json.dumps(result)
+        with write_lock:
+            counts["ok" if result["ok"] else "failed"] += 1
+            out.write(line + "\n")
+            out.flush()
+
+    def release(_future) -> None:
+        slots.release()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for line_no, command in commands:
+            slots.acquire()
+            pool.submit(work, line_no, command).add_done_callback(release)
+
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run NDJSON batches of Mosaic run/status operations")
+    parser.add_argument("--input", default="-", help="NDJSON command file (default: stdin)")
+    parser.add_argument("--output", default="-", help="NDJSON result file, overwritten (default: stdout)")
+    parser.add_argument("--append", action="store_true", help="Append to --output instead of overwriting it")
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel requests (default: 8)")
+    parser.add_argument("--api-key", help="Mosaic API key (or use MOSAIC_API_KEY env var)")
+    parser.add_argument("--base-url", default=DEFAULT_BASE_URL)
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    profiler = start_profiler("batch", args.profile, args.profile_cprofile)
+
+    if args.concurrency < 1:
+        print("❌ --concurrency must be at least 1", file=sys.stderr)
+        sys.exit(1)
+
+    api_key = resolve_api_key(args.api_key)
+    headers = {"Authorization": f"Bearer {api_key}"}
+    session = make_session(args.concurrency)
+
+    src = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    dst = sys.stdout if args.output == "-" else open(args.output, "a" if args.append else "w", encoding="utf-8")
+    started = time.perf_counter()
+    try:
+        # Reading, executing and writing overlap, so the whole pipeline is one phase
+        with profiler.phase("batch"):
+            counts = run_batch(read_commands(src), dst, session, args.base_url, headers, args.concurrency)
+    except KeyboardInterrupt:
+        print("\n❌ Batch cancelled by user", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        if src is not sys.stdin:
+            src.close()
+        if dst is not sys.stdout:
+            dst.close()
+
+    elapsed = time.perf_counter() - started
+    print(f"✅ {counts['ok']} ok, {counts['failed']} failed in {elapsed:.1f}s", file=sys.stderr)
+    sys.exit(1 if counts["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Decoding for batched webhook deliveries (POST /batch on both listeners).
+
+A batch body is either NDJSON (one event per line) or a JSON array of events,
+optionally sent with Content-Encoding: gzip (or deflate). The whole batch
+shares one X-Mosaic-Signature; each event then goes through the listener's
+normal single-event path, and the response lists a result per event:
+
+  curl -X POST localhost:3000/batch \\
+       -H 'Content-Type: application/x-ndjson' -H 'Content-Encoding: gzip' \\
+       -H 'X-Mosaic-Signature: your_secret' --data-binary @events.ndjson.gz
+
+  {"received": 3, "accepted": 2, "failed": 1, "results": [
+     {"index": 0, "status": 200, "run_id": "..."},
+     {"index": 1, "status": 400, "error": "line is not valid JSON: ..."},
+     {"index": 2, "status": 503, "run_id": "...", "route": "tenant-a", "error": "route busy"}]}
+
+Events that fail (4xx/5xx) can be resent on their own; the others must not be.
+"""
+
+import json
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+
+MAX_BATCH_BYTES = 64 * 1024 * 1024  # decompressed
+MAX_BATCH_EVENTS = 10_000
+
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/x-jsonlines")
+
+# (raw event bytes for history, parsed event or None, error or None)
+BatchItem = Tuple[bytes, Optional[Dict[str, Any]], Optional[str]]
+
+
+class BatchError(Exception):
+    """The batch as a whole can't be read; `status` is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+
+def decode_body(body: bytes, content_encoding: Optional[str], max_bytes: int = MAX_BATCH_BYTES) -> bytes:
+    """Undo Content-Encoding, refusing anything that inflates beyond max_bytes."""
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding in ("", "identity"):
+        if len(body) > max_bytes:
+            raise BatchError(f"batch larger than {max_bytes} bytes", 413)
+        return body
+    if encoding not in ("gzip", "x-gzip", "deflate"):
+        raise BatchError(f"unsupported Content-Encoding '{content_encoding}' (use gzip)", 415)
+    # wbits 47 accepts both gzip and zlib headers
+    decompressor = zlib.decompressobj(47)
+    try:
+        data = decompressor.decompress(body, max_bytes + 1)
+    except zlib.error as e:
+        raise BatchError(f"corrupt {encoding} body: {e}")
+    if len(data) > max_bytes:
+        raise BatchError(f"batch inflates beyond {max_bytes} bytes", 413)
+    if not decompressor.eof:
+        raise BatchError(f"truncated {encoding} body")
+    return data
+
+
+def _check_event(event: Any) -> Optional[str]:
+    if not isinstance(event, dict) or not event:
+        return "event must be a non-empty JSON object"
+    return None
+
+
+def parse_events(data: bytes, content_type: Optional[str] = None,
+                 max_events: int = MAX_BATCH_EVENTS) -> List[BatchItem]:
+    """Split a decoded batch into events; a bad line only fails its own event."""
+    mimetype = (content_type or "").split(";")[0].strip().lower()
+    text = data.lstrip()
+    items: List[BatchItem] = []
+
+    if text[:1] == b"[" and mimetype not in NDJSON_TYPES:
+        try:
+            events = json.loads(data)
+        except ValueError as e:
+            raise BatchError(f"body is not a valid JSON array: {e}")
+        if len(events) > max_events:
+            raise BatchError(f"batch has {len(events)} events (max {max_events})", 413)
+        for event in events:
+            raw = json.dumps(event, separators=(",", ":")).encode()
+            error = _check_event(event)
+            items.append((raw, None if error else event, error))
+        return items
+
+    if text[:1] == b"{" and mimetype == "application/json":
+        # A single (possibly pretty-printed) object
+        lines = [data]
+    else:
+        lines = [line for line in data.split(b"\n") if line.strip()]
+    if len(lines) > max_events:
+        raise BatchError(f"batch has {len(lines)} events (max {max_events})", 413)
+    for line in lines:
+        raw = line.strip()
+        try:
+            event = json.loads(raw)
+        except ValueError as e:
+            items.append((raw, None, f"line is not valid JSON: {e}"))
+            continue
+        error = _check_event(event)
+        items.append((raw, None if error else event, error))
+    return items
+
+
+def decode_batch(body: bytes, content_encoding: Optional[str], content_type: Optional[str]) -> List[BatchItem]:
+    events = parse_events(decode_body(body, content_encoding), content_type)
+    if not events:
+        raise BatchError("batch holds no events")
+    return events
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    accepted = sum(1 for r in results if r["status"] == 200)
+    return {"received": len(results), "accepted": accepted, "failed": len(results) - accepted, "results": results}
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Capture inbound webhook traffic and replay it against a listener.
+
+With --capture FILE both listeners append every inbound POST to FILE: arrival
+time, method, path, query string, headers, raw body, plus the status the
+listener answered with and how long it took to ack (server-side). Each record
+is a JSON header line followed by the raw body, and the file is one gzip
+stream flushed after every record: headers repeated across requests compress
+to a few bytes, and a crash loses at most the request in flight. A capture
+left unterminated by a killed listener is repaired when it is next opened.
+
+Replay resends the captured requests to any listener, open-loop: each request
+is sent at its original offset from the first one divided by --speed,
+whether or not earlier requests have been answered, so bursts and overlap
+look as they did in production. --speed max sends as fast as the worker pool
+allows. The report compares replayed acks with the captured ones.
+
+Usage:
+  python webhook_listener.py --capture incident.cap
+  python capture.py info incident.cap
+  python capture.py replay incident.cap --target http://localhost:3000 [--speed 1|10|max] [--max-gap 5] [--json]
+
+Captures contain X-Mosaic-Signature headers and full payloads; treat them
+like the webhook secret itself.
+"""
+
+import argparse
+import atexit
+import json
+import os
+import queue
+import statistics
+import sys
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+MAGIC = b"MOSAICCAP1\n"  # starts every gzip member
+
+# Set by the client/proxy for the connection, not part of what the sender meant
+SKIP_HEADERS = {"host", "content-length", "connection", "transfer-encoding", "keep-alive", "accept-encoding"}
+
+
+def _decompress(path: str) -> Iterator[bytes]:
+    """Decompressed bytes of every gzip member; stops quietly at a truncated tail."""
+    with open(path, "rb") as f:
+        decompressor = zlib.decompressobj(31)
+        while True:
+            chunk = f.read(1 << 16)
+            if not chunk:
+                return
+            while chunk:
+                try:
+                    data = decompressor.decompress(chunk)
+                except zlib.error:
+                    return
+                if data:
+                    yield data
+                if not decompressor.eof:
+                    break
+                # Next member (the listener was restarted and appended to the file)
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(31)
+
+
+def read_capture(path: str) -> Iterator[Tuple[Dict[str, Any], bytes]]:
+    """Yield (header, raw body) per captured request; stops at a truncated tail."""
+    buffer = bytearray()
+    started = False
+    for data in _decompress(path):
+        buffer += data
+        while True:
+            newline = buffer.find(b"\n")
+            if newline < 0:
+                break
+            line = bytes(buffer[:newline + 1])
+            if line == MAGIC:
+                started = True
+                del buffer[:newline + 1]
+                continue
+            if not started:
+                raise ValueError(f"{path} is not a capture file")
+            header = json.loads(line)
+            end = newline + 1 + header["len"]
+            if len(buffer) < end:
+                break
+            body = bytes(buffer[newline + 1:end])
+            del buffer[:end]
+            yield header, body
+    if not started and os.path.getsize(path):
+        raise ValueError(f"{path} is not a capture file")
+
+
+def _is_terminated(path: str) -> bool:
+    """True when the last gzip member has its trailer (the writer was closed)."""
+    with open(path, "rb") as f:
+        decompressor, fed = zlib.decompressobj(31), False
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            while chunk:
+                try:
+                    decompressor.decompress(chunk)
+                except zlib.error:
+                    return False
+                fed = True
+                if not decompressor.eof:
+                    break
+                chunk = decompressor.unused_data
+                decompressor, fed = zlib.decompressobj(31), False
+        return decompressor.eof or not fed
+
+
+class CaptureWriter:
+    """Thread-safe append-only capture file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(path) and os.path.getsize(path) and not _is_terminated(path):
+            self._repair()
+        self.file = open(path, "ab")
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self._write(MAGIC)
+        atexit.register(self.close)
+
+    def _repair(self) -> None:
+        """Rewrite a capture whose last member was never finished, keeping every whole record."""
+        tmp = f"{self.path}.repair"
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        with open(tmp, "wb") as out:
+            out.write(compressor.compress(MAGIC))
+            for header, body in read_capture(self.path):
+                out.write(compressor.compress(_encode(header, body)))
+            out.write(compressor.flush())
+        os.replace(tmp, self.path)
+
+    def _write(self, data: bytes) -> None:
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH))
+            self.file.flush()
+
+    def write(self, meta: Dict[str, Any], body: bytes) -> None:
+        self._write(_encode(meta, body))
+
+    def close(self) -> None:
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(self.compressor.flush())
+                self.file.close()
+
+
+def _encode(meta: Dict[str, Any], body: bytes) -> bytes:
+    header = dict(meta, len=len(body))
+    return json.dumps(header, separators=(",", ":")).encode() + b"\n" + body
+
+
+def install_capture(app, path: str) -> CaptureWriter:
+    """Record every POST the Flask app receives, with its response status and ack time."""
+    from flask import g, request
+
+    writer = CaptureWriter(path)
+
+    @app.before_request
+    def _capture_start():
+        if request.method == "POST":
+            g.capture_t = time.time()
+            g.capture_start = time.perf_counter()
+
+    @app.after_request
+    def _capture_record(response):
+        start = g.pop("capture_start", None)
+        if start is None:
+            return response
+        try:
+            writer.write({
+                "t": g.pop("capture_t"),
+                "method": request.method,
+                "path": request.path,
+                "query": request.query_string.decode("latin-1"),
+                "headers": [[k, v] for k, v in request.headers.items() if k.lower() not in SKIP_HEADERS],
+                "status": response.status_code,
+                "ack_ms": round((time.perf_counter() - start) * 1000, 3),
+            }, request.get_data())
+        except OSError as e:
+            app.logger.warning(f"Capture write failed: {e}")
+        return response
+
+    return writer
+
+
+def _percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    values = sorted(values)
+
+    def pct(p: float) -> float:
+        return round(values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))], 2)
+
+    return {"p50": pct(50), "p90": pct(90), "p99": pct(99), "max": round(values[-1], 2),
+            "mean": round(statistics.fmean(values), 2)}
+
+
+def _peak_rate(times: List[float]) -> int:
+    """Most requests that fell in any one-second window."""
+    peak, left = 0, 0
+    for right, t in enumerate(times):
+        while t - times[left] > 1.0:
+            left += 1
+        peak = max(peak, right - left + 1)
+    return peak
+
+
+def describe(path: str) -> Dict[str, Any]:
+    times, sizes, paths, statuses, acks = [], 0, {}, {}, []
+    for header, body in read_capture(path):
+        times.append(header["t"])
+        sizes += len(body)
+        paths[header["path"]] = paths.get(header["path"], 0) + 1
+        statuses[str(header.get("status"))] = statuses.get(str(header.get("status")), 0) + 1
+        if header.get("ack_ms") is not None:
+            acks.append(header["ack_ms"])
+    times.sort()
+    duration = times[-1] - times[0] if times else 0.0
+    return {
+        "requests": len(times),
+        "duration_s": round(duration, 3),
+        "mean_rps": round(len(times) / duration, 2) if duration else None,
+        "peak_rps": _peak_rate(times),
+        "payload_bytes": sizes,
+        "file_bytes": os.path.getsize(path),
+        "paths": dict(sorted(paths.items(), key=lambda item: -item[1])),
+        "statuses": statuses,
+        "ack_ms": _percentiles(acks),
+    }
+
+
+def replay(path: str, target: str, speed: Optional[float], concurrency: int = 64,
+           timeout: float = 30.0, limit: Optional[int] = None, max_gap: Optional[float] = None) -> Dict[str, Any]:
+    """Resend a capture to `target`; speed None = as fast as possible, max_gap caps idle stretches."""
+    import requests
+
+    records = list(read_capture(path))
+    records.sort(key=lambda record: record[0]["t"])
+    if limit:
+        records = records[:limit]
+    if not records:
+        raise ValueError(f"{path} holds no requests")
+    # Offset of each request from the first, with idle gaps longer than max_gap shortened
+    offsets, previous, shift = [], records[0][0]["t"], 0.0
+    for header, _ in records:
+        gap = header["t"] - previous
+        if max_gap is not None and gap > max_gap:
+            shift += gap - max_gap
+        offsets.append(header["t"] - records[0][0]["t"] - shift)
+        previous = header["t"]
+    target = target.rstrip("/")
+
+    jobs: "queue.Queue[Optional[Tuple[int, float]]]" = queue.Queue()
+    results: List[Optional[Dict[str, Any]]] = [None] * len(records)
+    local = threading.local()
+
+    def worker() -> None:
+        local.session = requests.Session()
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            index, due = job
+            header, body = records[index]
+            url = target + header["path"] + (f"?{header['query']}" if header.get("query") else "")
+            sent = time.perf_counter()
+            result: Dict[str, Any] = {"lag_ms": (sent - due) * 1000 if speed else 0.0}
+            try:
+                response = local.session.request(header.get("method", "POST"), url, data=body,
+                                                 headers=dict(header.get("headers", [])), timeout=timeout)
+                result["status"] = response.status_code
+            except requests.RequestException as e:
+                result["error"] = type(e).__name__
+            result["ack_ms"] = (time.perf_counter() - sent) * 1000
+            results[index] = result
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    for index, offset in enumerate(offsets):
+        due = start + offset / speed if speed else start
+        if speed:
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        jobs.put((index, due))
+    for _ in threads:
+        jobs.put(None)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    statuses: Dict[str, int] = {}
+    errors: Dict[str, int] = {}
+    changed: Dict[str, int] = {}
+    for (header, _), result in zip(records, results):
+        if "error" in result:
+            errors[result["error"]] = errors.get(result["error"], 0) + 1
+            continue
+        statuses[str(result["status"])] = statuses.get(str(result["status"]), 0) + 1
+        if header.get("status") is not None and header["status"] != result["status"]:
+            key = f"{header['status']}->{result['status']}"
+            changed[key] = changed.get(key, 0) + 1
+    original_span = offsets[-1]
+    return {
+        "target": target,
+        "speed": speed or "max",
+        "requests": len(records),
+        "elapsed_s": round(elapsed, 3),
+        "original_duration_s": round(original_span, 3),
+        "achieved_rps": round(len(records) / elapsed, 2) if elapsed else None,
+        "statuses": statuses,
+        "errors": errors,
+        "status_changed": changed,
+        "ack_ms": _percentiles([r["ack_ms"] for r in results if "error" not in r]),
+        "original_ack_ms": _percentiles([h["ack_ms"] for h, _ in records if h.get("ack_ms") is not None]),
+        # How late requests went out versus the scaled schedule (the replayer falling behind)
+        "send_lag_ms": _percentiles([r["lag_ms"] for r in results]) if speed else None,
+    }
+
+
+def _print_latency(label: str, stats: Optional[Dict[str, float]]) -> None:
+    if not stats:
+        print(f"   {label:<16} -")
+        return
+    print(f"   {label:<16} p50 {stats['p50']:8.2f}  p90 {stats['p90']:8.2f}  p99 {stats['p99']:8.2f}"
+          f"  max {stats['max']:8.2f} ms")
+
+
+def parse_speed(value: str) -> Optional[float]:
+    if value.lower() in ("max", "0", "inf"):
+        return None
+    try:
+        speed = float(value.lower().rstrip("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("speed must be a factor like 1, 10, 0.5 or 'max'")
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive")
+    return speed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and replay captured webhook traffic")
+    sub = parser.add_subparsers(dest="command", required=True)
+    info = sub.add_parser("info", help="Summarize a capture file")
+    info.add_argument("file")
+    info.add_argument("--json", action="store_true")
+    rep = sub.add_parser("replay", help="Resend a capture to a listener")
+    rep.add_argument("file")
+    rep.add_argument("--target", default="http://localhost:3000", help="Listener base URL (default: http://localhost:3000)")
+    rep.add_argument("--speed", type=parse_speed, default=1.0, help="Time scale: 1 (real time), 10 (10x faster) or max")
+    rep.add_argument("--concurrency", type=int, default=64, help="Max requests in flight (default: 64)")
+    rep.add_argument("--timeout", type=float, default=30.0, help="Per-request timeout in seconds (default: 30)")
+    rep.add_argument("--limit", type=int, help="Only replay the first N requests")
+    rep.add_argument("--max-gap", type=float, metavar="SECONDS",
+                     help="Shorten idle gaps longer than this (e.g. between capture sessions)")
+    rep.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.file):
+        print(f"❌ Capture file not found: {args.file}")
+        sys.exit(1)
+
+    try:
+        if args.command == "info":
+            summary = describe(args.file)
+        else:
+            summary = replay(args.file, args.target, args.speed, max(1, args.concurrency), args.timeout,
+                             args.limit, args.max_gap)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+
+    if args.command == "info":
+        print(f"📼 {args.file}: {summary['requests']} requests over {summary['duration_s']:.1f}s "
+              f"(mean {summary['mean_rps'] or 0:.1f}/s, peak {summary['peak_rps']}/s)")
+        print(f"   Payloads: {summary['payload_bytes']:,} bytes in a {summary['file_bytes']:,}-byte file")
+        print(f"   Statuses: {summary['statuses']}")
+        for path, count in list(summary["paths"].items())[:10]:
+            print(f"   {count:>7}  {path}")
+        _print_latency("ack (captured)", summary["ack_ms"])
+        return
+
+    speed = "as fast as possible" if summary["speed"] == "max" else f"{summary['speed']:g}x"
+    print(f"🔁 Replayed {summary['requests']} requests to {summary['target']} at {speed}")
+    print(f"   Took {summary['elapsed_s']:.2f}s (captured span {summary['original_duration_s']:.2f}s), "
+          f"{summary['achieved_rps'] or 0:.1f} req/s")
+    print(f"   Statuses: {summary['statuses']}")
+    if summary["errors"]:
+        print(f"   ❌ Transport errors: {summary['errors']}")
+    if summary["status_changed"]:
+        print(f"   ⚠️  Status differs from capture: {summary['status_changed']}")
+    _print_latency("ack (replay)", summary["ack_ms"])
+    _print_latency("ack (captured)", summary["original_ack_ms"])
+    if summary["send_lag_ms"]:
+        _print_latency("send lag", summary["send_lag_ms"])
+    sys.exit(1 if summary["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,808 @@
+#!/usr/bin/env python3
+"""
+Clustered listener mode: several listeners behind one load balancer.
+
+Every listener started with --cluster STORE_DB appends the events it receives
+to a shared SQLite event log and acks as soon as the row is committed.
+Redeliveries are dropped there: an event whose canonical JSON was already
+logged (within --cluster-retention) is acked without being stored again.
+
+Each run_id belongs to one node, picked by consistent hashing over the live
+nodes (each node heartbeats into the store; --node-id defaults to host-port).
+Only the owner takes a run's events out of the log, oldest first and one at a
+time, and does what a single listener does on arrival: routing, history,
+stats, run queue release, tracing. So per-run ordering holds across the
+cluster, whichever node the load balancer picked.
+
+  node A receives RUN_FINISHED for run r1 -> log row 42, ack
+  owner(r1) = node C -> C claims row 42 once rows < 42 of r1 are done -> handle -> done
+
+Claims are conditional updates in the store, so an event is handled once even
+while two nodes briefly disagree about membership. Every node is placed on the
+ring at many points, so when a node joins or leaves only about 1/N of the runs
+change owner. A node that stops cleanly leaves the ring at once; one that dies
+is dropped after --cluster-ttl seconds without a heartbeat, and an event it
+had claimed but not finished is handled again by the new owner: that one
+event is delivered at least once, all others exactly once.
+
+/history and /stats on any node read the shared store: the event log, and the
+sum of the rollups every node publishes with its heartbeat.
+
+The store is one SQLite file in WAL mode, like run_queue.py, so the nodes must
+share a host or a local volume (SQLite locking is not reliable over NFS).
+
+Usage:
+  python webhook_listener.py --port 3001 --cluster /var/lib/mosaic/cluster.db
+  python webhook_listener.py --port 3002 --cluster /var/lib/mosaic/cluster.db
+  python cluster.py --db /var/lib/mosaic/cluster.db status
+  python cluster.py --db /var/lib/mosaic/cluster.db owner RUN_ID
+  python cluster.py ring --nodes a,b,c --keys 100000   # runs moved by adding/removing a node
+  python cluster.py check --nodes 3                    # verify with local node processes
+
+Environment:
+  MOSAIC_CLUSTER_STORE=/var/lib/mosaic/cluster.db   # store file (default: ~/.mosaic/listener_cluster.db)
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+VNODES = 128
+HEARTBEAT = 1.0
+DEFAULT_TTL = 5.0
+POLL_INTERVAL = 0.05
+MAX_ATTEMPTS = 5
+DEFAULT_RETENTION_HOURS = 24.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq          INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedup_key    TEXT NOT NULL UNIQUE,
+    run_key      TEXT NOT NULL,
+    run_id       TEXT,
+    flag         TEXT,
+    path         TEXT NOT NULL,
+    token        TEXT,
+    secret       TEXT,
+    body         BLOB NOT NULL,
+    received_at  REAL NOT NULL,
+    received_ns  INTEGER NOT NULL,
+    received_by  TEXT NOT NULL,
+    state        TEXT NOT NULL DEFAULT 'pending',
+    claimed_by   TEXT,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    not_before   REAL NOT NULL DEFAULT 0,
+    processed_by TEXT,
+    processed_at REAL,
+    error        TEXT
+);
+-- Only the unfinished tail is scanned by the owners
+CREATE INDEX IF NOT EXISTS events_pending ON events (run_key, seq) WHERE state = 'pending';
+CREATE INDEX IF NOT EXISTS events_processed ON events (processed_at) WHERE state != 'pending';
+CREATE INDEX IF NOT EXISTS events_run ON events (run_id, flag);
+CREATE TABLE IF NOT EXISTS nodes (
+    node_id      TEXT PRIMARY KEY,
+    host         TEXT,
+    pid          INTEGER,
+    started_at   REAL NOT NULL,
+    heartbeat_at REAL NOT NULL,
+    left_at      REAL,
+    counters     TEXT NOT NULL DEFAULT '{}',
+    stats        TEXT
+);
+"""
+
+
+class ClusterError(Exception):
+    """The node can't join the cluster (e.g. its node id is held by a live node)."""
+
+
+def default_path() -> str:
+    return (os.environ.get("MOSAIC_CLUSTER_STORE")
+            or os.path.join(os.path.expanduser("~"), ".mosaic", "listener_cluster.db"))
+
+
+def default_node_id(port: int) -> str:
+    return f"{socket.gethostname()}-{port}"
+
+
+def dedup_key(data: Any) -> str:
+    """Same event, same key, however the sender spaced or ordered the JSON."""
+    canonical = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring with `vnodes` points per node."""
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = VNODES):
+        self.vnodes = vnodes
+        self.nodes = tuple(sorted(set(nodes)))
+        points = sorted((_point(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self.points = [p for p, _ in points]
+        self.owners = [n for _, n in points]
+
+    def owner(self, key: str) -> Optional[str]:
+        if not self.points:
+            return None
+        index = bisect.bisect(self.points, _point(key)) % len(self.points)
+        return self.owners[index]
+
+    def shares(self) -> Dict[str, float]:
+        """Fraction of the key space each node owns."""
+        shares = {node: 0.0 for node in self.nodes}
+        span = 2 ** 64
+        for index, node in enumerate(self.owners):
+            # Point i owns the arc (point i-1, point i]
+            previous = self.points[index - 1] if index else self.points[-1] - span
+            shares[node] += (self.points[index] - previous) / span
+        return shares
+
+
+class ClusterEvent:
+    """One logged event, handed to the owner's handler."""
+
+    __slots__ = ("seq", "run_id", "path", "token", "secret", "raw", "received_ns", "attempts")
+
+    def __init__(self, row: sqlite3.Row):
+        self.seq = row["seq"]
+        self.run_id = row["run_id"]
+        self.path = row["path"]
+        self.token = row["token"]
+        self.secret = row["secret"]
+        self.raw = bytes(row["body"])
+        self.received_ns = row["received_ns"]
+        self.attempts = row["attempts"]
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        return json.loads(self.raw)
+
+
+class _Closing:
+    """sqlite3 connections don't close on `with`; this one does."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None and self.conn.in_transaction:
+            self.conn.execute("ROLLBACK")
+        self.conn.close()
+
+
+class ClusterStore:
+    """
+    The shared store file. Every call opens its own short-lived connection,
+    so one instance serves the request threads, the owner worker and the heartbeat.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or default_path()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> _Closing:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        # A committed event survives the listener crashing (not a power cut); enough to ack on
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return _Closing(conn)
+
+    # --- membership ------------------------------------------------------
+
+    def join(self, node_id: str, ttl: float) -> Dict[str, Any]:
+        """Register a node; returns what its previous incarnation published (counters, stats)."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT * FROM nodes WHERE node_id = ?", (node_id,)).fetchone()
+            if row is not None and row["left_at"] is None and row["heartbeat_at"] > now - ttl:
+                conn.execute("ROLLBACK")
+                raise ClusterError(f"node id {node_id} is in use by a running listener "
+                                   f"(pid {row['pid']} on {row['host']}); pick another --node-id")
+            conn.execute(
+                "INSERT INTO nodes (node_id, host, pid, started_at, heartbeat_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (node_id) DO UPDATE SET host = excluded.host, pid = excluded.pid, "
+                "started_at = excluded.started_at, heartbeat_at = excluded.heartbeat_at, left_at = NULL",
+                (node_id, socket.gethostname(), os.getpid(), now, now),
+            )
+            # Claims left by this node's previous run were interrupted
+            conn.execute("UPDATE events SET claimed_by = NULL WHERE claimed_by = ? AND state = 'pending'",
+                         (node_id,))
+            conn.execute("COMMIT")
+        if row is None:
+            return {"counters": {}, "stats": None}
+        return {"counters": json.loads(row["counters"] or "{}"),
+                "stats": json.loads(row["stats"]) if row["stats"] else None}
+
+    def heartbeat(self, node_id: str, counters: Dict[str, int], stats: Optional[Dict[str, Any]]) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE nodes SET heartbeat_at = ?, counters = ?, stats = ? WHERE node_id = ?",
+                         (time.time(), json.dumps(counters), json.dumps(stats) if stats else None, node_id))
+
+    def leave(self, node_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE nodes SET left_at = ? WHERE node_id = ?", (time.time(), node_id))
+            conn.execute("UPDATE events SET claimed_by = NULL WHERE claimed_by = ? AND state = 'pending'",
+                         (node_id,))
+            conn.execute("COMMIT")
+
+    def live_nodes(self, ttl: float) -> List[str]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT node_id FROM nodes WHERE left_at IS NULL AND heartbeat_at >= ?",
+                                (time.time() - ttl,)).fetchall()
+        return [row["node_id"] for row in rows]
+
+    def nodes(self) -> List[Dict[str, Any]]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM nodes ORDER BY node_id").fetchall()
+        return [dict(row, counters=json.loads(row["counters"] or "{}"),
+                     stats=json.loads(row["stats"]) if row["stats"] else None) for row in rows]
+
+    # --- event log -------------------------------------------------------
+
+    def append(self, raw: bytes, data: Any, received_by: str, path: str = "", token: Optional[str] = None,
+               secret: Optional[str] = None, received_ns: Optional[int] = None) -> Tuple[Optional[int], str]:
+        """Log an event; returns (seq, run_key), seq None for a duplicate."""
+        key = dedup_key(data)
+        run_id = data.get("run_id") if isinstance(data, dict) else None
+        flag = data.get("flag") if isinstance(data, dict) else None
+        run_key = str(run_id) if run_id else f"event:{key}"
+        received_ns = time.time_ns() if received_ns is None else received_ns
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO events (dedup_key, run_key, run_id, flag, path, token, secret, body, "
+                "received_at, received_ns, received_by) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, run_key, run_id, flag, path, token, secret, bytes(raw), received_ns / 1e9, received_ns,
+                 received_by),
+            )
+            return (cur.lastrowid if cur.rowcount else None), run_key
+
+    def heads(self, limit: int, after_seq: int = 0) -> List[sqlite3.Row]:
+        """The oldest unfinished event of each run that is due, oldest first, from seq > after_seq."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT seq, run_key, claimed_by FROM events e WHERE state = 'pending' AND seq > ? "
+                "AND not_before <= ? AND NOT EXISTS (SELECT 1 FROM events p WHERE p.state = 'pending' "
+                "AND p.run_key = e.run_key AND p.seq < e.seq) ORDER BY seq LIMIT ?",
+                (after_seq, time.time(), limit),
+            ).fetchall()
+
+    def claim(self, node_id: str, picks: List[Tuple[int, Optional[str]]]) -> List[ClusterEvent]:
+        """Claim (seq, expected current claimant) pairs in one transaction; returns the ones won."""
+        won = []
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for seq, holder in picks:
+                cur = conn.execute("UPDATE events SET claimed_by = ?, attempts = attempts + 1 "
+                                   "WHERE seq = ? AND state = 'pending' AND claimed_by IS ?", (node_id, seq, holder))
+                if cur.rowcount:
+                    won.append(seq)
+            rows = conn.execute(f"SELECT * FROM events WHERE seq IN ({','.join('?' * len(won))}) ORDER BY seq",
+                                won).fetchall() if won else []
+            conn.execute("COMMIT")
+        return [ClusterEvent(row) for row in rows]
+
+    def finish(self, seq: int, node_id: str, state: str = "processed", error: Optional[str] = None) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE events SET state = ?, processed_by = ?, processed_at = ?, claimed_by = NULL, "
+                         "error = ? WHERE seq = ?", (state, node_id, time.time(), error, seq))
+
+    def defer(self, seq: int, delay: float, error: Optional[str] = None) -> None:
+        """Give a claimed event back, to be taken again after `delay` (its run waits too)."""
+        with self._connect() as conn:
+            conn.execute("UPDATE events SET claimed_by = NULL, not_before = ?, error = ? WHERE seq = ?",
+                         (time.time() + delay, error, seq))
+
+    def prune(self, max_age: float) -> int:
+        """Forget finished events (and so their dedup keys) older than max_age seconds."""
+        with self._connect() as conn:
+            cur = conn.execute("DELETE FROM events WHERE state != 'pending' AND processed_at < ?",
+                               (time.time() - max_age,))
+            return cur.rowcount
+
+    def finished_event(self, run_id: str) -> Optional[Dict[str, Any]]:
+        """The run's RUN_FINISHED payload, whichever node received it."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT body FROM events WHERE run_id = ? AND flag = 'RUN_FINISHED' "
+                               "ORDER BY seq DESC LIMIT 1", (run_id,)).fetchone()
+        return json.loads(bytes(row["body"])) if row else None
+
+    def counts(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            counts = {row["state"]: row["n"] for row in
+                      conn.execute("SELECT state, COUNT(*) AS n FROM events GROUP BY state")}
+            counts["claimed"] = conn.execute("SELECT COUNT(*) FROM events WHERE state = 'pending' "
+                                             "AND claimed_by IS NOT NULL").fetchone()[0]
+        return counts
+
+    def latest(self, limit: int = 10, include_secret: bool = False) -> List[Dict[str, Any]]:
+        """The newest `limit` events, oldest first, in the PayloadStore.latest() format."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM events ORDER BY seq DESC LIMIT ?", (max(0, limit),)).fetchall()
+        entries = []
+        for row in reversed(rows):
+            try:
+                data = json.loads(bytes(row["body"]))
+            except ValueError:
+                data = bytes(row["body"]).decode("utf-8", errors="replace")
+            entry = {
+                "timestamp": datetime.fromtimestamp(row["received_at"], timezone.utc).isoformat(),
+                "path": row["path"],
+                "token": row["token"],
+                "seq": row["seq"],
+                "received_by": row["received_by"],
+                "state": row["state"],
+                "processed_by": row["processed_by"],
+            }
+            if include_secret:
+                entry["webhook_secret"] = row["secret"]
+            entry["data"] = data
+            entries.append(entry)
+        return entries
+
+
+class ListenerCluster:
+    """
+    This listener's membership: heartbeat, ring view, and the owner worker
+    that feeds logged events for the runs it owns to `handler`.
+
+    handler(event) returns True once the event is handled, False to have it
+    offered again a second later (e.g. its route's queue is full); an
+    exception is retried with backoff and the event is marked failed after
+    MAX_ATTEMPTS.
+    """
+
+    def __init__(self, store: ClusterStore, node_id: str, handler: Callable[[ClusterEvent], bool],
+                 stats=None, ttl: float = DEFAULT_TTL, retention_hours: float = DEFAULT_RETENTION_HOURS):
+        self.store = store
+        self.node_id = node_id
+        self.handler = handler
+        self.stats = stats  # event_stats.RollupStats published for /stats, or None
+        self.ttl = ttl
+        self.retention = retention_hours * 3600
+        self.ring = HashRing([node_id])
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.threads: List[threading.Thread] = []
+        self.counters = {"received": 0, "duplicates": 0, "processed": 0, "deferred": 0, "retried": 0,
+                         "failed": 0, "taken_over": 0}
+
+    def start(self) -> None:
+        previous = self.store.join(self.node_id, self.ttl)
+        for name, value in previous["counters"].items():
+            if name in self.counters:
+                self.counters[name] += value
+        if self.stats is not None and previous["stats"]:
+            # A restart with the same node id keeps its share of the cluster rollups
+            self.stats.absorb({k: v for k, v in previous["stats"].items() if k != "open_runs"})
+        self._refresh()
+        for target in (self._heartbeat_loop, self._work_loop):
+            thread = threading.Thread(target=target, name=f"cluster-{target.__name__.strip('_')}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self) -> None:
+        """Leave the ring now instead of after the ttl; claimed events go back to the log."""
+        if self.stopping.is_set():
+            return
+        self.stopping.set()
+        self.wakeup.set()
+        for thread in self.threads:
+            thread.join(timeout=10)
+        self._publish()
+        self.store.leave(self.node_id)
+
+    # --- ingestion (request threads) -------------------------------------
+
+    def append(self, raw: bytes, data: Any, path: str = "", token: Optional[str] = None,
+               secret: Optional[str] = None, received_ns: Optional[int] = None) -> Tuple[Optional[int], str]:
+        """Log an event for its owner; returns (seq or None if a duplicate, owner node)."""
+        seq, run_key = self.store.append(raw, data, self.node_id, path, token, secret, received_ns)
+        owner = self.owner(run_key)
+        self._count("received" if seq else "duplicates")
+        if seq and owner == self.node_id:
+            self.wakeup.set()
+        return seq, owner
+
+    def owner(self, run_key: str) -> Optional[str]:
+        with self.lock:
+            return self.ring.owner(run_key)
+
+    # --- background ------------------------------------------------------
+
+    def _refresh(self) -> None:
+        nodes = set(self.store.live_nodes(self.ttl)) | {self.node_id}
+        with self.lock:
+            if nodes != set(self.ring.nodes):
+                logger.info(f"Cluster membership: {', '.join(sorted(nodes))}")
+                self.ring = HashRing(nodes)
+        # Runs may have moved to us
+        self.wakeup.set()
+
+    def _publish(self) -> None:
+        with self.lock:
+            counters = dict(self.counters)
+        stats = None
+        if self.stats is not None:
+            stats = self.stats.state()
+            stats["open_runs"] = len(self.stats.open_runs)
+        self.store.heartbeat(self.node_id, counters, stats)
+
+    def _heartbeat_loop(self) -> None:
+        last_prune = 0.0
+        while not self.stopping.wait(HEARTBEAT):
+            try:
+                self._publish()
+                self._refresh()
+                if time.monotonic() - last_prune > 60:
+                    last_prune = time.monotonic()
+                    self.store.prune(self.retention)
+            except sqlite3.Error as e:
+                logger.warning(f"Cluster heartbeat failed: {e}")
+
+    def _work_loop(self) -> None:
+        while not self.stopping.is_set():
+            try:
+                handled = self._work_once()
+            except sqlite3.Error as e:
+                logger.warning(f"Cluster store unavailable: {e}")
+                handled = 0
+            if not handled:
+                self.wakeup.wait(POLL_INTERVAL)
+                self.wakeup.clear()
+
+    def _work_once(self, limit: int = 200) -> int:
+        with self.lock:
+            ring = self.ring
+        picks = []
+        alive = None
+        after_seq = 0
+        # Page past other nodes' heads: a backlog owned by one node must not hide ours
+        while len(picks) < limit:
+            rows = self.store.heads(limit, after_seq)
+            for row in rows:
+                if ring.owner(row["run_key"]) != self.node_id:
+                    continue
+                holder = row["claimed_by"]
+                if holder is not None:
+                    # Judged by heartbeat, not by our ring view, which may not show a node that just joined
+                    alive = set(self.store.live_nodes(self.ttl)) if alive is None else alive
+                    if holder in alive:
+                        continue  # the previous owner is still on it; the run follows once it's done
+                picks.append((row["seq"], holder))
+                if len(picks) == limit:
+                    break
+            if len(rows) < limit:
+                break
+            after_seq = rows[-1]["seq"]
+        if not picks:
+            return 0
+        events = self.store.claim(self.node_id, picks)
+        taken_over = sum(1 for _, holder in picks if holder is not None)
+        if taken_over:
+            self._count("taken_over", taken_over)
+        for event in events:
+            if self.stopping.is_set():
+                self.store.defer(event.seq, 0)
+                continue
+            self._handle(event)
+        return len(events)
+
+    def _handle(self, event: ClusterEvent) -> None:
+        try:
+            handled = self.handler(event)
+        except Exception as e:
+            logger.exception(f"Cluster event {event.seq} (run {event.run_id}) failed")
+            if event.attempts >= MAX_ATTEMPTS:
+                self.store.finish(event.seq, self.node_id, "failed", f"{type(e).__name__}: {e}")
+                self._count("failed")
+            else:
+                self.store.defer(event.seq, min(60.0, 2 ** event.attempts), f"{type(e).__name__}: {e}")
+                self._count("retried")
+            return
+        if handled:
+            self.store.finish(event.seq, self.node_id)
+            self._count("processed")
+        else:
+            self.store.defer(event.seq, 1.0, "handler busy")
+            self._count("deferred")
+
+    def _count(self, name: str, amount: int = 1) -> None:
+        with self.lock:
+            self.counters[name] += amount
+
+    # --- reporting -------------------------------------------------------
+
+    def merged_stats(self) -> Dict[str, Any]:
+        """The /stats rollup summed over every node that ever published one."""
+        from event_stats import RollupStats
+
+        merged = RollupStats()
+        open_runs = 0
+        for node in self.store.nodes():
+            if node["node_id"] == self.node_id and self.stats is not None:
+                state = self.stats.state()
+                state["open_runs"] = len(self.stats.open_runs)
+            else:
+                state = node["stats"]
+            if state:
+                merged.absorb(state)
+                open_runs += state.get("open_runs", 0)
+        snapshot = merged.snapshot()
+        snapshot["runs_open"] = open_runs
+        return snapshot
+
+    def snapshot(self, run_id: Optional[str] = None) -> Dict[str, Any]:
+        with self.lock:
+            ring = self.ring
+            counters = dict(self.counters)
+        shares = ring.shares()
+        now = time.time()
+        nodes = []
+        for node in self.store.nodes():
+            live = node["node_id"] in shares
+            nodes.append({
+                "node_id": node["node_id"],
+                "state": "live" if live else ("left" if node["left_at"] else "lost"),
+                "host": node["host"],
+                "pid": node["pid"],
+                "heartbeat_age_s": round(now - node["heartbeat_at"], 1),
+                "ring_share": round(shares.get(node["node_id"], 0.0), 4),
+                "counters": counters if node["node_id"] == self.node_id else node["counters"],
+            })
+        result = {
+            "node_id": self.node_id,
+            "store": self.store.path,
+            "ttl_s": self.ttl,
+            "vnodes": ring.vnodes,
+            "events": self.store.counts(),
+            "nodes": nodes,
+        }
+        if run_id:
+            result["owner"] = {"run_id": run_id, "node_id": ring.owner(run_id)}
+        return result
+
+
+def movement(nodes: List[str], keys: int, vnodes: int = VNODES) -> Dict[str, Any]:
+    """Share of `keys` run ids that change owner when a node is added or removed."""
+    run_ids = [f"run-{i}" for i in range(keys)]
+    base = HashRing(nodes, vnodes)
+    owners = [base.owner(r) for r in run_ids]
+    counts = {node: 0 for node in nodes}
+    for owner in owners:
+        counts[owner] += 1
+    grown = HashRing(nodes + ["added-node"], vnodes)
+    shrunk = HashRing(nodes[1:], vnodes)
+    return {
+        "nodes": len(nodes),
+        "keys": keys,
+        "load_min_max": [min(counts.values()) / keys, max(counts.values()) / keys],
+        "moved_on_add": sum(grown.owner(r) != o for r, o in zip(run_ids, owners)) / keys,
+        "moved_on_remove": sum(shrunk.owner(r) != o for r, o in zip(run_ids, owners)) / keys,
+        "ideal": 1 / (len(nodes) + 1),
+    }
+
+
+
+def _check_node(db: str, node_id: str, out_path: str, delay: float, stop) -> None:
+    """One `check` node: handles its runs' events with `delay` each, then dumps what it handled."""
+    handled = []
+
+    def handler(event: ClusterEvent) -> bool:
+        time.sleep(delay)
+        data = event.data
+        handled.append([event.seq, data["run_id"], data["i"], time.time()])
+        return True
+
+    cluster = ListenerCluster(ClusterStore(db), node_id, handler)
+    cluster.start()
+    stop.wait()
+    cluster.stop()
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump(handled, f)
+
+
+def check(node_count: int, runs: int, events_per_run: int, backlog: int, delay: float,
+          scratch_dir: Optional[str] = None, timeout: float = 120.0) -> Dict[str, Any]:
+    """
+    Run `node_count` nodes as separate processes on a scratch store and verify
+    the cluster: every event handled once, by its run's owner, in per-run
+    order, and the other nodes not held up by one node's `backlog`.
+    """
+    import multiprocessing
+    import tempfile
+
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="mosaic-cluster-check-", dir=scratch_dir) as tmp:
+        db = os.path.join(tmp, "cluster.db")
+        store = ClusterStore(db)
+        node_ids = [f"check-{i}" for i in range(1, node_count + 1)]
+        ring = HashRing(node_ids)
+        stop = ctx.Event()
+        procs = [ctx.Process(target=_check_node, args=(db, node_id, os.path.join(tmp, f"{node_id}.json"),
+                                                       delay, stop), daemon=True)
+                 for node_id in node_ids]
+        for proc in procs:
+            proc.start()
+        deadline = time.monotonic() + timeout
+        while set(store.live_nodes(DEFAULT_TTL)) != set(node_ids):
+            if time.monotonic() > deadline:
+                raise ClusterError("check nodes did not join in time")
+            time.sleep(0.1)
+        # Let every node's ring catch up with the full membership
+        time.sleep(2 * HEARTBEAT)
+
+        hot = node_ids[0]
+        hot_runs = []
+        i = 0
+        while len(hot_runs) < backlog:
+            if ring.owner(f"hot-{i}") == hot:
+                hot_runs.append(f"hot-{i}")
+            i += 1
+        # The hot node's backlog goes in first, the spread runs after it
+        events = [(run_id, 0) for run_id in hot_runs]
+        events += [(f"run-{r}", n) for n in range(events_per_run) for r in range(runs)]
+        for run_id, n in events:
+            data = {"run_id": run_id, "i": n, "flag": "RUN_PROGRESS"}
+            store.append(json.dumps(data).encode("utf-8"), data, "check")
+        while store.counts().get("pending", 0):
+            if time.monotonic() > deadline:
+                break
+            time.sleep(0.1)
+        stop.set()
+        for proc in procs:
+            proc.join(timeout=30)
+
+        handled = {}
+        for node_id in node_ids:
+            path = os.path.join(tmp, f"{node_id}.json")
+            handled[node_id] = json.load(open(path, encoding="utf-8")) if os.path.exists(path) else []
+
+    problems = []
+    seen: Dict[int, int] = {}
+    by_run: Dict[str, List[Tuple[float, int]]] = {}
+    for node_id, rows in handled.items():
+        for seq, run_id, n, at in rows:
+            seen[seq] = seen.get(seq, 0) + 1
+            by_run.setdefault(run_id, []).append((at, n))
+            if ring.owner(run_id) != node_id:
+                problems.append(f"{run_id} handled by {node_id}, owner {ring.owner(run_id)}")
+    missing = len(events) - len(seen)
+    if missing:
+        problems.append(f"{missing} events never handled")
+    twice = sum(1 for count in seen.values() if count > 1)
+    if twice:
+        problems.append(f"{twice} events handled more than once")
+    for run_id, steps in by_run.items():
+        order = [n for _, n in sorted(steps)]
+        if order != sorted(order):
+            problems.append(f"{run_id} handled out of order: {order}")
+    # Starvation: the other nodes should be done well before the hot node is
+    hot_times = sorted(at for _, run_id, _, at in handled[hot] if run_id.startswith("hot-"))
+    other_done = max((at for node_id in node_ids[1:] for *_, at in handled[node_id]), default=None)
+    if hot_times and other_done is not None and other_done > hot_times[len(hot_times) // 2]:
+        problems.append(f"other nodes finished after half of {hot}'s backlog of {backlog}: they were starved")
+    return {
+        "nodes": node_count,
+        "events": len(events),
+        "handled": {node_id: len(rows) for node_id, rows in handled.items()},
+        "problems": problems,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect a clustered listener store")
+    parser.add_argument("--db", help="Store file (default: MOSAIC_CLUSTER_STORE or ~/.mosaic/listener_cluster.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    status = sub.add_parser("status", help="Nodes, ring shares and event counts")
+    status.add_argument("--ttl", type=float, default=DEFAULT_TTL)
+    status.add_argument("--json", action="store_true")
+
+    owner = sub.add_parser("owner", help="Which live node owns each run id")
+    owner.add_argument("run_ids", nargs="+")
+    owner.add_argument("--ttl", type=float, default=DEFAULT_TTL)
+
+    ring = sub.add_parser("ring", help="Simulate how many runs move when a node joins or leaves")
+    ring.add_argument("--nodes", default="node-1,node-2,node-3", help="Comma-separated node ids")
+    ring.add_argument("--keys", type=int, default=100_000)
+    ring.add_argument("--vnodes", type=int, default=VNODES)
+
+    check_parser = sub.add_parser("check", help="Run several local node processes on a scratch store and verify "
+                                                "once-only, per-run ordered handling and fair progress")
+    check_parser.add_argument("--nodes", type=int, default=3)
+    check_parser.add_argument("--runs", type=int, default=30, help="Runs spread over all nodes")
+    check_parser.add_argument("--events-per-run", type=int, default=5)
+    check_parser.add_argument("--backlog", type=int, default=600,
+                              help="Older single-event runs owned by the first node, queued ahead of the rest")
+    check_parser.add_argument("--delay", type=float, default=0.002, help="Seconds each handled event takes")
+    check_parser.add_argument("--dir", help="Where to put the scratch store (default: the system temp dir; "
+                                            "use a local disk or /dev/shm, a slow disk stalls heartbeats)")
+
+    args = parser.parse_args()
+
+    if args.command == "check":
+        if args.nodes < 2:
+            print("❌ --nodes needs to be at least 2")
+            sys.exit(1)
+        result = check(args.nodes, args.runs, args.events_per_run, args.backlog, args.delay, args.dir)
+        handled = ", ".join(f"{node} {count}" for node, count in result["handled"].items())
+        print(f"🧪 {result['nodes']} node processes, {result['events']} events: {handled}")
+        for problem in result["problems"][:20]:
+            print(f"   ❌ {problem}")
+        if len(result["problems"]) > 20:
+            print(f"   ... and {len(result['problems']) - 20} more")
+        if result["problems"]:
+            sys.exit(1)
+        print("   ✅ each event handled once, by its owner, in per-run order; no node starved")
+        return
+
+    if args.command == "ring":
+        nodes = [n.strip() for n in args.nodes.split(",") if n.strip()]
+        if len(nodes) < 2:
+            print("❌ --nodes needs at least two node ids")
+            sys.exit(1)
+        result = movement(nodes, args.keys, args.vnodes)
+        low, high = result["load_min_max"]
+        print(f"🔁 {len(nodes)} nodes, {args.vnodes} points each, {args.keys:,} runs")
+        print(f"   load per node:   {low:.1%} .. {high:.1%} (even: {1 / len(nodes):.1%})")
+        print(f"   add a node:      {result['moved_on_add']:.1%} of runs move (ideal {result['ideal']:.1%})")
+        print(f"   remove a node:   {result['moved_on_remove']:.1%} of runs move (ideal {1 / len(nodes):.1%})")
+        return
+
+    store = ClusterStore(args.db)
+    ring_now = HashRing(store.live_nodes(args.ttl))
+
+    if args.command == "owner":
+        if not ring_now.nodes:
+            print("⚠️  No live nodes")
+            sys.exit(1)
+        for run_id in args.run_ids:
+            print(f"{run_id} -> {ring_now.owner(run_id)}")
+        return
+
+    shares = ring_now.shares()
+    nodes = store.nodes()
+    counts = store.counts()
+    if args.json:
+        print(json.dumps({"store": store.path, "events": counts, "ring_share": shares, "nodes": nodes}, indent=2))
+        return
+    print(f"🧩 {store.path}: {len(shares)} live of {len(nodes)} nodes")
+    print("   events: " + "  ".join(f"{s} {counts.get(s, 0)}" for s in ("pending", "claimed", "processed", "failed")))
+    now = time.time()
+    for node in nodes:
+        c = node["counters"]
+        state = "live" if node["node_id"] in shares else ("left" if node["left_at"] else "lost")
+        print(f"   {node['node_id']:<24} {state:<5} share {shares.get(node['node_id'], 0):6.1%}  "
+              f"heartbeat {now - node['heartbeat_at']:6.1f}s ago  received {c.get('received', 0)}  "
+              f"processed {c.get('processed', 0)}  duplicates {c.get('duplicates', 0)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+Queue-backed console output for the webhook listeners.
+
+The listeners used to print a 30-line block per event on the request thread,
+and the api-call listener also printed the whole payload as indented JSON.
+That made terminal and log I/O the largest cost of handling a webhook.
+EventLog moves that work to a writer thread:
+
+  - event() and message() run on the request thread. They only apply the
+    per-flag sampling and rate limit and put the unrendered event on a
+    bounded queue. The writer thread renders everything queued so far and
+    writes it with one write and one flush.
+  - Formats: "pretty" is the listener's multi-line block. "line" prints one
+    key=value line per event and "json" one JSON object per line. "auto"
+    (the default) is pretty on a terminal and line otherwise, so no blocks
+    are rendered into log files.
+  - Full payloads are dumped only with payloads=True (--log-payloads).
+  - install_logging() sends logging records (the listener's, Flask's,
+    werkzeug's) through the same queue. They keep their stream and format,
+    or become JSON in json mode.
+
+If the writer falls behind, the queue fills and further events are skipped
+and counted instead of slowing the listener. Every 10 seconds the writer
+prints how many events were not shown and why.
+
+Usage (both listeners):
+  python webhook_listener.py --log-format json > events.jsonl
+  python webhook_listener.py --log-sample OUTPUTS_FINISHED=0.1 --log-rate 5
+  python webhook_listener.py --log-sample '*=0'     # no events, only log lines
+  python webhook_listener.py --log-payloads         # also dump every payload
+"""
+
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+FORMATS = ("auto", "pretty", "line", "json")
+DEFAULT_RATE = 20.0  # events shown per second per flag
+QUEUE_SIZE = 10_000
+BATCH = 1000  # items rendered per write
+REPORT_INTERVAL = 10.0
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# (data, path, token, secret) -> the multi-line block shown in pretty mode
+Renderer = Callable[[Dict[str, Any], Optional[str], Optional[str], Optional[str]], str]
+
+_REASONS = {"sampled_out": "sampled out", "rate_limited": "over the rate limit", "dropped": "writer behind"}
+
+
+def parse_samples(specs: Iterable[str]) -> Dict[str, float]:
+    """{"OUTPUTS_FINISHED": 0.1} from ["OUTPUTS_FINISHED=0.1", "RUN_STARTED=0.5,*=1"]."""
+    samples = {}
+    for spec in specs:
+        for part in spec.split(","):
+            if not part.strip():
+                continue
+            flag, _, value = part.partition("=")
+            try:
+                fraction = float(value)
+            except ValueError:
+                fraction = -1.0
+            if not flag.strip() or not 0 <= fraction <= 1:
+                raise ValueError(f"expected FLAG=FRACTION with a fraction from 0 to 1, got {part!r}")
+            samples[flag.strip().upper()] = fraction
+    return samples
+
+
+def _counts(data: Dict[str, Any]) -> Dict[str, int]:
+    counts = {}
+    for key, value in (("inputs", data.get("inputs")), ("outputs", data.get("outputs") or data.get("output"))):
+        if isinstance(value, list):
+            counts[key] = len(value)
+    return counts
+
+
+class _QueueLogHandler(logging.Handler):
+    """Puts records on the EventLog queue; the writer formats and writes them."""
+
+    def __init__(self, log: "EventLog", stream, formatter: logging.Formatter):
+        super().__init__()
+        self.log = log
+        self.stream = stream
+        self.setFormatter(formatter)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # Freeze what can change once the call returns: the arguments and the traceback
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatter.formatException(record.exc_info)
+        record.msg, record.args, record.exc_info = record.message, None, None
+        self.log._put(("record", record, self), None)
+
+
+class EventLog:
+    """Filters events on the calling thread; renders and writes them on one writer thread."""
+
+    def __init__(self, fmt: str = "auto", payloads: bool = False, samples: Optional[Dict[str, float]] = None,
+                 rate: float = DEFAULT_RATE, renderer: Optional[Renderer] = None, stream=None,
+                 queue_size: int = QUEUE_SIZE):
+        if fmt not in FORMATS:
+            raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+        self.format = fmt
+        self.payloads = payloads
+        self.samples = dict(samples or {})
+        self.default_fraction = self.samples.pop("*", None)
+        self.rate = rate
+        self.renderer = renderer
+        self.stream = stream  # None: sys.stdout at write time, so redirection is followed
+        self.queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.buckets: Dict[str, List[float]] = {}  # key -> [tokens, last refill]
+        self.skipped: Dict[str, Dict[str, int]] = {}  # reason -> key -> count since the last report
+        self.counters = {"queued": 0, "written": 0, "sampled_out": 0, "rate_limited": 0, "dropped": 0}
+        self.thread: Optional[threading.Thread] = None
+        self.last_report = time.monotonic()
+
+    # --- request thread --------------------------------------------------
+
+    def event(self, data: Dict[str, Any], path: Optional[str] = None, token: Optional[str] = None,
+              secret: Optional[str] = None) -> bool:
+        """Queue an event for display. False if it was sampled out, rate limited or dropped."""
+        flag = data.get("flag") or "UNKNOWN"
+        fraction = self.samples.get(flag, self.default_fraction)
+        if fraction is not None and not self._sampled(data, fraction):
+            self._skip("sampled_out", flag)
+            return False
+        if not self._allow(flag):
+            self._skip("rate_limited", flag)
+            return False
+        return self._put(("event", time.time(), data, path, token, secret), flag)
+
+    def message(self, text: str, key: Optional[str] = None, level: str = "INFO") -> bool:
+        """Queue a free-form line; with a key it shares that key's rate limit."""
+        if key is not None and not self._allow(key):
+            self._skip("rate_limited", key)
+            return False
+        return self._put(("message", time.time(), text, level), key)
+
+    def _sampled(self, data: Dict[str, Any], fraction: float) -> bool:
+        run_id = data.get("run_id")
+        if not run_id:
+            return random.random() < fraction
+        # Decided per run_id, so a run that is shown has all its events of this flag shown
+        return zlib.crc32(str(run_id).encode()) < fraction * 2 ** 32
+
+    def _allow(self, key: str) -> bool:
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [max(1.0, self.rate), now]
+            bucket[0] = min(max(1.0, self.rate), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                return False
+            bucket[0] -= 1
+            return True
+
+    def _skip(self, reason: str, key: Optional[str]) -> None:
+        with self.lock:
+            self.counters[reason] += 1
+            per_key = self.skipped.setdefault(reason, {})
+            per_key[key or "log"] = per_key.get(key or "log", 0) + 1
+
+    def _put(self, item: tuple, key: Optional[str]) -> bool:
+        if self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self._skip("dropped", key)
+            return False
+        self.counters["queued"] += 1
+        return True
+
+    # --- writer thread ---------------------------------------------------
+
+    def start(self) -> None:
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="event-log", daemon=True)
+                self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                items = [self.queue.get(timeout=REPORT_INTERVAL)]
+            except queue.Empty:
+                items = []
+            try:
+                while len(items) < BATCH:
+                    items.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            self._write(items)
+
+    def _write(self, items: List[tuple]) -> None:
+        stdout = self.stream or sys.stdout
+        fmt = self.format
+        if fmt == "auto":
+            isatty = getattr(stdout, "isatty", None)
+            fmt = "pretty" if isatty and isatty() else "line"
+        out: Dict[Any, List[str]] = {}
+        done: List[threading.Event] = []
+        for item in items:
+            kind = item[0]
+            if kind == "flush":
+                done.append(item[1])
+                continue
+            stream = item[2].stream if kind == "record" else stdout
+            try:
+                out.setdefault(stream, []).append(self._render(item, fmt))
+            except Exception as e:
+                out.setdefault(stream, []).append(f"⚠️  Could not render {kind}: {e}")
+        report = self._report(fmt, force=bool(done))
+        if report:
+            out.setdefault(stdout, []).append(report)
+        for stream, chunks in out.items():
+            try:
+                stream.write("\n".join(chunks) + "\n")
+                stream.flush()
+            except (OSError, ValueError):
+                pass  # closed or gone (a pipe reader exited): drop the output, keep the listener
+        self.counters["written"] += len(items) - len(done)
+        for event in done:
+            event.set()
+
+    def _render(self, item: tuple, fmt: str) -> str:
+        kind = item[0]
+        if kind == "record":
+            record, handler = item[1], item[2]
+            if fmt != "json":
+                return handler.formatter.format(record)
+            entry = {"ts": self._iso(record.created), "level": record.levelname, "logger": record.name,
+                     "message": record.message}
+            if record.exc_text:
+                entry["exception"] = record.exc_text
+            return json.dumps(entry, default=str)
+        if kind == "message":
+            _, ts, text, level = item
+            if fmt == "json":
+                return json.dumps({"ts": self._iso(ts), "level": level, "message": text.strip()}, default=str)
+            if fmt == "line":
+                return f"{self._time(ts)} | {level} | " + " ".join(text.split())
+            return text
+        _, ts, data, path, token, secret = item
+        if fmt == "json":
+            entry = {"ts": self._iso(ts), "level": "EVENT", "flag": data.get("flag") or "UNKNOWN"}
+            for key in ("run_id", "agent_id", "status"):
+                if data.get(key) is not None:
+                    entry[key] = data[key]
+            entry.update(_counts(data))
+            entry.update({key: value for key, value in (("path", path), ("token", token)) if value})
+            if self.payloads:
+                entry["payload"] = data
+            return json.dumps(entry, default=str)
+        if fmt == "pretty" and self.renderer is not None:
+            text = self.renderer(data, path, token, secret)
+        else:
+            fields = [data.get("flag") or "UNKNOWN"]
+            fields += [f"{key}={data[key]}" for key in ("run_id", "agent_id", "status") if data.get(key) is not None]
+            fields += [f"{key}={count}" for key, count in _counts(data).items()]
+            fields += [f"{key}={value}" for key, value in (("path", path), ("token", token)) if value]
+            text = f"{self._time(ts)} | EVENT | " + " ".join(fields)
+        if self.payloads:
+            text += "\n" + json.dumps(data, indent=2, default=str)
+        return text
+
+    def _report(self, fmt: str, force: bool = False) -> Optional[str]:
+        now = time.monotonic()
+        if not force and now - self.last_report < REPORT_INTERVAL:
+            return None
+        with self.lock:
+            skipped, self.skipped = self.skipped, {}
+            elapsed, self.last_report = now - self.last_report, now
+        if not skipped:
+            return None
+        if fmt == "json":
+            return json.dumps({"ts": self._iso(time.time()), "level": "WARNING",
+                               "message": "events not shown", "seconds": round(elapsed, 1), "skipped": skipped})
+        parts = [f"{count:,} {key}" + f" ({_REASONS[reason]})"
+                 for reason, per_key in skipped.items() for key, count in sorted(per_key.items())]
+        text = f"⏩ Not shown in the last {elapsed:.1f}s: " + ", ".join(parts)
+        return f"{self._time(time.time())} | WARNING | {text}" if fmt == "line" else text
+
+    @staticmethod
+    def _time(ts: float) -> str:
+        return datetime.fromtimestamp(ts).strftime(TIME_FORMAT)
+
+    @staticmethod
+    def _iso(ts: float) -> str:
+        return datetime.fromtimestamp(ts, timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+    # --- lifecycle -------------------------------------------------------
+
+    def install_logging(self) -> None:
+        """Route the root logger's records through the writer, keeping each handler's stream and format."""
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            if isinstance(handler, logging.StreamHandler) and not isinstance(handler, logging.FileHandler):
+                root.removeHandler(handler)
+                queued = _QueueLogHandler(self, handler.stream, handler.formatter or logging.Formatter())
+                queued.setLevel(handler.level)
+                root.addHandler(queued)
+
+    def flush(self, timeout: float = 2.0) -> bool:
+        """Wait until everything queued so far is written (and skip counts reported)."""
+        if self.thread is None:
+            return True
+        done = threading.Event()
+        try:
+            self.queue.put(("flush", done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            samples = dict(self.samples, **({"*": self.default_fraction} if self.default_fraction is not None else {}))
+            return {"format": self.format, "rate": self.rate, "samples": samples,
+                    "queue": self.queue.qsize(), **self.counters}
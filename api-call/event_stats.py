@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+Incremental rollup statistics over received webhook events.
+
+Every event updates a handful of counters once, so serving /stats never scans
+history: the cost of a query depends only on the number of distinct flags,
+agents and channels, not on how many events have been received.
+
+Tracked:
+  - event counts per flag, per agent and per YouTube channel (triggered_by.channel_id)
+  - runs completed / failed over the last 1m, 5m, 1h and 24h (per-minute ring buckets)
+  - RUN_STARTED -> RUN_FINISHED duration distribution (log2 histogram + min/max/mean)
+
+state() returns the counters in a JSON-safe form and absorb() adds such a
+state into another instance, so listeners in a cluster (see cluster.py) can
+publish their rollups to the shared store and serve the sum of all of them.
+"""
+
+import math
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+
+WINDOWS_MINUTES = {"1m": 1, "5m": 5, "1h": 60, "24h": 1440}
+
+# Runs whose RUN_STARTED we've seen but RUN_FINISHED we haven't
+MAX_OPEN_RUNS = 100_000
+
+
+class WindowCounter:
+    """Counts events over sliding windows using one bucket per minute."""
+
+    def __init__(self, horizon_minutes: int = 1440):
+        self.horizon = horizon_minutes
+        self.buckets = [0] * horizon_minutes
+        self.current_minute = int(time.time() // 60)
+        self.sums = {name: 0 for name in WINDOWS_MINUTES}
+
+    def _advance(self, minute: int) -> None:
+        # Each elapsed minute is visited once, so the cost is amortized O(1)
+        steps = min(minute - self.current_minute, self.horizon)
+        for step in range(1, steps + 1):
+            new_minute = self.current_minute + step
+            # Buckets leaving each window as this minute begins
+            for name, span in WINDOWS_MINUTES.items():
+                self.sums[name] -= self.buckets[(new_minute - span) % self.horizon]
+            self.buckets[new_minute % self.horizon] = 0
+        if minute - self.current_minute > self.horizon:
+            self.buckets = [0] * self.horizon
+            self.sums = {name: 0 for name in WINDOWS_MINUTES}
+        self.current_minute = max(self.current_minute, minute)
+
+    def add(self, now: float, amount: int = 1) -> None:
+        minute = int(now // 60)
+        self._advance(minute)
+        self.buckets[minute % self.horizon] += amount
+        for name in self.sums:
+            self.sums[name] += amount
+
+    def totals(self, now: float) -> Dict[str, int]:
+        self._advance(int(now // 60))
+        return dict(self.sums)
+
+    def minutes(self) -> Dict[int, int]:
+        """Non-empty buckets still inside the horizon, keyed by minute."""
+        current = self.current_minute
+        return {minute: self.buckets[minute % self.horizon]
+                for minute in range(current - self.horizon + 1, current + 1)
+                if self.buckets[minute % self.horizon]}
+
+    def add_minutes(self, minutes: Dict[int, int], now: float) -> None:
+        """Add counts recorded elsewhere; minutes outside a window only count toward the wider ones."""
+        self._advance(int(now // 60))
+        current = self.current_minute
+        for minute, amount in minutes.items():
+            minute = int(minute)
+            age = current - minute
+            if not 0 <= age < self.horizon:
+                continue
+            self.buckets[minute % self.horizon] += amount
+            for name, span in WINDOWS_MINUTES.items():
+                if age < span:
+                    self.sums[name] += amount
+
+
+class DurationHistogram:
+    """Log2-bucketed histogram of durations in seconds."""
+
+    BUCKETS = 20  # upper bounds 1s, 2s, 4s ... 2^19s (~6 days); last bucket is open-ended
+
+    def __init__(self):
+        self.counts = [0] * self.BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, seconds: float) -> None:
+        seconds = max(0.0, seconds)
+        index = 0 if seconds <= 1 else min(self.BUCKETS - 1, math.ceil(math.log2(seconds)))
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """Upper bound of the bucket holding the percentile (clamped to the observed max)."""
+        if not self.count:
+            return None
+        target = self.count * pct / 100
+        seen = 0
+        for index, bucket in enumerate(self.counts):
+            seen += bucket
+            if seen >= target:
+                return min(float(2 ** index), self.max)
+        return self.max
+
+    def absorb(self, counts: List[int], total: float, low: Optional[float], high: Optional[float]) -> None:
+        for index, n in enumerate(counts[:self.BUCKETS]):
+            self.counts[index] += n
+            self.count += n
+        self.total += total
+        if low is not None:
+            self.min = low if self.min is None else min(self.min, low)
+        if high is not None:
+            self.max = high if self.max is None else max(self.max, high)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean_s": round(self.total / self.count, 3) if self.count else None,
+            "min_s": self.min,
+            "max_s": self.max,
+            "p50_s": self.percentile(50),
+            "p90_s": self.percentile(90),
+            "p99_s": self.percentile(99),
+            "histogram": {
+                (f"<={2 ** i}s" if i < self.BUCKETS - 1 else f">{2 ** (i - 1)}s"): n
+                for i, n in enumerate(self.counts) if n
+            },
+        }
+
+
+class RollupStats:
+    """Thread-safe aggregates updated once per webhook event."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.total = 0
+        self.by_flag: Counter = Counter()
+        self.by_agent: Counter = Counter()
+        self.by_channel: Counter = Counter()
+        self.completed = WindowCounter()
+        self.failed = WindowCounter()
+        self.durations = DurationHistogram()
+        self.open_runs: Dict[str, float] = {}
+
+    def record(self, data: Dict[str, Any], now: Optional[float] = None) -> None:
+        now = time.time() if now is None else now
+        flag = data.get("flag") or "UNKNOWN"
+        run_id = data.get("run_id")
+        triggered_by = data.get("triggered_by") or {}
+        channel_id = triggered_by.get("channel_id") or (triggered_by.get("youtube") or {}).get("channel_id")
+
+        with self.lock:
+            self.total += 1
+            self.by_flag[flag] += 1
+            if data.get("agent_id"):
+                self.by_agent[data["agent_id"]] += 1
+            if channel_id:
+                self.by_channel[channel_id] += 1
+
+            if flag == "RUN_STARTED" and run_id:
+                if len(self.open_runs) >= MAX_OPEN_RUNS:
+                    # Drop the oldest start we're still waiting on (dicts keep insertion order)
+                    self.open_runs.pop(next(iter(self.open_runs)))
+                self.open_runs[run_id] = now
+            elif flag == "RUN_FINISHED":
+                status = data.get("status")
+                if status == "completed":
+                    self.completed.add(now)
+                elif status == "failed":
+                    self.failed.add(now)
+                started = self.open_runs.pop(run_id, None) if run_id else None
+                if started is not None:
+                    self.durations.add(now - started)
+
+    def snapshot(self, now: Optional[float] = None) -> Dict[str, Any]:
+        now = time.time() if now is None else now
+        with self.lock:
+            return {
+                "since": self.started_at,
+                "events_total": self.total,
+                "events_by_flag": dict(self.by_flag),
+                "events_by_agent": dict(self.by_agent),
+                "events_by_channel": dict(self.by_channel),
+                "runs_completed": self.completed.totals(now),
+                "runs_failed": self.failed.totals(now),
+                "runs_open": len(self.open_runs),
+                "run_duration": self.durations.snapshot(),
+            }
+
+    def state(self) -> Dict[str, Any]:
+        """Counters as JSON-safe data for absorb(); open runs are left out."""
+        with self.lock:
+            return {
+                "since": self.started_at,
+                "total": self.total,
+                "by_flag": dict(self.by_flag),
+                "by_agent": dict(self.by_agent),
+                "by_channel": dict(self.by_channel),
+                "completed": {str(m): n for m, n in self.completed.minutes().items()},
+                "failed": {str(m): n for m, n in self.failed.minutes().items()},
+                "durations": {
+                    "counts": list(self.durations.counts),
+                    "total": self.durations.total,
+                    "min": self.durations.min,
+                    "max": self.durations.max,
+                },
+            }
+
+    def absorb(self, state: Dict[str, Any], now: Optional[float] = None) -> None:
+        """Add the counters of another instance's state()."""
+        now = time.time() if now is None else now
+        durations = state.get("durations") or {}
+        with self.lock:
+            self.started_at = min(self.started_at, state.get("since", self.started_at))
+            self.total += state.get("total", 0)
+            self.by_flag.update(state.get("by_flag") or {})
+            self.by_agent.update(state.get("by_agent") or {})
+            self.by_channel.update(state.get("by_channel") or {})
+            self.completed.add_minutes(state.get("completed") or {}, now)
+            self.failed.add_minutes(state.get("failed") or {}, now)
+            self.durations.absorb(durations.get("counts") or [], durations.get("total", 0.0),
+                                  durations.get("min"), durations.get("max"))
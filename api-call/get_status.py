@@ -4,17 +4,26 @@ Fetch or watch the status of a Mosaic agent run by run_id.
 
 Usage:
   python get_status.py --run-id RUN_ID [--watch] [--interval 5]
+  python get_status.py --run-id RUN_ID --watch --hedge [--hedge-percentile 95] [--hedge-budget 0.1]
+  python get_status.py --run-id RUN_ID --watch --profile status.profile.json
 """
 
 import argparse
 import json
 import os
 import sys
+import threading
 import time
-from typing import Optional
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Optional, Union
 
 import requests
 
+from profiling import add_profile_arguments, start_profiler
+from ratelimit import acquire
+from run_models import RunStatus
+
 
 DEFAULT_BASE_URL = "https://api.mosaic.so"
 
@@ -30,24 +39,120 @@ def resolve_api_key(explicit_key: Optional[str]) -> str:
     return api_key
 
 
-def fetch_status(base_url: str, headers: dict, run_id: str) -> dict:
-    resp = requests.get(f"{base_url}/agent_run/{run_id}", headers=headers, timeout=30)
+def request_status(session, base_url: str, headers: dict, run_id: str,
+                   compact: bool = False) -> Union[dict, RunStatus]:
+    """GET /agent_run/{run_id}; raises requests.HTTPError on an error response.
+
+    With `compact` the body is returned as a lazily decoded RunStatus instead of dicts.
+    """
+    acquire("status")
+    resp = session.get(f"{base_url}/agent_run/{run_id}", headers=headers, timeout=30)
+    resp.raise_for_status()
+    if compact:
+        return RunStatus.from_response(resp)
+    return resp.json()
+
+
+class HedgedStatusFetcher:
+    """
+    Status fetcher that hedges slow requests.
+
+    If the primary request hasn't answered within the tracked latency
+    percentile, a duplicate is sent on a second session (a separate connection
+    pool) and whichever succeeds first wins. Hedges are capped at `budget`
+    extra requests per request made, plus one so a fresh watcher can hedge.
+    """
+
+    def __init__(self, base_url: str, headers: dict, percentile: float = 95, budget: float = 0.1,
+                 initial_delay: float = 1.0, min_samples: int = 10, window: int = 200, compact: bool = False):
+        self.base_url = base_url
+        self.headers = headers
+        self.compact = compact
+        self.percentile = percentile
+        self.budget = budget
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.latencies = deque(maxlen=window)
+        self.sessions = (requests.Session(), requests.Session())
+        # Losing requests keep running in the background, so allow a few extra workers
+        self.pool = ThreadPoolExecutor(max_workers=4)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+
+    def hedge_delay(self) -> float:
+        with self.lock:
+            samples = sorted(self.latencies)
+        if len(samples) < self.min_samples:
+            return self.initial_delay
+        rank = min(len(samples) - 1, int(round((len(samples) - 1) * self.percentile / 100)))
+        return samples[rank]
+
+    def _timed(self, session, run_id: str) -> Union[dict, RunStatus]:
+        start = time.perf_counter()
+        data = request_status(session, self.base_url, self.headers, run_id, self.compact)
+        with self.lock:
+            self.latencies.append(time.perf_counter() - start)
+        return data
+
+    def fetch(self, run_id: str) -> Union[dict, RunStatus]:
+        """Like request_status, raising the first error only if every attempt fails."""
+        with self.lock:
+            self.requests += 1
+        primary = self.pool.submit(self._timed, self.sessions[0], run_id)
+        done, _ = wait([primary], timeout=self.hedge_delay())
+        if done:
+            return primary.result()
+
+        with self.lock:
+            allowed = self.hedges_fired < self.budget * self.requests + 1
+            if allowed:
+                self.hedges_fired += 1
+        if not allowed:
+            return primary.result()
+
+        hedge = self.pool.submit(self._timed, self.sessions[1], run_id)
+        pending = {primary, hedge}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self.lock:
+                            self.hedges_won += 1
+                    return future.result()
+                first_error = first_error or future.exception()
+        raise first_error
+
+    def summary(self) -> str:
+        return (f"⚡ Hedging: {self.hedges_fired}/{self.requests} requests hedged, "
+                f"{self.hedges_won} won by the hedge (next hedge after {self.hedge_delay():.2f}s)")
+
+
+def fetch_status(base_url: str, headers: dict, run_id: str, hedger: Optional[HedgedStatusFetcher] = None,
+                 compact: bool = False) -> Union[dict, RunStatus]:
     try:
-        resp.raise_for_status()
+        if hedger:
+            return hedger.fetch(run_id)
+        return request_status(requests, base_url, headers, run_id, compact)
     except requests.HTTPError as e:
-        print(f"❌ Failed to fetch status: {e}\n{resp.text}")
+        print(f"❌ Failed to fetch status: {e}\n{e.response.text}")
         sys.exit(1)
-    return resp.json()
 
 
-def print_summary(data: dict) -> None:
-    status = data.get("status")
+def print_summary(data: Union[dict, RunStatus]) -> None:
+    if isinstance(data, RunStatus):
+        # Only status and the output URLs are decoded; the rest of the body stays text
+        status, urls = data.status, data.output_urls()
+    else:
+        status = data.get("status")
+        urls = [out.get("video_url") or out.get("url") for out in data.get("outputs") or []]
     print(f"status {status}")
-    outputs = data.get("outputs") or []
-    if outputs:
-        print(f"outputs {len(outputs)}")
-        for idx, out in enumerate(outputs, 1):
-            url = out.get("video_url") or out.get("url")
+    if urls:
+        print(f"outputs {len(urls)}")
+        for idx, url in enumerate(urls, 1):
             if url:
                 print(f"  {idx}. {url}")
 
@@ -59,26 +164,50 @@ def main():
     parser.add_argument("--interval", type=int, default=5, help="Polling interval seconds")
     parser.add_argument("--api-key", help="Mosaic API key (or use MOSAIC_API_KEY env var)")
     parser.add_argument("--base-url", default=DEFAULT_BASE_URL)
+    parser.add_argument("--hedge", action="store_true",
+                        help="Send a duplicate request when the first is slower than usual")
+    parser.add_argument("--hedge-percentile", type=float, default=95,
+                        help="Latency percentile after which to hedge (default: 95)")
+    parser.add_argument("--hedge-budget", type=float, default=0.1,
+                        help="Max extra requests from hedging, as a fraction of requests (default: 0.1)")
+    parser.add_argument("--hedge-initial-delay", type=float, default=1.0,
+                        help="Hedge delay in seconds until enough latencies are tracked (default: 1.0)")
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    profiler = start_profiler("get_status", args.profile, args.profile_cprofile)
 
     api_key = resolve_api_key(args.api_key)
     headers = {"Authorization": f"Bearer {api_key}"}
+    hedger = None
+    if args.hedge:
+        if not 0 < args.hedge_percentile <= 100 or args.hedge_budget < 0:
+            print("❌ --hedge-percentile must be in (0, 100] and --hedge-budget >= 0")
+            sys.exit(1)
+        hedger = HedgedStatusFetcher(args.base_url, headers, args.hedge_percentile,
+                                     args.hedge_budget, args.hedge_initial_delay, compact=args.watch)
 
     if not args.watch:
-        data = fetch_status(args.base_url, headers, args.run_id)
+        with profiler.phase("fetch_status"):
+            data = fetch_status(args.base_url, headers, args.run_id, hedger)
         print(json.dumps(data, indent=2))
+        if hedger:
+            print(hedger.summary())
         return
 
     # watch mode
     print(f"👀 Watching run {args.run_id} (every {args.interval}s)...")
     while True:
-        data = fetch_status(args.base_url, headers, args.run_id)
+        with profiler.phase("fetch_status"):
+            data = fetch_status(args.base_url, headers, args.run_id, hedger, compact=True)
         print_summary(data)
-        if data.get("status") in ("completed", "failed"):
+        if data.status in ("completed", "failed"):
             print("\n📦 Full response:")
-            print(json.dumps(data, indent=2))
+            print(json.dumps(data.to_dict(), indent=2))
             break
-        time.sleep(args.interval)
+        with profiler.phase("poll_interval"):
+            time.sleep(args.interval)
+    if hedger:
+        print(hedger.summary())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Parallel multi-part upload for large files (used by upload_video.py).
+
+A single resumable session moves every byte over one TCP stream, so on a
+high-latency link a 3-5 GB master is capped by that one connection's window.
+When /videos/get_upload_url answers with several part URLs, the file is split
+into byte ranges that are uploaded concurrently and then assembled server-side:
+
+  request:  {..., "multipart": {"part_size": 67108864, "max_parts": 10000}}
+  response: {"video_id": "...", "part_method": "PUT", "part_size": 67108864,
+             "parts": [{"part_number": 1, "upload_url": "..."}, ...],
+             "complete_url": "..."}                       # optional
+
+Part n covers bytes [(n-1) * part_size, n * part_size) of the file (the last
+part is shorter). Each part is sent with its own request and retried on
+connection errors, 429 and 5xx; the ETag each part returns is collected. With
+a complete_url the assembly request is POST {"parts": [{"part_number", "etag"}]}
+(S3 CompleteMultipartUpload / GCS compose style); without one, the same list
+is sent with /videos/finalize_upload.
+
+A server that ignores the "multipart" hint returns a single upload_url, and
+upload_video.py falls back to the resumable single-stream upload.
+"""
+
+import random
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+DEFAULT_PART_SIZE = 64 * 1024 * 1024
+MIN_PART_SIZE = 5 * 1024 * 1024  # S3's floor for every part but the last
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+
+class MultipartError(Exception):
+    """The server's part plan is unusable, or a part failed after all its retries."""
+
+
+def parse_size(value: str) -> int:
+    """Parse a size such as '64M', '512k', '1G' or '1048576' into bytes."""
+    value = value.strip().lower().rstrip("b")
+    multipliers = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    if value and value[-1] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(value)
+
+
+def plan_parts(data: Dict[str, Any], file_size: int) -> Optional[List[Dict[str, Any]]]:
+    """
+    Turn a get_upload_url response into [{part_number, upload_url, offset, size}],
+    or None when the server offered a single upload URL. Raises MultipartError
+    when the parts can't cover the file.
+    """
+    parts = data.get("parts")
+    if not parts or len(parts) < 2:
+        return None
+    urls = []
+    for index, part in enumerate(parts, 1):
+        if isinstance(part, str):
+            urls.append((index, part))
+        elif isinstance(part, dict) and part.get("upload_url"):
+            urls.append((int(part.get("part_number", index)), part["upload_url"]))
+        else:
+            raise MultipartError(f"part {index} has no upload_url")
+    urls.sort()
+
+    part_size = int(data.get("part_size") or -(-file_size // len(urls)))
+    if part_size * len(urls) < file_size:
+        raise MultipartError(f"{len(urls)} parts of {part_size} bytes can't hold {file_size} bytes")
+    plan = []
+    for number, url in urls:
+        offset = (number - 1) * part_size
+        size = max(0, min(part_size, file_size - offset))
+        if size:
+            plan.append({"part_number": number, "upload_url": url, "offset": offset, "size": size})
+    return plan
+
+
+class Progress:
+    """Byte counter shared by the part workers, printed at most every `interval` seconds."""
+
+    def __init__(self, total: int, parts: int, interval: float = 1.0, out=sys.stdout):
+        self.total = total
+        self.parts = parts
+        self.interval = interval
+        self.out = out
+        self.tty = hasattr(out, "isatty") and out.isatty()
+        self.sent = 0
+        self.done_parts = 0
+        self.retries = 0
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.last_print = 0.0
+
+    def add(self, count: int) -> None:
+        with self.lock:
+            self.sent += count
+            now = time.monotonic()
+            if now - self.last_print < self.interval:
+                return
+            self.last_print = now
+        self.show()
+
+    def part_done(self) -> None:
+        with self.lock:
+            self.done_parts += 1
+
+    def retried(self, sent: int) -> None:
+        """A part is being resent: take back the bytes it already counted."""
+        with self.lock:
+            self.sent -= sent
+            self.retries += 1
+
+    def rate(self) -> float:
+        return self.sent / max(1e-9, time.monotonic() - self.started)
+
+    def line(self) -> str:
+        mb = 1024 * 1024
+        percent = 100 * self.sent / self.total if self.total else 100
+        return (f"   📦 {self.sent / mb:,.1f}/{self.total / mb:,.1f}MB ({percent:.0f}%) "
+                f"{self.rate() / mb:.1f}MB/s, parts {self.done_parts}/{self.parts}"
+                + (f", {self.retries} retried" if self.retries else ""))
+
+    def show(self, final: bool = False) -> None:
+        if self.tty:
+            self.out.write("\r" + self.line() + ("\n" if final else ""))
+            self.out.flush()
+        else:
+            print(self.line(), file=self.out, flush=True)
+
+
+class _FileRange:
+    """File-like view of [offset, offset + size) that reports what it has read."""
+
+    def __init__(self, path: str, offset: int, size: int, progress: Progress, block: int = 1024 * 1024):
+        self.file = open(path, "rb")
+        self.file.seek(offset)
+        self.remaining = size
+        self.size = size
+        self.progress = progress
+        self.block = block
+        self.read_bytes = 0
+
+    def __len__(self) -> int:
+        # requests uses this for Content-Length instead of falling back to chunked encoding
+        return self.size
+
+    def read(self, amount: int = -1) -> bytes:
+        if self.remaining <= 0:
+            return b""
+        if amount is None or amount < 0:
+            amount = self.remaining
+        data = self.file.read(min(amount, self.block, self.remaining))
+        self.remaining -= len(data)
+        self.read_bytes += len(data)
+        self.progress.add(len(data))
+        return data
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def upload_part(session, method: str, path: str, part: Dict[str, Any], content_type: str,
+                progress: Progress, retries: int, timeout: float) -> str:
+    """Send one byte range, retrying transient failures; returns the part's ETag (may be empty)."""
+    attempt = 0
+    while True:
+        body = _FileRange(path, part["offset"], part["size"], progress)
+        error: Optional[str] = None
+        try:
+            resp = session.request(method, part["upload_url"], data=body, timeout=timeout,
+                                   headers={"Content-Type": content_type})
+            if resp.status_code in (200, 201, 204):
+                progress.part_done()
+                return resp.headers.get("ETag", "").strip('"')
+            if resp.status_code not in RETRY_STATUSES:
+                raise MultipartError(f"part {part['part_number']} failed: HTTP {resp.status_code} {resp.text[:200]}")
+            error = f"HTTP {resp.status_code}"
+        except requests.RequestException as e:
+            # A part PUT is idempotent, so unlike run submission every error is safe to retry
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            body.close()
+
+        attempt += 1
+        progress.retried(body.read_bytes)
+        if attempt > retries:
+            raise MultipartError(f"part {part['part_number']} failed after {retries} retries: {error}")
+        time.sleep(min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+
+def upload_parts(path: str, plan: List[Dict[str, Any]], method: str, content_type: str,
+                 concurrency: int = 8, retries: int = 5, timeout: float = 900) -> List[Dict[str, Any]]:
+    """Upload every part concurrently; returns [{part_number, etag}] in part order."""
+    total = sum(part["size"] for part in plan)
+    progress = Progress(total, len(plan))
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=concurrency)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    print(f"   📦 Uploading {total / (1024 * 1024):.2f}MB as {len(plan)} parts, {concurrency} at a time...")
+    pool = ThreadPoolExecutor(max_workers=concurrency)
+    futures = {pool.submit(upload_part, session, method, path, part, content_type, progress, retries, timeout):
+               part["part_number"] for part in plan}
+    try:
+        done, pending = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in done:
+            if future.exception() is not None:
+                # One part is lost for good: don't keep sending the others
+                for other in pending:
+                    other.cancel()
+                raise future.exception()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+    progress.show(final=True)
+    return sorted(({"part_number": futures[f], "etag": f.result()} for f in futures), key=lambda p: p["part_number"])
+
+
+def complete_upload(complete_url: str, api_key: str, parts: List[Dict[str, Any]]) -> None:
+    """Ask the server to assemble the uploaded parts."""
+    resp = requests.post(
+        complete_url,
+        headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+        json={"parts": parts},
+        timeout=300,
+    )
+    if resp.status_code not in (200, 201, 204):
+        raise MultipartError(f"assembling {len(parts)} parts failed: HTTP {resp.status_code} {resp.text[:200]}")
+
+
+def default_part_size(file_size: int, concurrency: int) -> int:
+    """64MB parts, smaller for files that would otherwise leave workers idle."""
+    size = min(DEFAULT_PART_SIZE, -(-file_size // max(1, concurrency)))
+    return max(MIN_PART_SIZE, size)
+
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Compact, byte-budgeted in-memory history of webhook payloads.
+
+Instead of keeping every parsed payload dict (several times the size of the
+JSON for large RUN_FINISHED events), the listeners keep the raw request body,
+optionally zlib- or zstd-compressed, in a small __slots__ record. Payloads are
+decoded only when an entry is served, and the oldest entries are evicted once
+the retained bytes exceed the budget, so history depth scales with memory
+rather than with a fixed entry count.
+
+  store = PayloadStore(max_bytes=64 * 1024 * 1024, compression="zlib")
+  store.append(request.get_data(), path=request.path, token=token)
+  store.latest(10)  # -> [{"timestamp": ..., "path": ..., "token": ..., "data": {...}}]
+
+zstd needs the optional `zstandard` package.
+"""
+
+import json
+import sys
+import threading
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any, Deque, Dict, List, Optional
+
+
+COMPRESSIONS = ("none", "zlib", "zstd")
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Record.encoding values
+RAW, ZLIB, ZSTD = 0, 1, 2
+
+
+class Record:
+    """One stored payload; body stays encoded until the entry is served."""
+
+    __slots__ = ("received_at", "path", "token", "secret", "encoding", "body", "size", "cost")
+
+    def __init__(self, received_at: float, path: str, token: Optional[str], secret: Optional[str],
+                 encoding: int, body: bytes):
+        self.received_at = received_at
+        self.path = path
+        self.token = token
+        self.secret = secret
+        self.encoding = encoding
+        self.body = body
+        self.size = 0  # decoded length
+        self.cost = 0  # bytes charged against the budget
+
+
+# Fixed cost of a record: the object, its bytes header, the float/int fields and the deque slot
+RECORD_OVERHEAD = (sys.getsizeof(Record(0.0, "", None, None, RAW, b"")) + sys.getsizeof(b"")
+                   + sys.getsizeof(0.0) + 2 * sys.getsizeof(2 ** 40) + 8)
+
+
+class _Codec:
+    def __init__(self, compression: str, level: Optional[int]):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"compression must be one of {', '.join(COMPRESSIONS)}")
+        self.compression = compression
+        self.encoding = {"none": RAW, "zlib": ZLIB, "zstd": ZSTD}[compression]
+        self.level = level
+        self._zstd = None
+        if compression == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise RuntimeError("zstd compression needs the 'zstandard' package (pip install zstandard)")
+            self._zstd = zstandard
+            self._compressor = zstandard.ZstdCompressor(level=level or 3)
+            self._decompressor = zstandard.ZstdDecompressor()
+        # zstd (de)compressor objects are not safe to share between threads
+        self._lock = threading.Lock()
+
+    def encode(self, raw: bytes):
+        if self.encoding == ZLIB:
+            packed = zlib.compress(raw, 6 if self.level is None else self.level)
+        elif self.encoding == ZSTD:
+            with self._lock:
+                packed = self._compressor.compress(raw)
+        else:
+            return RAW, raw
+        # Tiny payloads can grow when compressed; keep whichever is smaller
+        return (self.encoding, packed) if len(packed) < len(raw) else (RAW, raw)
+
+    def decode(self, encoding: int, body: bytes) -> bytes:
+        if encoding == ZLIB:
+            return zlib.decompress(body)
+        if encoding == ZSTD:
+            if self._zstd is None:
+                raise RuntimeError("zstd payload in a store without zstd support")
+            with self._lock:
+                return self._decompressor.decompress(body)
+        return body
+
+
+class PayloadStore:
+    """Thread-safe FIFO of raw payloads bounded by retained bytes."""
+
+    def __init__(self, max_bytes: Optional[int] = DEFAULT_MAX_BYTES, compression: str = "zlib",
+                 level: Optional[int] = None):
+        self.max_bytes = max_bytes  # None = unbounded
+        self.codec = _Codec(compression, level)
+        self.records: Deque[Record] = deque()
+        self.bytes = 0
+        self.raw_bytes = 0  # uncompressed size of what is retained
+        self.received = 0
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+    @property
+    def compression(self) -> str:
+        return self.codec.compression
+
+    def append(self, raw: bytes, path: str = "", token: Optional[str] = None,
+               secret: Optional[str] = None, received_at: Optional[float] = None) -> None:
+        """Store a raw request body; evicts the oldest entries beyond the budget."""
+        encoding, body = self.codec.encode(bytes(raw))
+        record = Record(time.time() if received_at is None else received_at,
+                        sys.intern(path), token, secret, encoding, body)
+        record.size = len(raw)
+        record.cost = (RECORD_OVERHEAD + len(body) + len(path)
+                       + (sys.getsizeof(token) if token else 0)
+                       + (sys.getsizeof(secret) if secret else 0))
+        with self.lock:
+            self.records.append(record)
+            self.bytes += record.cost
+            self.raw_bytes += len(raw)
+            self.received += 1
+            # Always keep the newest entry, even if it alone is over budget
+            while self.max_bytes is not None and self.bytes > self.max_bytes and len(self.records) > 1:
+                old = self.records.popleft()
+                self.bytes -= old.cost
+                self.raw_bytes -= old.size
+                self.evicted += 1
+
+    def decode(self, record: Record, include_secret: bool = False) -> Dict[str, Any]:
+        raw = self.codec.decode(record.encoding, record.body)
+        try:
+            data = json.loads(raw)
+        except ValueError:
+            data = raw.decode("utf-8", errors="replace")
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.received_at, timezone.utc).isoformat(),
+            "path": record.path,
+            "token": record.token,
+        }
+        if include_secret:
+            entry["webhook_secret"] = record.secret
+        entry["data"] = data
+        return entry
+
+    def latest(self, limit: int = 10, include_secret: bool = False) -> List[Dict[str, Any]]:
+        """Decode the newest `limit` entries, oldest first."""
+        with self.lock:
+            records = list(islice(reversed(self.records), max(0, limit)))
+        return [self.decode(record, include_secret) for record in reversed(records)]
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "entries": len(self.records),
+                "received": self.received,
+                "evicted": self.evicted,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "payload_bytes": self.raw_bytes,
+                "compression": self.codec.compression,
+            }
+
+    def __len__(self) -> int:
+        return len(self.records)
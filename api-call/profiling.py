@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Per-phase timing reports for the Mosaic CLIs (--profile).
+
+A script wraps each step of its work in a phase:
+
+  profiler = start_profiler("upload_video", args.profile, args.profile_cprofile)
+  with profiler.phase("get_upload_url"):
+      ...
+
+and at exit a JSON report is written with, per phase, wall and CPU time, the
+number of HTTP requests made and bytes sent/received, plus the time spent
+waiting on the host-wide rate limiter. HTTP traffic is counted by wrapping
+requests.Session.send while profiling is on, so requests made through the
+module-level helpers (requests.post, ...) are included; requests issued from
+worker threads are charged to the innermost phase open at the time.
+
+With --profile-cprofile FILE the whole run is also recorded with cProfile
+(inspect with `python -m pstats FILE`). For a sampling profile without code
+changes, run the script under py-spy: `py-spy record -o out.svg -- python ...`.
+
+When profiling is off, start_profiler returns a profiler whose phases are
+no-ops, so the scripts don't need to branch.
+"""
+
+import atexit
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+
+PHASE_FIELDS = ("calls", "wall_s", "cpu_s", "requests", "bytes_sent", "bytes_received")
+
+
+def _body_size(request) -> Optional[int]:
+    length = request.headers.get("Content-Length")
+    if length is not None:
+        try:
+            return int(length)
+        except ValueError:
+            return None
+    if isinstance(request.body, (bytes, str)):
+        return len(request.body)
+    return None  # streamed (chunked) body; the caller reports it with add_bytes
+
+
+class Profiler:
+    """Accumulates per-phase wall/CPU time, request counts and bytes."""
+
+    def __init__(self, command: str, enabled: bool = True, timeline: bool = False):
+        self.command = command
+        self.enabled = enabled
+        # (phase, start_ns, end_ns) in wall-clock time, for tracing.record_upload etc.
+        self.timeline: Optional[List[Tuple[str, int, int]]] = [] if timeline else None
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self.active: List[str] = []
+        self.lock = threading.Lock()
+        self.started_at = datetime.now(timezone.utc)
+        self.wall_start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        self.child_cpu_start = self._child_cpu()
+        self._original_send = None
+
+    @staticmethod
+    def _child_cpu() -> float:
+        times = os.times()
+        return times.children_user + times.children_system
+
+    def _phase(self, name: str) -> Dict[str, float]:
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = {field: 0 for field in PHASE_FIELDS}
+        return phase
+
+    @contextmanager
+    def phase(self, name: str):
+        if not self.enabled:
+            yield
+            return
+        with self.lock:
+            self.active.append(name)
+            self._phase(name)["calls"] += 1
+        wall, cpu, start_ns = time.perf_counter(), time.process_time(), time.time_ns()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            with self.lock:
+                phase = self._phase(name)
+                phase["wall_s"] += wall
+                phase["cpu_s"] += cpu
+                self.active.remove(name)
+                if self.timeline is not None:
+                    self.timeline.append((name, start_ns, time.time_ns()))
+
+    def add_bytes(self, sent: int = 0, received: int = 0, requests: int = 0) -> None:
+        """Charge traffic the HTTP hook can't see (e.g. chunked uploads) to the current phase."""
+        if not self.enabled:
+            return
+        with self.lock:
+            phase = self._phase(self.active[-1] if self.active else "other")
+            phase["bytes_sent"] += sent
+            phase["bytes_received"] += received
+            phase["requests"] += requests
+
+    def install_http_hook(self) -> None:
+        import requests
+
+        if self._original_send is not None:
+            return
+        original = self._original_send = requests.Session.send
+        profiler = self
+
+        def send(session, request, **kwargs):
+            response = original(session, request, **kwargs)
+            received = 0
+            if not kwargs.get("stream"):
+                received = len(response.content or b"")
+            else:
+                received = int(response.headers.get("Content-Length") or 0)
+            profiler.add_bytes(sent=_body_size(request) or 0, received=received, requests=1)
+            return response
+
+        requests.Session.send = send
+
+    def uninstall_http_hook(self) -> None:
+        if self._original_send is None:
+            return
+        import requests
+
+        requests.Session.send = self._original_send
+        self._original_send = None
+
+    def report(self) -> Dict[str, Any]:
+        import platform
+
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.process_time() - self.cpu_start
+        with self.lock:
+            phases = {
+                name: {field: (round(v, 6) if isinstance(v, float) else v) for field, v in phase.items()}
+                for name, phase in self.phases.items()
+            }
+        totals = {field: sum(p[field] for p in phases.values())
+                  for field in ("requests", "bytes_sent", "bytes_received")}
+        accounted = sum(p["wall_s"] for p in phases.values())
+
+        report = {
+            "command": self.command,
+            "argv": [re.sub(r"mk_\w+", "mk_***", arg) for arg in sys.argv[1:]],
+            "started_at": self.started_at.isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "wall_s": round(wall, 6),
+            "cpu_s": round(cpu, 6),
+            # e.g. ffmpeg for upload_video.py --transcode
+            "child_cpu_s": round(self._child_cpu() - self.child_cpu_start, 6),
+            "unaccounted_wall_s": round(max(0.0, wall - accounted), 6),
+            "phases": phases,
+            "totals": totals,
+        }
+        ratelimit = sys.modules.get("ratelimit")
+        if ratelimit is not None and ratelimit.STATS:
+            report["rate_limit_waits"] = json.loads(json.dumps(ratelimit.STATS))
+        return report
+
+
+def start_profiler(command: str, report_path: Optional[str], cprofile_path: Optional[str] = None,
+                   timeline: bool = False) -> Profiler:
+    """
+    Create the profiler for a CLI run.
+
+    `report_path` is where the JSON report goes at exit ("-" for stderr);
+    None disables profiling unless `cprofile_path` is given. With `timeline`
+    phases are timed (and kept in profiler.timeline) even without a report.
+    """
+    reporting = bool(report_path or cprofile_path)
+    profiler = Profiler(command, reporting or timeline, timeline)
+    if not reporting:
+        return profiler
+
+    profiler.install_http_hook()
+    cprof = None
+    if cprofile_path:
+        import cProfile
+
+        cprof = cProfile.Profile()
+        cprof.enable()
+
+    def finish() -> None:
+        if cprof is not None:
+            cprof.disable()
+            cprof.dump_stats(cprofile_path)
+            print(f"🧪 cProfile written to {cprofile_path} (python -m pstats {cprofile_path})", file=sys.stderr)
+        profiler.uninstall_http_hook()
+        if not report_path:
+            return
+        text = json.dumps(profiler.report(), indent=2)
+        if report_path == "-":
+            print(text, file=sys.stderr)
+            return
+        directory = os.path.dirname(os.path.abspath(report_path))
+        os.makedirs(directory, exist_ok=True)
+        with open(report_path, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        print(f"🧪 Profile written to {report_path}", file=sys.stderr)
+
+    # atexit also covers the scripts' sys.exit() error paths
+    atexit.register(finish)
+    return profiler
+
+
+def add_profile_arguments(parser) -> None:
+    group = parser.add_argument_group("profiling")
+    group.add_argument("--profile", nargs="?", const="-", metavar="FILE",
+                       help="Write a per-phase timing report as JSON to FILE (default: stderr)")
+    group.add_argument("--profile-cprofile", metavar="FILE",
+                       help="Also record the run with cProfile and dump the stats to FILE")
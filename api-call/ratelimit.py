@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Host-wide token bucket shared by every Mosaic script on the machine.
+
+Each endpoint class (upload, run, status, triggers) has one bucket stored in a
+small JSON file; processes take a token under an exclusive file lock, so all
+copies of upload_video.py, run_agent.py, get_status.py, batch.py and
+add_triggers.py running on a host together stay under the configured rate.
+A caller that finds the bucket empty reserves the next token and sleeps until
+it is due, which keeps waiters in arrival order without polling.
+
+Environment:
+  MOSAIC_RATE_LIMITS="run=5,status=20:40"   # rate per second[:burst] per class
+  MOSAIC_RATE_LIMITS=off                    # disable limiting entirely
+  MOSAIC_RATE_LIMIT_DIR=/var/run/mosaic     # where bucket files live
+
+Usage:
+  python ratelimit.py            # show host-wide counters
+  python ratelimit.py --reset    # clear buckets and counters
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: limit within the process only
+    fcntl = None
+
+
+# requests per second, burst
+DEFAULT_LIMITS: Dict[str, Tuple[float, float]] = {
+    "upload": (2.0, 2.0),
+    "run": (5.0, 5.0),
+    "status": (20.0, 20.0),
+    "triggers": (1.0, 2.0),
+}
+
+# Waits for this process, per endpoint class
+STATS: Dict[str, Dict[str, float]] = {}
+
+_local_lock = threading.Lock()
+
+
+def state_dir() -> str:
+    return os.environ.get("MOSAIC_RATE_LIMIT_DIR") or os.path.join(tempfile.gettempdir(), "mosaic-ratelimit")
+
+
+def load_limits() -> Optional[Dict[str, Tuple[float, float]]]:
+    """Limits from MOSAIC_RATE_LIMITS layered over the defaults; None when disabled."""
+    limits = dict(DEFAULT_LIMITS)
+    spec = os.environ.get("MOSAIC_RATE_LIMITS", "").strip()
+    if spec.lower() in ("off", "0", "none", "disabled"):
+        return None
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, value = (part.strip() for part in item.split("=", 1))
+        try:
+            if ":" in value:
+                rate, burst = (float(v) for v in value.split(":", 1))
+            else:
+                rate = float(value)
+                burst = max(1.0, rate)
+        except ValueError:
+            print(f"⚠️  Ignoring invalid rate limit '{item}' in MOSAIC_RATE_LIMITS", file=sys.stderr)
+            continue
+        if rate > 0:
+            limits[name] = (rate, max(1.0, burst))
+    return limits
+
+
+def _read_state(f) -> dict:
+    f.seek(0)
+    raw = f.read()
+    try:
+        return json.loads(raw) if raw else {}
+    except json.JSONDecodeError:
+        return {}
+
+
+def _write_state(f, state: dict) -> None:
+    f.seek(0)
+    f.truncate()
+    f.write(json.dumps(state))
+    f.flush()
+
+
+def _reserve(endpoint_class: str, rate: float, burst: float) -> float:
+    """Take one token from the shared bucket and return how long to wait for it."""
+    os.makedirs(state_dir(), exist_ok=True)
+    path = os.path.join(state_dir(), f"{endpoint_class}.bucket")
+    with _local_lock, open(path, "a+", encoding="utf-8") as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            state = _read_state(f)
+            now = time.time()
+            tokens = float(state.get("tokens", burst))
+            elapsed = max(0.0, now - float(state.get("updated", now)))
+            # Negative tokens are reservations already handed to waiting callers
+            tokens = min(burst, tokens + elapsed * rate) - 1.0
+            wait = -tokens / rate if tokens < 0 else 0.0
+
+            state.update({
+                "tokens": tokens,
+                "updated": now,
+                "rate": rate,
+                "burst": burst,
+                "acquired": state.get("acquired", 0) + 1,
+                "waited": state.get("waited", 0) + (1 if wait > 0 else 0),
+                "wait_seconds": state.get("wait_seconds", 0.0) + wait,
+            })
+            _write_state(f, state)
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    return wait
+
+
+def acquire(endpoint_class: str) -> float:
+    """
+    Block until the host-wide bucket for `endpoint_class` allows one request.
+
+    Returns the number of seconds spent waiting. Unknown classes and disabled
+    limiting return immediately.
+    """
+    limits = load_limits()
+    if not limits or endpoint_class not in limits:
+        return 0.0
+    rate, burst = limits[endpoint_class]
+    try:
+        wait = _reserve(endpoint_class, rate, burst)
+    except OSError as e:
+        # Never fail an API call because the limiter's state is unavailable
+        print(f"⚠️  Rate limiter unavailable ({e}); continuing unthrottled", file=sys.stderr)
+        return 0.0
+
+    with _local_lock:
+        stats = STATS.setdefault(endpoint_class, {"acquired": 0, "waited": 0, "wait_seconds": 0.0})
+        stats["acquired"] += 1
+        if wait > 0:
+            stats["waited"] += 1
+            stats["wait_seconds"] += wait
+    if wait > 0:
+        time.sleep(wait)
+    return wait
+
+
+def host_stats() -> Dict[str, dict]:
+    """Counters accumulated by every process on this host, per endpoint class."""
+    result = {}
+    directory = state_dir()
+    if not os.path.isdir(directory):
+        return result
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".bucket"):
+            continue
+        with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+            state = _read_state(f)
+        result[name[:-len(".bucket")]] = {
+            key: state.get(key) for key in ("rate", "burst", "tokens", "acquired", "waited", "wait_seconds")
+        }
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the host-wide Mosaic API rate limiter")
+    parser.add_argument("--reset", action="store_true", help="Delete all buckets and counters")
+    parser.add_argument("--json", action="store_true", help="Print counters as JSON")
+    args = parser.parse_args()
+
+    if args.reset:
+        directory = state_dir()
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                if name.endswith(".bucket"):
+                    os.remove(os.path.join(directory, name))
+        print(f"✅ Rate limiter state cleared ({directory})")
+        return
+
+    stats = host_stats()
+    if args.json:
+        print(json.dumps(stats, indent=2))
+        return
+
+    limits = load_limits()
+    print(f"📂 State: {state_dir()}")
+    if limits is None:
+        print("🔓 Rate limiting: DISABLED (MOSAIC_RATE_LIMITS=off)")
+    else:
+        for name, (rate, burst) in limits.items():
+            print(f"   {name:<9} {rate:g}/s (burst {burst:g})")
+    if not stats:
+        print("\nNo requests recorded yet")
+        return
+    print(f"\n{'class':<10}{'acquired':>10}{'waited':>10}{'wait s':>10}")
+    for name, s in stats.items():
+        print(f"{name:<10}{s['acquired'] or 0:>10}{s['waited'] or 0:>10}{s['wait_seconds'] or 0:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,15 +4,40 @@ Run a Mosaic agent on one or more uploaded videos.
 
 Usage:
   python run_agent.py --agent-id YOUR_AGENT_ID --video-ids VID1,VID2 [--callback-url URL]
+
+Mass submission (shards a large id list into many runs, paces itself on 429s
+and resumes only unsubmitted shards when re-run with the same mapping file;
+a shard whose POST may have reached Mosaic is never resent automatically):
+  python run_agent.py --agent-id YOUR_AGENT_ID --video-ids-file ids.txt \
+      [--shard-size 50] [--concurrency 4] [--mapping-file ids.txt.runs.jsonl]
+
+Queued submission (records the runs for run_queue.py's dispatcher, which keeps
+at most N in flight, instead of starting them now):
+  python run_agent.py --agent-id YOUR_AGENT_ID --video-ids-file ids.txt --queue [QUEUE_DB]
+
+Add --profile [FILE] for a per-phase timing report (JSON).
 """
 
 import argparse
 import json
 import os
+import random
+import sqlite3
 import sys
-from typing import List, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, List, Optional, Set
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+import tracing
+from profiling import Profiler, add_profile_arguments, start_profiler
+from ratelimit import acquire
 
 
 DEFAULT_BASE_URL = "https://api.mosaic.so"
@@ -33,49 +58,379 @@ def parse_ids(ids_str: str) -> List[str]:
     return [v.strip() for v in ids_str.split(',') if v.strip()]
 
 
-def run_agent(base_url: str, headers: dict, agent_id: str, video_ids: List[str], callback_url: Optional[str]) -> str:
+def start_run(
+    session,
+    base_url: str,
+    headers: dict,
+    agent_id: str,
+    video_ids: List[str],
+    callback_url: Optional[str] = None,
+) -> str:
+    """POST /agent/{agent_id}/run and return the run_id.
+
+    Raises requests.HTTPError on an error response and ValueError when no run_id
+    comes back. `session` may be a requests.Session or the requests module itself.
+    """
     payload = {"video_ids": video_ids}
     if callback_url:
         payload["callback_url"] = callback_url
 
-    resp = requests.post(
+    acquire("run")
+    started_ns = time.time_ns()
+    resp = session.post(
         f"{base_url}/agent/{agent_id}/run",
         headers={**headers, "Content-Type": "application/json"},
         json=payload,
         timeout=60,
     )
-    try:
-        resp.raise_for_status()
-    except requests.HTTPError as e:
-        print(f"❌ Failed to start agent run: {e}\n{resp.text}")
-        sys.exit(1)
+    resp.raise_for_status()
 
     data = resp.json()
     run_id = data.get("run_id")
     if not run_id:
-        print(f"❌ No run_id returned: {data}")
-        sys.exit(1)
+        raise ValueError(f"No run_id returned: {data}")
+    tracing.record_run_submit(run_id, agent_id, video_ids, started_ns, time.time_ns(), callback_url)
     return run_id
 
 
+def run_agent(base_url: str, headers: dict, agent_id: str, video_ids: List[str], callback_url: Optional[str]) -> str:
+    try:
+        return start_run(requests, base_url, headers, agent_id, video_ids, callback_url)
+    except requests.HTTPError as e:
+        print(f"❌ Failed to start agent run: {e}\n{e.response.text}")
+        sys.exit(1)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class AimdPacer:
+    """
+    Request pacer shared by all submission threads.
+
+    Requests are spaced 1/rate seconds apart. Every success adds roughly
+    `increase` req/s per second of traffic (additive increase); a 429/503
+    multiplies the rate by `decrease` (multiplicative decrease) and, when the
+    server sends Retry-After, holds every thread until it has passed.
+    """
+
+    def __init__(self, rate: float, min_rate: float, max_rate: float,
+                 increase: float = 0.5, decrease: float = 0.5):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.next_at = 0.0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.throttled_count = 0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_at, self.blocked_until)
+            self.next_at = start + 1.0 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+    def success(self) -> None:
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def throttled(self, retry_after: Optional[float]) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.throttled_count += 1
+            # One decrease per burst: replies to requests already in flight
+            # when the limit was hit shouldn't compound the cut
+            if now - self.last_decrease > 1.0 / self.rate:
+                self.rate = max(self.min_rate, self.rate * self.decrease)
+                self.last_decrease = now
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            self.next_at = max(self.next_at, now + 1.0 / self.rate)
+
+
+def read_ids_file(path: str) -> List[str]:
+    """Read video ids (one per line or comma-separated), dropping duplicates and # comments."""
+    seen: Set[str] = set()
+    ids = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.split("#", 1)[0]
+            for vid in parse_ids(line):
+                if vid not in seen:
+                    seen.add(vid)
+                    ids.append(vid)
+    return ids
+
+
+def load_submitted(mapping_file: str) -> Set[str]:
+    """Video ids already covered by a run, or a submission of unknown outcome, recorded in the mapping file."""
+    submitted: Set[str] = set()
+    if not os.path.exists(mapping_file):
+        return submitted
+    with open(mapping_file, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A torn last line from an interrupted write; that shard is resubmitted
+                continue
+            if record.get("run_id") or record.get("outcome_unknown"):
+                submitted.update(record.get("video_ids", []))
+    return submitted
+
+
+class OutcomeUnknown(Exception):
+    """The run POST may have reached Mosaic (5xx other than 503, dropped connection, read timeout); never resend it."""
+
+
+def _never_sent(e: requests.ConnectionError) -> bool:
+    """True when the connection was never established (refused, DNS failure, connect timeout)."""
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    # requests wraps urllib3's MaxRetryError; an aborted connection carries a ProtocolError instead
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def submit_shard(session, pacer: AimdPacer, base_url: str, headers: dict, agent_id: str,
+                 video_ids: List[str], callback_url: Optional[str], max_retries: int) -> str:
+    """
+    Submit one shard. Only retries what provably created nothing: 429/503 (with
+    pacing) and connections that were never established. Raises OutcomeUnknown
+    when the run may exist, HTTPError/ValueError on a definite refusal, and
+    RuntimeError once the retries run out.
+    """
+    attempt = 0
+    while True:
+        pacer.wait()
+        try:
+            run_id = start_run(session, base_url, headers, agent_id, video_ids, callback_url)
+            pacer.success()
+            return run_id
+        except requests.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if status not in (429, 503):
+                if status is not None and status >= 500:
+                    raise OutcomeUnknown(f"{e} {e.response.text}".strip()) from e
+                raise
+            pacer.throttled(parse_retry_after(e.response.headers.get("Retry-After")))
+            attempt += 1
+        except requests.ConnectionError as e:
+            if not _never_sent(e):
+                raise OutcomeUnknown(f"{type(e).__name__}: {e}") from e
+            attempt += 1
+        except requests.Timeout as e:
+            raise OutcomeUnknown(f"{type(e).__name__}: {e}") from e
+        if attempt > max_retries:
+            raise RuntimeError(f"gave up after {max_retries} retries (throttled or unreachable; no run was created)")
+        time.sleep(min(30.0, 0.5 * 2 ** attempt) * random.uniform(0.5, 1.0))
+
+
+def run_sharded(args, headers: dict, profiler: Optional[Profiler] = None) -> None:
+    profiler = profiler or Profiler("run_agent", enabled=False)
+    with profiler.phase("read_ids"):
+        video_ids = read_ids_file(args.video_ids_file)
+    if not video_ids:
+        print(f"❌ No video ids found in {args.video_ids_file}")
+        sys.exit(1)
+
+    mapping_file = args.mapping_file or f"{args.video_ids_file}.runs.jsonl"
+    with profiler.phase("load_mapping"):
+        submitted = load_submitted(mapping_file)
+    remaining = [v for v in video_ids if v not in submitted]
+    shards = [remaining[i:i + args.shard_size] for i in range(0, len(remaining), args.shard_size)]
+
+    print(f"\n📋 {len(video_ids)} video ids, {len(video_ids) - len(remaining)} already submitted")
+    print(f"🚀 Submitting {len(shards)} runs of up to {args.shard_size} videos "
+          f"({args.concurrency} concurrent, mapping: {mapping_file})")
+    if not shards:
+        print("✅ Nothing left to submit")
+        return
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=args.concurrency)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    pacer = AimdPacer(args.initial_rate, args.min_rate, args.max_rate)
+    write_lock = threading.Lock()
+    failed: Dict[int, str] = {}
+    unknown: Dict[int, str] = {}
+    done = 0
+    started = time.monotonic()
+
+    with profiler.phase("submit"), open(mapping_file, "a+", encoding="utf-8") as mapping, \
+            ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        # Terminate a torn last line so the next record starts cleanly
+        if mapping.tell() > 0:
+            mapping.seek(mapping.tell() - 1)
+            if mapping.read(1) != "\n":
+                mapping.write("\n")
+
+        def write_record(record: dict) -> None:
+            with write_lock:
+                mapping.write(json.dumps(record) + "\n")
+                mapping.flush()
+                os.fsync(mapping.fileno())
+
+        def submit_and_record(shard: List[str]) -> dict:
+            # Recorded on the worker so shards still running at Ctrl-C (which
+            # the executor lets finish) land in the mapping file too
+            submitted_at = datetime.now(timezone.utc).isoformat()
+            try:
+                run_id = submit_shard(session, pacer, args.base_url, headers, args.agent_id,
+                                      shard, args.callback_url, args.max_retries)
+            except OutcomeUnknown as e:
+                # The run may exist: recorded so a re-run doesn't send it again
+                write_record({"run_id": None, "video_ids": shard, "submitted_at": submitted_at,
+                              "outcome_unknown": str(e)})
+                raise
+            record = {"run_id": run_id, "video_ids": shard, "submitted_at": submitted_at}
+            write_record(record)
+            return record
+
+        futures = {pool.submit(submit_and_record, shard): idx for idx, shard in enumerate(shards, 1)}
+        try:
+            for future in as_completed(futures):
+                idx = futures[future]
+                try:
+                    record = future.result()
+                except OutcomeUnknown as e:
+                    unknown[idx] = str(e)
+                    print(f"   ⚠️  shard {idx}/{len(shards)} outcome unknown: {e}")
+                    continue
+                except Exception as e:
+                    detail = e.response.text if isinstance(e, requests.HTTPError) and e.response is not None else ""
+                    failed[idx] = f"{e} {detail}".strip()
+                    print(f"   ❌ shard {idx}/{len(shards)} failed: {failed[idx]}")
+                    continue
+                done += 1
+                print(f"   ✅ shard {idx}/{len(shards)} -> {record['run_id']} "
+                      f"({len(record['video_ids'])} videos, rate {pacer.rate:.2f}/s)")
+        except KeyboardInterrupt:
+            print("\n❌ Interrupted; waiting for in-flight shards to be recorded, "
+                  "then re-run the same command to submit the rest")
+            for future in futures:
+                future.cancel()
+            raise
+
+    elapsed = time.monotonic() - started
+    print(f"\n📊 Submitted {done}/{len(shards)} runs in {elapsed:.1f}s "
+          f"({pacer.throttled_count} throttled responses, final rate {pacer.rate:.2f}/s)")
+    if unknown:
+        print(f"⚠️  {len(unknown)} shards may or may not have started a run; they won't be resent. Check Mosaic, "
+              f"then delete their \"outcome_unknown\" lines from {mapping_file} to resubmit them")
+    if failed:
+        print(f"⚠️  {len(failed)} shards failed; re-run the same command to retry them")
+    if failed or unknown:
+        sys.exit(1)
+
+
+def enqueue_runs(args, video_ids: List[str]) -> None:
+    """Record runs in the durable queue; with --video-ids-file, ids already queued for the agent are skipped."""
+    from run_queue import RunQueue
+
+    try:
+        queue = RunQueue(args.queue or None)
+    except (OSError, sqlite3.Error) as e:
+        print(f"❌ Cannot open run queue: {e}")
+        sys.exit(1)
+    if args.video_ids_file:
+        queued = queue.video_ids_for(args.agent_id)
+        remaining = [v for v in video_ids if v not in queued]
+        shards = [remaining[i:i + args.shard_size] for i in range(0, len(remaining), args.shard_size)]
+        print(f"\n📋 {len(video_ids)} video ids, {len(video_ids) - len(remaining)} already queued")
+    else:
+        shards = [video_ids]
+    ids = queue.enqueue_many(args.agent_id, shards, args.callback_url)
+    if not ids:
+        print("✅ Nothing left to queue")
+        return
+    span = f"#{ids[0]}" if len(ids) == 1 else f"#{ids[0]}..#{ids[-1]}"
+    print(f"📥 Queued {len(ids)} run{'s' if len(ids) != 1 else ''} ({span}) in {queue.path}")
+    if not args.callback_url:
+        print("   No --callback-url: slots are freed by status polling only")
+    print("   Start them with: python run_queue.py dispatch --max-in-flight N")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Run a Mosaic agent on uploaded videos")
     parser.add_argument("--agent-id", required=True)
-    parser.add_argument("--video-ids", required=True, help="Comma-separated video IDs")
+    ids_group = parser.add_mutually_exclusive_group(required=True)
+    ids_group.add_argument("--video-ids", help="Comma-separated video IDs")
+    ids_group.add_argument("--video-ids-file", help="File of video IDs (one per line) to submit as sharded runs")
     parser.add_argument("--callback-url", help="Optional webhook callback URL")
     parser.add_argument("--api-key", help="Mosaic API key (or use MOSAIC_API_KEY env var)")
     parser.add_argument("--base-url", default=DEFAULT_BASE_URL)
+    parser.add_argument("--queue", nargs="?", const="", metavar="QUEUE_DB",
+                        help="Add the runs to the durable run queue instead of starting them (see run_queue.py)")
+
+    mass = parser.add_argument_group("mass submission (with --video-ids-file)")
+    mass.add_argument("--shard-size", type=int, default=50, help="Videos per run (default: 50)")
+    mass.add_argument("--concurrency", type=int, default=4, help="Concurrent submissions (default: 4)")
+    mass.add_argument("--mapping-file", help="JSONL run_id -> video_ids log used to resume (default: <ids file>.runs.jsonl)")
+    mass.add_argument("--initial-rate", type=float, default=2.0, help="Starting submissions per second (default: 2)")
+    mass.add_argument("--min-rate", type=float, default=0.1, help="Lowest rate after backing off (default: 0.1)")
+    mass.add_argument("--max-rate", type=float, default=20.0, help="Highest rate to ramp up to (default: 20)")
+    mass.add_argument("--max-retries", type=int, default=8, help="Retries per shard on 429/5xx (default: 8)")
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    profiler = start_profiler("run_agent", args.profile, args.profile_cprofile)
+
+    if args.queue is not None:
+        if args.shard_size < 1:
+            print("❌ --shard-size must be at least 1")
+            sys.exit(1)
+        video_ids = read_ids_file(args.video_ids_file) if args.video_ids_file else parse_ids(args.video_ids)
+        if not video_ids:
+            print("❌ No video ids to queue")
+            sys.exit(1)
+        enqueue_runs(args, video_ids)
+        return
 
     api_key = resolve_api_key(args.api_key)
     headers = {"Authorization": f"Bearer {api_key}"}
+
+    if args.video_ids_file:
+        if args.shard_size < 1 or args.concurrency < 1:
+            print("❌ --shard-size and --concurrency must be at least 1")
+            sys.exit(1)
+        if not 0 < args.min_rate <= args.initial_rate <= args.max_rate:
+            print("❌ Rates must satisfy 0 < --min-rate <= --initial-rate <= --max-rate")
+            sys.exit(1)
+        run_sharded(args, headers, profiler)
+        return
+
     video_ids = parse_ids(args.video_ids)
     if not video_ids:
         print("❌ Provide at least one video id via --video-ids")
         sys.exit(1)
 
     print("\n🚀 Starting agent run...")
-    run_id = run_agent(args.base_url, headers, args.agent_id, video_ids, args.callback_url)
+    with profiler.phase("start_run"):
+        run_id = run_agent(args.base_url, headers, args.agent_id, video_ids, args.callback_url)
     print(f"✅ Run started\nrun_id {run_id}")
 
 
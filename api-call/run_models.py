@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Compact models for /agent_run/{id} responses, decoded lazily from the raw body.
+
+resp.json() turns a run with thousands of outputs into thousands of dicts,
+each several times the size of its JSON. RunStatus instead keeps the response
+as its JSON text and decodes a field only when it is read:
+
+  run = RunStatus(resp.content)
+  run.status                 # scans the top level until "status", decodes one string
+  run.output_urls()          # walks "outputs" pulling video_url/url, nothing else
+  run.outputs                # tuple of slotted RunOutput, built on each access
+  run.to_dict()              # the full object graph, when it is really needed
+
+The scanner walks the top-level object with the json module's C string
+scanner and raw_decode, one value at a time; arrays are stepped through
+element by element, so neither a lookup nor a walk over "outputs" ever holds
+more than one output's objects at once. RunOutput, RunInput and TriggeredBy
+are __slots__ classes holding only the fields the scripts use.
+"""
+
+import json
+import re
+from json.decoder import scanstring
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+
+_DECODER = json.JSONDecoder()
+_WS = re.compile(r"[ \t\n\r]*")
+
+
+def _skip_ws(text: str, pos: int) -> int:
+    if text[pos] not in " \t\n\r":
+        return pos
+    return _WS.match(text, pos).end()
+
+
+def value_end(text: str, pos: int) -> int:
+    """Offset just past the JSON value starting at pos."""
+    first = text[pos]
+    if first == '"':
+        return scanstring(text, pos + 1)[1]
+    if first == "[":
+        # Element by element, so skipping a huge array never builds more than one element
+        end = pos + 1
+        for _, end in iter_elements(text, pos):
+            pass
+        return text.index("]", end) + 1
+    return _DECODER.raw_decode(text, pos)[1]
+
+
+def decode(text: str, start: int) -> Any:
+    """Decode the one value starting at start."""
+    if text[start] == '"':
+        return scanstring(text, start + 1)[0]
+    return _DECODER.raw_decode(text, start)[0]
+
+
+def iter_members(text: str, pos: int) -> Iterator[Tuple[str, int]]:
+    """
+    Yield (key, value_start) for the object starting at pos.
+
+    The value is only skipped when the generator is resumed, so a caller that
+    stops at the key it wants never pays for stepping over that value.
+    """
+    pos = _skip_ws(text, pos)
+    if text[pos] != "{":
+        raise ValueError(f"expected an object at {pos}")
+    pos = _skip_ws(text, pos + 1)
+    if text[pos] == "}":
+        return
+    while True:
+        if text[pos] != '"':
+            raise ValueError(f"expected a key at {pos}")
+        key, pos = scanstring(text, pos + 1)
+        pos = _skip_ws(text, pos)
+        if text[pos] != ":":
+            raise ValueError(f"expected ':' at {pos}")
+        start = _skip_ws(text, pos + 1)
+        yield key, start
+        pos = _skip_ws(text, value_end(text, start))
+        if text[pos] == ",":
+            pos = _skip_ws(text, pos + 1)
+        elif text[pos] == "}":
+            return
+        else:
+            raise ValueError(f"expected ',' or '}}' at {pos}")
+
+
+def iter_elements(text: str, pos: int) -> Iterator[Tuple[int, int]]:
+    """Yield (start, end) for each element of the array starting at pos."""
+    pos = _skip_ws(text, pos)
+    if text[pos] != "[":
+        raise ValueError(f"expected an array at {pos}")
+    pos = _skip_ws(text, pos + 1)
+    if text[pos] == "]":
+        return
+    while True:
+        end = value_end(text, pos)
+        yield pos, end
+        pos = _skip_ws(text, end)
+        if text[pos] == ",":
+            pos = _skip_ws(text, pos + 1)
+        elif text[pos] == "]":
+            return
+        else:
+            raise ValueError(f"expected ',' or ']' at {pos}")
+
+
+def iter_values(text: str, pos: int) -> Iterator[Any]:
+    """Decode the elements of the array starting at pos one at a time."""
+    raw_decode, whitespace = _DECODER.raw_decode, _WS.match
+    pos = _skip_ws(text, pos)
+    if text[pos] != "[":
+        raise ValueError(f"expected an array at {pos}")
+    pos = _skip_ws(text, pos + 1)
+    if text[pos] == "]":
+        return
+    while True:
+        value, pos = raw_decode(text, pos)
+        yield value
+        # Inlined _skip_ws: this loop runs once per output
+        char = text[pos]
+        if char in " \t\n\r":
+            pos = whitespace(text, pos).end()
+            char = text[pos]
+        if char == ",":
+            pos += 1
+            if text[pos] in " \t\n\r":
+                pos = whitespace(text, pos).end()
+        elif char == "]":
+            return
+        else:
+            raise ValueError(f"expected ',' or ']' at {pos}")
+
+
+class _Model:
+    """Slotted record keeping only the fields the scripts use."""
+
+    __slots__ = ()
+    _aliases: Dict[str, str] = {}
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "_Model":
+        model = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(model, name, data.get(name))
+        for alias, name in cls._aliases.items():
+            if getattr(model, name) is None:
+                setattr(model, name, data.get(alias))
+        return model
+
+    @classmethod
+    def from_json(cls, text: str, start: int) -> "_Model":
+        return cls.from_dict(_DECODER.raw_decode(text, start)[0])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{k}={v!r}" for k, v in self.to_dict().items())
+        return f"{type(self).__name__}({fields})"
+
+
+class RunOutput(_Model):
+    __slots__ = ("video_id", "video_url", "thumbnail_url", "completed_at")
+    _aliases = {"url": "video_url"}  # some responses use "url"
+
+
+class RunInput(_Model):
+    __slots__ = ("video_id", "video_url", "file_name", "file_url", "thumbnail_url", "uploaded_at")
+
+
+class TriggeredBy(_Model):
+    __slots__ = ("type", "channel_id", "channel_name", "video_id", "video_title", "video_url",
+                 "triggered_at", "youtube")
+
+
+class RunStatus:
+    """
+    One /agent_run/{id} response held as its JSON text.
+
+    Top-level fields are located on first use (the scan stops at the
+    requested key) and decoded on every access; only their offsets are kept.
+    """
+
+    __slots__ = ("text", "_spans", "_scan")
+
+    def __init__(self, body):
+        # ASCII JSON (the usual case) is stored one byte per character
+        self.text: str = body.decode("utf-8") if isinstance(body, (bytes, bytearray)) else body
+        self._spans: Dict[str, int] = {}
+        self._scan: Optional[Iterator[Tuple[str, int]]] = iter_members(self.text, 0)
+
+    @classmethod
+    def from_response(cls, response) -> "RunStatus":
+        return cls(response.content)
+
+    def _start(self, key: str) -> Optional[int]:
+        start = self._spans.get(key)
+        if start is not None or self._scan is None:
+            return start
+        for found, start in self._scan:
+            self._spans.setdefault(found, start)
+            if found == key:
+                return start
+        self._scan = None
+        return None
+
+    def get(self, key: str, default: Any = None) -> Any:
+        start = self._start(key)
+        return default if start is None else decode(self.text, start)
+
+    @property
+    def status(self) -> Optional[str]:
+        return self.get("status")
+
+    @property
+    def run_id(self) -> Optional[str]:
+        return self.get("run_id")
+
+    @property
+    def agent_id(self) -> Optional[str]:
+        return self.get("agent_id")
+
+    def _elements(self, key: str) -> Iterator[Any]:
+        # One element's objects at a time; each is dropped once its fields are copied
+        start = self._start(key)
+        if start is None or self.text[start] != "[":
+            return iter(())
+        return iter_values(self.text, start)
+
+    @property
+    def outputs(self) -> Tuple[RunOutput, ...]:
+        return tuple(RunOutput.from_dict(o) for o in self._elements("outputs") if isinstance(o, dict))
+
+    @property
+    def inputs(self) -> Tuple[RunInput, ...]:
+        return tuple(RunInput.from_dict(i) for i in self._elements("inputs") if isinstance(i, dict))
+
+    @property
+    def triggered_by(self) -> Optional[TriggeredBy]:
+        start = self._start("triggered_by")
+        if start is None or self.text[start] != "{":
+            return None
+        return TriggeredBy.from_json(self.text, start)
+
+    def output_count(self) -> int:
+        start = self._start("outputs")
+        if start is None or self.text[start] != "[":
+            return 0
+        return sum(1 for _ in iter_elements(self.text, start))
+
+    def output_urls(self) -> List[Optional[str]]:
+        """video_url (or url) of every output, in order; None where an output has neither."""
+        return [(o.get("video_url") or o.get("url")) if isinstance(o, dict) else None
+                for o in self._elements("outputs")]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return json.loads(self.text)
+
+    def __repr__(self) -> str:
+        return f"RunStatus(status={self.status!r}, {len(self.text)} chars)"
@@ -0,0 +1,515 @@
+#!/usr/bin/env python3
+"""
+Durable run admission queue with a max-in-flight dispatcher.
+
+run_agent.py --queue records runs in a local SQLite file instead of starting
+them; the dispatcher then starts them through the same /agent/{id}/run call
+(retrying 429/503 with its pacing), keeping at most --max-in-flight runs
+active overall and at most --max-per-agent per agent. A slot is released when
+the run's RUN_FINISHED reaches a listener started with --run-queue, or when a
+status poll finds the run completed or failed, so Mosaic sees a steady load
+instead of a burst it has to queue or refuse.
+
+Each queued run moves through:
+
+  queued -> submitting -> running -> completed | failed
+                     \\-> rejected   (the API refused it; requeue to retry)
+                     \\-> unknown    (interrupted mid-POST, 5xx or dropped connection; check Mosaic, then requeue)
+
+A run is marked "submitting" in the database before its POST is sent, so a
+dispatcher that is killed and restarted never sends the same run twice: runs
+it finds mid-submission become "unknown" rather than being resubmitted.
+Several dispatchers on one host may share a database: claims are made in a
+single write transaction, and only the submissions of dispatchers that are
+no longer running are treated as interrupted.
+
+Usage:
+  python run_agent.py --agent-id AGENT_ID --video-ids-file ids.txt --queue --callback-url URL/webhooks/mosaic
+  python webhook_listener.py --run-queue                  # releases slots on RUN_FINISHED
+  python run_queue.py dispatch --max-in-flight 8 [--max-per-agent 2] [--drain]
+  python run_queue.py status [--json]
+  python run_queue.py requeue 12 13                       # after checking "unknown" runs in Mosaic
+  python run_queue.py release --run-id RUN_ID [--status failed]
+
+Environment:
+  MOSAIC_RUN_QUEUE=/var/lib/mosaic/runs.db   # queue file (default: ~/.mosaic/run_queue.db)
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATES = ("submitting", "running")
+TERMINAL_STATUSES = ("completed", "failed")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    agent_id      TEXT NOT NULL,
+    video_ids     TEXT NOT NULL,
+    callback_url  TEXT,
+    state         TEXT NOT NULL DEFAULT 'queued',
+    run_id        TEXT UNIQUE,
+    attempts      INTEGER NOT NULL DEFAULT 0,
+    owner         INTEGER,
+    not_before    REAL NOT NULL DEFAULT 0,
+    last_polled   REAL NOT NULL DEFAULT 0,
+    enqueued_at   TEXT NOT NULL,
+    submitted_at  TEXT,
+    finished_at   TEXT,
+    error         TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_state ON runs (state, id);
+CREATE INDEX IF NOT EXISTS runs_agent ON runs (agent_id, state);
+-- RUN_FINISHED events seen by a listener, kept briefly in case one arrives
+-- before the dispatcher has recorded the run_id its POST returned
+CREATE TABLE IF NOT EXISTS finished (
+    run_id  TEXT PRIMARY KEY,
+    status  TEXT NOT NULL,
+    at      REAL NOT NULL
+);
+"""
+
+
+def default_path() -> str:
+    return os.environ.get("MOSAIC_RUN_QUEUE") or os.path.join(os.path.expanduser("~"), ".mosaic", "run_queue.db")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class _Closing:
+    """sqlite3 connections don't close on `with`; this one does."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None and self.conn.in_transaction:
+            self.conn.execute("ROLLBACK")
+        self.conn.close()
+
+
+class RunQueue:
+    """
+    The queue file. Every call opens its own short-lived connection, so one
+    instance can be shared by the listener's request threads and the
+    dispatcher's submit threads.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or default_path()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> _Closing:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=FULL")
+        return _Closing(conn)
+
+    # --- producers -------------------------------------------------------
+
+    def enqueue(self, agent_id: str, video_ids: List[str], callback_url: Optional[str] = None) -> int:
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO runs (agent_id, video_ids, callback_url, enqueued_at) VALUES (?, ?, ?, ?)",
+                (agent_id, json.dumps(video_ids), callback_url, _now()),
+            )
+            return cur.lastrowid
+
+    def enqueue_many(self, agent_id: str, shards: List[List[str]], callback_url: Optional[str] = None) -> List[int]:
+        """Enqueue several runs in one transaction."""
+        ids = []
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for shard in shards:
+                cur = conn.execute(
+                    "INSERT INTO runs (agent_id, video_ids, callback_url, enqueued_at) VALUES (?, ?, ?, ?)",
+                    (agent_id, json.dumps(shard), callback_url, _now()),
+                )
+                ids.append(cur.lastrowid)
+            conn.execute("COMMIT")
+        return ids
+
+    def video_ids_for(self, agent_id: str) -> set:
+        """Video ids already queued or run for an agent (rejected runs excluded)."""
+        seen = set()
+        with self._connect() as conn:
+            for row in conn.execute("SELECT video_ids FROM runs WHERE agent_id = ? AND state != 'rejected'",
+                                    (agent_id,)):
+                seen.update(json.loads(row["video_ids"]))
+        return seen
+
+    # --- dispatcher ------------------------------------------------------
+
+    def recover(self) -> int:
+        """Mark runs left mid-submission by a dead dispatcher as unknown; returns how many."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            orphans = [row["id"] for row in conn.execute("SELECT id, owner FROM runs WHERE state = 'submitting'")
+                       if not _alive(row["owner"])]
+            for job_id in orphans:
+                conn.execute("UPDATE runs SET state = 'unknown', error = ? WHERE id = ?",
+                             ("dispatcher stopped during submission; check Mosaic before requeueing", job_id))
+            conn.execute("COMMIT")
+        return len(orphans)
+
+    def claim(self, limit: int, max_in_flight: int, max_per_agent: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Move up to `limit` due runs to "submitting" without exceeding either budget."""
+        claimed = []
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            placeholders = ",".join("?" * len(ACTIVE_STATES))
+            in_flight = conn.execute(f"SELECT COUNT(*) FROM runs WHERE state IN ({placeholders})",
+                                     ACTIVE_STATES).fetchone()[0]
+            per_agent = {
+                row["agent_id"]: row["n"]
+                for row in conn.execute(f"SELECT agent_id, COUNT(*) AS n FROM runs WHERE state IN ({placeholders}) "
+                                        "GROUP BY agent_id", ACTIVE_STATES)
+            }
+            while len(claimed) < limit and in_flight < max_in_flight:
+                full = [a for a, n in per_agent.items() if max_per_agent and n >= max_per_agent]
+                row = conn.execute(
+                    "SELECT * FROM runs WHERE state = 'queued' AND not_before <= ? "
+                    f"AND agent_id NOT IN ({','.join('?' * len(full))}) ORDER BY id LIMIT 1",
+                    (time.time(), *full),
+                ).fetchone()
+                if row is None:
+                    break
+                conn.execute("UPDATE runs SET state = 'submitting', attempts = attempts + 1, submitted_at = ?, "
+                             "owner = ? WHERE id = ?", (_now(), os.getpid(), row["id"]))
+                claimed.append(dict(row, video_ids=json.loads(row["video_ids"])))
+                in_flight += 1
+                per_agent[row["agent_id"]] = per_agent.get(row["agent_id"], 0) + 1
+            conn.execute("COMMIT")
+        return claimed
+
+    def started(self, job_id: int, run_id: str) -> str:
+        """Record the run_id of a submitted run; returns its state (already finished if the webhook won)."""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            early = conn.execute("SELECT status FROM finished WHERE run_id = ?", (run_id,)).fetchone()
+            state = early["status"] if early else "running"
+            conn.execute("UPDATE runs SET state = ?, run_id = ?, last_polled = ?, finished_at = ?, error = NULL "
+                         "WHERE id = ?", (state, run_id, time.time(), _now() if early else None, job_id))
+            conn.execute("COMMIT")
+        return state
+
+    def retry_later(self, job_id: int, delay: float, error: str) -> None:
+        """The API turned the run away without creating it: back to the queue after `delay`."""
+        with self._connect() as conn:
+            conn.execute("UPDATE runs SET state = 'queued', not_before = ?, error = ? WHERE id = ?",
+                         (time.time() + delay, error, job_id))
+
+    def settle(self, job_id: int, state: str, error: str) -> None:
+        """A submission that ended in "rejected" or "unknown"."""
+        with self._connect() as conn:
+            conn.execute("UPDATE runs SET state = ?, error = ?, finished_at = ? WHERE id = ?",
+                         (state, error, _now(), job_id))
+
+    def due_for_poll(self, interval: float, limit: int) -> List[str]:
+        """Running run_ids whose status hasn't been checked for `interval` seconds."""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT run_id FROM runs WHERE state = 'running' AND last_polled <= ? "
+                                "ORDER BY last_polled LIMIT ?", (time.time() - interval, limit)).fetchall()
+        return [row["run_id"] for row in rows]
+
+    def polled(self, run_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE runs SET last_polled = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def prune_finished(self, max_age: float = 86400) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM finished WHERE at < ?", (time.time() - max_age,))
+
+    # --- listener / operators --------------------------------------------
+
+    def release(self, run_id: str, status: str = "completed") -> bool:
+        """Free a run's slot because it reached a terminal status; False if it isn't an active queued run."""
+        status = status if status in TERMINAL_STATUSES else "completed"
+        placeholders = ",".join("?" * len(ACTIVE_STATES))
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            cur = conn.execute(f"UPDATE runs SET state = ?, finished_at = ? WHERE run_id = ? "
+                               f"AND state IN ({placeholders})", (status, _now(), run_id, *ACTIVE_STATES))
+            if cur.rowcount == 0:
+                conn.execute("INSERT OR REPLACE INTO finished (run_id, status, at) VALUES (?, ?, ?)",
+                             (run_id, status, time.time()))
+            conn.execute("COMMIT")
+        return cur.rowcount > 0
+
+    def requeue(self, job_ids: List[int]) -> int:
+        """Put rejected or unknown runs back in the queue."""
+        with self._connect() as conn:
+            cur = conn.execute(
+                f"UPDATE runs SET state = 'queued', not_before = 0, error = NULL, finished_at = NULL "
+                f"WHERE state IN ('rejected', 'unknown') AND id IN ({','.join('?' * len(job_ids))})",
+                job_ids,
+            )
+            return cur.rowcount
+
+    def counts(self) -> Dict[str, Any]:
+        with self._connect() as conn:
+            states = {row["state"]: row["n"] for row in
+                      conn.execute("SELECT state, COUNT(*) AS n FROM runs GROUP BY state")}
+            placeholders = ",".join("?" * len(ACTIVE_STATES))
+            per_agent = {row["agent_id"]: row["n"] for row in
+                         conn.execute(f"SELECT agent_id, COUNT(*) AS n FROM runs WHERE state IN ({placeholders}) "
+                                      "GROUP BY agent_id", ACTIVE_STATES)}
+            attention = [dict(row) for row in
+                         conn.execute("SELECT id, agent_id, state, error FROM runs "
+                                      "WHERE state IN ('rejected', 'unknown') ORDER BY id LIMIT 20")]
+        return {
+            "states": states,
+            "in_flight": sum(states.get(s, 0) for s in ACTIVE_STATES),
+            "in_flight_per_agent": per_agent,
+            "needs_attention": attention,
+        }
+
+
+class Dispatcher:
+    """Starts queued runs as slots free up; one per process is enough, several are safe."""
+
+    def __init__(self, queue: RunQueue, base_url: str, api_key: str, max_in_flight: int,
+                 max_per_agent: Optional[int] = None, concurrency: int = 4, poll_interval: float = 30.0,
+                 tick: float = 0.2, max_retries: int = 8, initial_rate: float = 2.0, max_rate: float = 20.0):
+        # Imported here so the listener can release slots without the API client modules
+        from run_agent import AimdPacer
+
+        self.queue = queue
+        self.base_url = base_url
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self.max_in_flight = max_in_flight
+        self.max_per_agent = max_per_agent
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.tick = tick
+        self.max_retries = max_retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=concurrency + 1)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Spaces the POSTs themselves, backing off on 429s like run_agent.py
+        self.pacer = AimdPacer(rate=initial_rate, min_rate=min(0.1, initial_rate), max_rate=max_rate)
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+        self.submitting = 0
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.counters = {"started": 0, "rejected": 0, "unknown": 0, "deferred": 0, "released_by_poll": 0}
+
+    def run(self, drain: bool = False) -> None:
+        recovered = self.queue.recover()
+        if recovered:
+            print(f"⚠️  {recovered} runs were mid-submission when the last dispatcher stopped; marked unknown "
+                  f"(check Mosaic, then: python run_queue.py requeue ID...)")
+        last_prune = 0.0
+        while True:
+            self.poll_terminal()
+            with self.lock:
+                free = self.concurrency - self.submitting
+            for job in self.queue.claim(free, self.max_in_flight, self.max_per_agent) if free > 0 else []:
+                with self.lock:
+                    self.submitting += 1
+                self.pool.submit(self._submit, job)
+            if time.monotonic() - last_prune > 3600:
+                self.queue.prune_finished()
+                last_prune = time.monotonic()
+            if drain:
+                counts = self.queue.counts()
+                with self.lock:
+                    busy = self.submitting
+                if not busy and not counts["in_flight"] and not counts["states"].get("queued"):
+                    self.pool.shutdown()
+                    return
+            self.wakeup.wait(self.tick)
+            self.wakeup.clear()
+
+    def _submit(self, job: Dict[str, Any]) -> None:
+        from run_agent import OutcomeUnknown, parse_retry_after, submit_shard
+
+        label = f"#{job['id']} ({job['agent_id']}, {len(job['video_ids'])} videos)"
+        try:
+            run_id = submit_shard(self.session, self.pacer, self.base_url, self.headers, job["agent_id"],
+                                  job["video_ids"], job["callback_url"], self.max_retries)
+            state = self.queue.started(job["id"], run_id)
+            self._count("started")
+            print(f"   ✅ {label} -> {run_id}" + (f" (already {state})" if state != "running" else ""))
+        except requests.HTTPError as e:
+            response = e.response
+            status = response.status_code if response is not None else None
+            detail = f"{e} {response.text if response is not None else ''}".strip()
+            if status in (429, 503):
+                # Refused without being created: safe to try again once the server asks
+                delay = parse_retry_after(response.headers.get("Retry-After")) or 30.0
+                self.queue.retry_later(job["id"], delay, detail)
+                self._count("deferred")
+                print(f"   ⏳ {label} deferred {delay:.0f}s: {detail}")
+            else:
+                self.queue.settle(job["id"], "rejected", detail)
+                self._count("rejected")
+                print(f"   ❌ {label} rejected: {detail}")
+        except OutcomeUnknown as e:
+            # 5xx, dropped connection or read timeout: the run may exist, so never resend it automatically
+            self.queue.settle(job["id"], "unknown", str(e))
+            self._count("unknown")
+            print(f"   ⚠️  {label} outcome unknown: {e}")
+        except (RuntimeError, ValueError) as e:
+            # Retries ran out on 429/503 or unreachable connections (nothing was created),
+            # or no run_id came back
+            self.queue.settle(job["id"], "rejected", str(e))
+            self._count("rejected")
+            print(f"   ❌ {label} rejected: {e}")
+        except requests.RequestException as e:
+            # Anything submit_shard didn't classify: assume the run may exist
+            self.queue.settle(job["id"], "unknown", f"{type(e).__name__}: {e}")
+            self._count("unknown")
+            print(f"   ⚠️  {label} outcome unknown: {e}")
+        finally:
+            with self.lock:
+                self.submitting -= 1
+            self.wakeup.set()
+
+    def poll_terminal(self) -> None:
+        """Release runs whose RUN_FINISHED never reached a listener."""
+        if self.poll_interval <= 0:
+            return
+        from get_status import request_status
+
+        for run_id in self.queue.due_for_poll(self.poll_interval, limit=self.max_in_flight):
+            try:
+                status = request_status(self.session, self.base_url, self.headers, run_id, compact=True).status
+            except (requests.RequestException, ValueError) as e:
+                logger.warning(f"Status poll for {run_id} failed: {e}")
+                status = None
+            if status in TERMINAL_STATUSES and self.queue.release(run_id, status):
+                self._count("released_by_poll")
+                print(f"   🏁 {run_id} {status} (polled)")
+            else:
+                self.queue.polled(run_id)
+
+    def _count(self, name: str) -> None:
+        with self.lock:
+            self.counters[name] += 1
+
+
+def print_counts(counts: Dict[str, Any]) -> None:
+    states = counts["states"]
+    order = ("queued", "submitting", "running", "completed", "failed", "rejected", "unknown")
+    print("📋 " + "  ".join(f"{s} {states.get(s, 0)}" for s in order))
+    if counts["in_flight_per_agent"]:
+        print("   in flight: " + ", ".join(f"{a} {n}" for a, n in sorted(counts["in_flight_per_agent"].items())))
+    for row in counts["needs_attention"]:
+        print(f"   #{row['id']} {row['state']:<8} {row['agent_id']}: {row['error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Durable Mosaic run queue and dispatcher")
+    parser.add_argument("--db", help="Queue file (default: MOSAIC_RUN_QUEUE or ~/.mosaic/run_queue.db)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    dispatch = sub.add_parser("dispatch", help="Start queued runs, keeping at most N in flight")
+    dispatch.add_argument("--max-in-flight", type=int, default=8, help="Runs active at once overall (default: 8)")
+    dispatch.add_argument("--max-per-agent", type=int, help="Runs active at once per agent (default: no limit)")
+    dispatch.add_argument("--concurrency", type=int, default=4, help="Submissions in progress at once (default: 4)")
+    dispatch.add_argument("--poll-interval", type=float, default=30.0,
+                          help="Seconds between status polls of a running run; 0 relies on the listener (default: 30)")
+    dispatch.add_argument("--max-retries", type=int, default=8, help="Retries per submission on 429/5xx (default: 8)")
+    dispatch.add_argument("--initial-rate", type=float, default=2.0, help="Starting submissions per second (default: 2)")
+    dispatch.add_argument("--max-rate", type=float, default=20.0, help="Highest rate to ramp up to (default: 20)")
+    dispatch.add_argument("--drain", action="store_true", help="Exit once nothing is queued or in flight")
+    dispatch.add_argument("--api-key", help="Mosaic API key (or use MOSAIC_API_KEY env var)")
+    dispatch.add_argument("--base-url", default="https://api.mosaic.so")
+
+    status = sub.add_parser("status", help="Show queue counts")
+    status.add_argument("--json", action="store_true")
+
+    requeue = sub.add_parser("requeue", help="Queue rejected or unknown runs again")
+    requeue.add_argument("ids", type=int, nargs="+")
+
+    release = sub.add_parser("release", help="Free a run's slot by hand")
+    release.add_argument("--run-id", required=True)
+    release.add_argument("--status", choices=TERMINAL_STATUSES, default="completed")
+
+    args = parser.parse_args()
+    queue = RunQueue(args.db)
+
+    if args.command == "status":
+        counts = queue.counts()
+        if args.json:
+            print(json.dumps(counts, indent=2))
+        else:
+            print_counts(counts)
+        return
+
+    if args.command == "requeue":
+        print(f"🔁 Requeued {queue.requeue(args.ids)} of {len(args.ids)} runs")
+        return
+
+    if args.command == "release":
+        if queue.release(args.run_id, args.status):
+            print(f"✅ Released {args.run_id}")
+        else:
+            print(f"⚠️  {args.run_id} is not an active queued run")
+        return
+
+    from run_agent import resolve_api_key
+    api_key = resolve_api_key(args.api_key)
+    if args.max_in_flight < 1 or args.concurrency < 1 or (args.max_per_agent is not None and args.max_per_agent < 1):
+        print("❌ --max-in-flight, --max-per-agent and --concurrency must be at least 1")
+        sys.exit(1)
+    if not 0 < args.initial_rate <= args.max_rate:
+        print("❌ Rates must satisfy 0 < --initial-rate <= --max-rate")
+        sys.exit(1)
+    dispatcher = Dispatcher(queue, args.base_url, api_key, args.max_in_flight, args.max_per_agent,
+                            args.concurrency, args.poll_interval, max_retries=args.max_retries,
+                            initial_rate=args.initial_rate, max_rate=args.max_rate)
+    per_agent = f", {args.max_per_agent} per agent" if args.max_per_agent else ""
+    print(f"🚦 Dispatching from {queue.path}: max {args.max_in_flight} in flight{per_agent}")
+    print_counts(queue.counts())
+    started = time.monotonic()
+    try:
+        dispatcher.run(drain=args.drain)
+    except KeyboardInterrupt:
+        print("\n⏹️  Stopped; runs already started keep their slots until they finish")
+    c = dispatcher.counters
+    print(f"\n📊 {c['started']} started, {c['deferred']} deferred, {c['rejected']} rejected, "
+          f"{c['unknown']} unknown, {c['released_by_poll']} released by polling "
+          f"in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
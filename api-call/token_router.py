@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+"""
+Per-token routing of webhook events to pluggable handlers.
+
+Both listeners accept /webhook/<token> (and /webhooks/mosaic/<token>); with
+--routes routes.json each event whose token matches a route is handed to that
+route's handler, a plain Python function:
+
+  # tenants.py
+  def handle(event: dict, token: str):
+      ...
+
+  {
+    "routes": [
+      {"name": "tenant-a", "pattern": "tenant-a/*", "handler": "tenants:handle",
+       "workers": 4, "queue_size": 200, "timeout": 10},
+      {"name": "transcode", "pattern": "pipeline/transcode", "handler": "./heavy.py:process",
+       "mode": "process", "workers": 2, "timeout": 120}
+    ]
+  }
+
+Patterns are shell-style globs matched against the token; the first matching
+route wins and events without a matching route are not dispatched. Handlers
+are "module:function" (importable from the routes file's directory) or
+"path/to/file.py:function".
+
+Every route has its own bounded queue and its own workers, so a slow or
+CPU-heavy handler only ever delays its own route:
+  - mode "thread" (default): handlers run on the route's threads. A call that
+    overruns its timeout is counted and abandoned so the route keeps moving;
+    the call itself can't be interrupted and finishes in the background. It
+    keeps holding one of the route's `workers` slots until it does, so a hung
+    handler never grows the thread count: once every slot is held by an
+    abandoned call the route is degraded, takes no jobs, and its full queue
+    is answered with 503 until a call returns.
+  - mode "process": each worker is a separate process (own GIL); a call that
+    overruns its timeout has its process killed and replaced.
+The listener only enqueues, so acks never wait for a handler. A full queue is
+answered with 503 + Retry-After so Mosaic redelivers later instead of the
+event being dropped.
+"""
+
+import fnmatch
+import importlib
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+MODES = ("thread", "process")
+LATENCY_WINDOW = 1000  # recent handler durations kept per route for percentiles
+
+
+class RouteError(Exception):
+    """Raised for an invalid routing table."""
+
+
+def load_handler(spec: str, base_dir: str = ".") -> Callable[[Dict[str, Any], str], Any]:
+    """Resolve "module:function" or "path/to/file.py:function"."""
+    target, sep, attr = spec.rpartition(":")
+    if not sep or not target or not attr:
+        raise RouteError(f"handler '{spec}' must look like 'module:function' or 'file.py:function'")
+    if target.endswith(".py"):
+        path = target if os.path.isabs(target) else os.path.join(base_dir, target)
+        name = f"mosaic_route_{os.path.splitext(os.path.basename(path))[0]}"
+        module_spec = importlib.util.spec_from_file_location(name, path)
+        if module_spec is None or module_spec.loader is None:
+            raise RouteError(f"cannot load handler file {path}")
+        module = importlib.util.module_from_spec(module_spec)
+        module_spec.loader.exec_module(module)
+    else:
+        if base_dir not in sys.path:
+            sys.path.insert(0, base_dir)
+        module = importlib.import_module(target)
+    handler = getattr(module, attr, None)
+    if not callable(handler):
+        raise RouteError(f"handler '{spec}' is not a callable")
+    return handler
+
+
+def _process_worker(spec: str, base_dir: str, conn) -> None:
+    """Worker process loop: receive (event, token), reply (ok, error)."""
+    handler = load_handler(spec, base_dir)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        event, token = job
+        try:
+            handler(event, token)
+            conn.send((True, None))
+        except Exception as e:  # reported to the parent as a failed call
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+class _WorkerProcess:
+    def __init__(self, ctx, spec: str, base_dir: str):
+        self.ctx, self.spec, self.base_dir = ctx, spec, base_dir
+        self.start()
+
+    def start(self) -> None:
+        self.conn, child = self.ctx.Pipe()
+        self.process = self.ctx.Process(target=_process_worker, args=(self.spec, self.base_dir, child), daemon=True)
+        self.process.start()
+        child.close()
+
+    def call(self, event: Dict[str, Any], token: str, timeout: float) -> Tuple[str, Optional[str]]:
+        """Returns ("ok" | "failed" | "timeout", error)."""
+        try:
+            self.conn.send((event, token))
+            if not self.conn.poll(timeout):
+                self.restart()
+                return "timeout", f"killed after {timeout:g}s"
+            ok, error = self.conn.recv()
+        except (EOFError, OSError) as e:
+            self.restart()
+            return "failed", f"worker process died: {e}"
+        return ("ok", None) if ok else ("failed", error)
+
+    def restart(self) -> None:
+        self.process.kill()
+        self.process.join(5)
+        self.conn.close()
+        self.start()
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(2)
+        if self.process.is_alive():
+            self.process.kill()
+
+
+class Route:
+    """One routing-table entry with its own queue, workers and metrics."""
+
+    def __init__(self, name: str, pattern: str, handler: str, base_dir: str = ".", mode: str = "thread",
+                 workers: int = 2, queue_size: int = 100, timeout: float = 30.0):
+        if mode not in MODES:
+            raise RouteError(f"route '{name}': mode must be one of {', '.join(MODES)}")
+        if workers < 1 or queue_size < 1 or timeout <= 0:
+            raise RouteError(f"route '{name}': workers and queue_size must be >= 1 and timeout > 0")
+        self.name = name
+        self.pattern = pattern
+        self.handler_spec = handler
+        self.base_dir = base_dir
+        self.mode = mode
+        self.workers = workers
+        self.timeout = timeout
+        self.queue: "queue.Queue[Optional[Tuple[Dict[str, Any], str, float]]]" = queue.Queue(maxsize=queue_size)
+        # Resolved up front so a typo fails at startup; process workers load their own copy
+        self.handler = load_handler(handler, base_dir)
+        self.lock = threading.Lock()
+        self.counts = {"accepted": 0, "rejected": 0, "completed": 0, "failed": 0, "timed_out": 0, "abandoned": 0}
+        self.in_flight = 0
+        # Thread mode: one slot per running handler call, abandoned ones included
+        self.call_slots = threading.Semaphore(workers)
+        self.stuck = 0  # abandoned calls still running
+        self.durations: deque = deque(maxlen=LATENCY_WINDOW)
+        self.queue_waits: deque = deque(maxlen=LATENCY_WINDOW)
+        self.last_error: Optional[str] = None
+        self.threads: List[threading.Thread] = []
+        self.processes: List[_WorkerProcess] = []
+
+    def matches(self, token: Optional[str]) -> bool:
+        return fnmatch.fnmatchcase(token or "", self.pattern)
+
+    def start(self) -> None:
+        ctx = multiprocessing.get_context("spawn") if self.mode == "process" else None
+        for index in range(self.workers):
+            worker = _WorkerProcess(ctx, self.handler_spec, self.base_dir) if ctx else None
+            if worker:
+                self.processes.append(worker)
+            thread = threading.Thread(target=self._work, args=(worker,), name=f"route-{self.name}-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self) -> None:
+        for _ in self.threads:
+            try:
+                self.queue.put_nowait(None)
+            except queue.Full:
+                break
+        for worker in self.processes:
+            worker.stop()
+
+    def submit(self, event: Dict[str, Any], token: str) -> bool:
+        """Enqueue without blocking; False when the route's queue is full."""
+        try:
+            self.queue.put_nowait((event, token, time.monotonic()))
+        except queue.Full:
+            with self.lock:
+                self.counts["rejected"] += 1
+            return False
+        with self.lock:
+            self.counts["accepted"] += 1
+        return True
+
+    def _call_in_thread(self, event: Dict[str, Any], token: str) -> Tuple[str, Optional[str]]:
+        """Run the handler on a call thread holding a slot from call_slots, released when it returns."""
+        outcome: Dict[str, Any] = {"abandoned": False}
+
+        def run() -> None:
+            try:
+                self.handler(event, token)
+                outcome["result"] = ("ok", None)
+            except Exception as e:
+                logger.exception(f"Route '{self.name}' handler failed")
+                outcome["result"] = ("failed", f"{type(e).__name__}: {e}")
+            finally:
+                with self.lock:
+                    outcome["done"] = True
+                    if outcome["abandoned"]:
+                        self.stuck -= 1
+                self.call_slots.release()
+
+        runner = threading.Thread(target=run, name=f"route-{self.name}-call", daemon=True)
+        runner.start()
+        runner.join(self.timeout)
+        with self.lock:
+            if not outcome.get("done"):
+                outcome["abandoned"] = True
+                self.stuck += 1
+                self.counts["abandoned"] += 1
+                return "timeout", f"still running after {self.timeout:g}s (abandoned, holds a worker slot)"
+        return outcome["result"]
+
+    def _work(self, worker: Optional[_WorkerProcess]) -> None:
+        while True:
+            if worker is None:
+                # Blocks while abandoned calls hold every slot
+                self.call_slots.acquire()
+            job = self.queue.get()
+            if job is None:
+                if worker is None:
+                    self.call_slots.release()
+                return
+            event, token, enqueued = job
+            started = time.monotonic()
+            with self.lock:
+                self.in_flight += 1
+                self.queue_waits.append(started - enqueued)
+            if worker is not None:
+                result, error = worker.call(event, token, self.timeout)
+            else:
+                result, error = self._call_in_thread(event, token)
+            elapsed = time.monotonic() - started
+            with self.lock:
+                self.in_flight -= 1
+                self.durations.append(elapsed)
+                self.counts[{"ok": "completed", "failed": "failed", "timeout": "timed_out"}[result]] += 1
+                if error:
+                    self.last_error = error
+            if error:
+                logger.warning(f"Route '{self.name}' ({token}): {error}")
+
+    def metrics(self) -> Dict[str, Any]:
+        def pct(values: List[float], p: float) -> Optional[float]:
+            if not values:
+                return None
+            values = sorted(values)
+            return round(values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000, 1)
+
+        with self.lock:
+            durations, waits = list(self.durations), list(self.queue_waits)
+            return {
+                "pattern": self.pattern,
+                "handler": self.handler_spec,
+                "mode": self.mode,
+                "workers": self.workers,
+                "timeout_s": self.timeout,
+                "queue_depth": self.queue.qsize(),
+                "queue_size": self.queue.maxsize,
+                "in_flight": self.in_flight,
+                "stuck_calls": self.stuck,
+                "degraded": self.mode == "thread" and self.stuck >= self.workers,
+                **self.counts,
+                "handler_ms": {"p50": pct(durations, 50), "p95": pct(durations, 95), "max": pct(durations, 100)},
+                "queue_wait_ms": {"p50": pct(waits, 50), "p95": pct(waits, 95), "max": pct(waits, 100)},
+                "last_error": self.last_error,
+            }
+
+
+class TokenRouter:
+    """Ordered routing table: the first route whose pattern matches the token gets the event."""
+
+    def __init__(self, routes: List[Route]):
+        names = [r.name for r in routes]
+        if len(set(names)) != len(names):
+            raise RouteError("route names must be unique")
+        self.routes = routes
+        self.unrouted = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path: str) -> "TokenRouter":
+        with open(path, "r", encoding="utf-8") as f:
+            spec = json.load(f)
+        entries = spec.get("routes") if isinstance(spec, dict) else None
+        if not isinstance(entries, list) or not entries:
+            raise RouteError("routing table needs a non-empty 'routes' list")
+        base_dir = os.path.dirname(os.path.abspath(path))
+        routes = []
+        for index, entry in enumerate(entries, 1):
+            if not entry.get("pattern") or not entry.get("handler"):
+                raise RouteError(f"route #{index} needs 'pattern' and 'handler'")
+            routes.append(Route(
+                name=entry.get("name") or entry["pattern"],
+                pattern=entry["pattern"],
+                handler=entry["handler"],
+                base_dir=base_dir,
+                mode=entry.get("mode", "thread"),
+                workers=int(entry.get("workers", 2)),
+                queue_size=int(entry.get("queue_size", 100)),
+                timeout=float(entry.get("timeout", 30)),
+            ))
+        return cls(routes)
+
+    def start(self) -> None:
+        for route in self.routes:
+            route.start()
+
+    def stop(self) -> None:
+        for route in self.routes:
+            route.stop()
+
+    def match(self, token: Optional[str]) -> Optional[Route]:
+        for route in self.routes:
+            if route.matches(token):
+                return route
+        return None
+
+    def dispatch(self, event: Dict[str, Any], token: Optional[str]) -> Tuple[Optional[str], bool]:
+        """Returns (route name or None, accepted). Never blocks."""
+        route = self.match(token)
+        if route is None:
+            with self.lock:
+                self.unrouted += 1
+            return None, True
+        return route.name, route.submit(event, token or "")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self.lock:
+            unrouted = self.unrouted
+        return {"unrouted": unrouted, "routes": {route.name: route.metrics() for route in self.routes}}
@@ -0,0 +1,472 @@
+#!/usr/bin/env python3
+"""
+Cross-stage tracing: upload -> run submission -> webhook callbacks.
+
+When MOSAIC_TRACE_FILE and/or MOSAIC_TRACE_ENDPOINT is set, each stage emits
+spans in OpenTelemetry's OTLP/JSON encoding:
+  - upload_video.py:     "mosaic.upload" (+ one child per step), trace keyed by video_id
+  - start_run() callers: "mosaic.run.submit", trace keyed by run_id, linked to
+                         the upload traces of its video_ids
+  - webhook listeners:   "webhook <FLAG>" per callback; RUN_FINISHED closes the
+                         run's trace with a "mosaic.agent_run" root span
+
+Trace and root span ids are derived from the video_id / run_id, so separate
+processes land in the same trace without sharing state. The file holds one
+OTLP ExportTraceServiceRequest per line (what the collector's file exporter
+writes and otlpjsonfile receiver reads); the endpoint gets the same JSON
+POSTed to <endpoint>/v1/traces.
+
+Environment:
+  MOSAIC_TRACE_FILE=traces.jsonl                # append spans to this file
+  MOSAIC_TRACE_ENDPOINT=http://localhost:4318   # also export to an OTLP/HTTP collector
+
+Usage:
+  python tracing.py summary [--file traces.jsonl] [--run-id RUN_ID] [--json]
+
+The summary splits each run's latency into our side (upload, gap until
+submission, submission request) and Mosaic's side (queue wait until
+RUN_STARTED, processing until RUN_FINISHED, callback delivery). Timestamps
+come from each process's wall clock, so run every stage on hosts with
+synchronized clocks.
+"""
+
+import argparse
+import atexit
+import hashlib
+import json
+import os
+import queue
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: rely on append-mode writes
+    fcntl = None
+
+
+SPAN_KIND_INTERNAL, SPAN_KIND_SERVER, SPAN_KIND_CLIENT = 1, 2, 3
+STATUS_OK, STATUS_ERROR = 1, 2
+
+# Runs whose RUN_STARTED we've seen but RUN_FINISHED we haven't
+MAX_OPEN_RUNS = 100_000
+
+_warned = False
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def trace_file() -> Optional[str]:
+    return os.environ.get("MOSAIC_TRACE_FILE") or None
+
+
+def trace_endpoint() -> Optional[str]:
+    endpoint = os.environ.get("MOSAIC_TRACE_ENDPOINT")
+    return endpoint.rstrip("/") if endpoint else None
+
+
+def enabled() -> bool:
+    return bool(trace_file() or trace_endpoint())
+
+
+def _digest(kind: str, key: str) -> str:
+    return hashlib.sha256(f"{kind}:{key}".encode()).hexdigest()
+
+
+def trace_id(kind: str, key: str) -> str:
+    return _digest(kind, key)[:32]
+
+
+def root_span_id(kind: str, key: str) -> str:
+    return _digest(kind, key)[32:48]
+
+
+def new_span_id() -> str:
+    return os.urandom(8).hex()
+
+
+def iso_to_ns(value: Optional[str]) -> Optional[int]:
+    if not value:
+        return None
+    try:
+        return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() * 1e9)
+    except (TypeError, ValueError):
+        return None
+
+
+def default_service() -> str:
+    name = os.path.splitext(os.path.basename(sys.argv[0] or ""))[0]
+    return name or "mosaic"
+
+
+def _attr_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}  # int64 is a string in OTLP/JSON
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [_attr_value(v) for v in value]}}
+    return {"stringValue": str(value)}
+
+
+def _attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": k, "value": _attr_value(v)} for k, v in attributes.items() if v is not None]
+
+
+def make_span(
+    name: str,
+    trace: str,
+    span_id: str,
+    start_ns: int,
+    end_ns: int,
+    attributes: Dict[str, Any],
+    parent_span_id: Optional[str] = None,
+    kind: int = SPAN_KIND_INTERNAL,
+    error: Optional[str] = None,
+    links: Iterable[Tuple[str, str]] = (),
+) -> Dict[str, Any]:
+    span = {
+        "traceId": trace,
+        "spanId": span_id,
+        "name": name,
+        "kind": kind,
+        "startTimeUnixNano": str(start_ns),
+        "endTimeUnixNano": str(max(start_ns, end_ns)),
+        "attributes": _attributes(attributes),
+        "status": {"code": STATUS_ERROR, "message": error} if error else {"code": STATUS_OK},
+    }
+    if parent_span_id:
+        span["parentSpanId"] = parent_span_id
+    links = [{"traceId": t, "spanId": s} for t, s in links]
+    if links:
+        span["links"] = links
+    return span
+
+
+class _HttpExporter:
+    """Posts export requests to an OTLP/HTTP collector from a background thread."""
+
+    def __init__(self, endpoint: str):
+        self.url = f"{endpoint}/v1/traces"
+        self.pending: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=10000)
+        self.thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def submit(self, body: str) -> None:
+        try:
+            self.pending.put_nowait(body)
+        except queue.Full:
+            _warn("trace export queue full; dropping spans")
+
+    def _run(self) -> None:
+        import requests
+
+        session = requests.Session()
+        while True:
+            body = self.pending.get()
+            if body is None:
+                return
+            try:
+                session.post(self.url, data=body, headers={"Content-Type": "application/json"}, timeout=5)
+            except requests.RequestException as e:
+                _warn(f"trace export to {self.url} failed: {e}")
+
+    def close(self, timeout: float = 2.0) -> None:
+        try:
+            self.pending.put_nowait(None)
+        except queue.Full:
+            return
+        self.thread.join(timeout)
+
+
+def _warn(message: str) -> None:
+    global _warned
+    if not _warned:
+        _warned = True
+        print(f"⚠️  Tracing: {message}", file=sys.stderr)
+
+
+def emit(spans: List[Dict[str, Any]], service: Optional[str] = None) -> None:
+    """Write spans to the trace file and/or collector; never raises."""
+    global _exporter
+    if not spans or not enabled():
+        return
+    body = json.dumps({
+        "resourceSpans": [{
+            "resource": {"attributes": _attributes({"service.name": service or default_service()})},
+            "scopeSpans": [{"scope": {"name": "mosaic.tracing"}, "spans": spans}],
+        }]
+    }, separators=(",", ":"))
+
+    path = trace_file()
+    if path:
+        try:
+            with open(path, "a", encoding="utf-8") as f:
+                if fcntl:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                f.write(body + "\n")
+        except OSError as e:
+            _warn(f"cannot write {path}: {e}")
+
+    endpoint = trace_endpoint()
+    if endpoint:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = _HttpExporter(endpoint)
+        _exporter.submit(body)
+
+
+def record_upload(video_id: str, start_ns: int, end_ns: int,
+                  steps: Iterable[Tuple[str, int, int]] = (), attributes: Optional[Dict[str, Any]] = None) -> None:
+    """Emit the upload trace for a finished upload; `steps` become child spans."""
+    if not enabled():
+        return
+    trace, root = trace_id("video", video_id), root_span_id("video", video_id)
+    spans = [make_span("mosaic.upload", trace, root, start_ns, end_ns,
+                       {"mosaic.video_id": video_id, **(attributes or {})})]
+    for name, step_start, step_end in steps:
+        spans.append(make_span(f"upload.{name}", trace, new_span_id(), step_start, step_end,
+                               {"mosaic.video_id": video_id}, parent_span_id=root))
+    emit(spans)
+
+
+def record_run_submit(run_id: str, agent_id: str, video_ids: List[str], start_ns: int, end_ns: int,
+                      callback_url: Optional[str] = None) -> None:
+    """Emit the submission span of a run, linked to the upload traces of its videos."""
+    if not enabled():
+        return
+    links = [(trace_id("video", v), root_span_id("video", v)) for v in video_ids]
+    emit([make_span(
+        "mosaic.run.submit", trace_id("run", run_id), new_span_id(), start_ns, end_ns,
+        {"mosaic.run_id": run_id, "mosaic.agent_id": agent_id, "mosaic.video_ids": list(video_ids),
+         "mosaic.callback_url": callback_url},
+        parent_span_id=root_span_id("run", run_id), kind=SPAN_KIND_CLIENT, links=links,
+    )])
+
+
+class WebhookTracer:
+    """Emits a span per callback and closes a run's trace on RUN_FINISHED."""
+
+    def __init__(self, service: str, max_open_runs: int = MAX_OPEN_RUNS):
+        self.service = service
+        self.max_open_runs = max_open_runs
+        self.started: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, data: Dict[str, Any], received_ns: int, handled_ns: Optional[int] = None) -> None:
+        run_id = data.get("run_id")
+        if not run_id or not enabled():
+            return
+        handled_ns = handled_ns or time.time_ns()
+        flag = data.get("flag") or "UNKNOWN"
+        trace, root = trace_id("run", run_id), root_span_id("run", run_id)
+        triggered_by = data.get("triggered_by") or {}
+        outputs = data.get("outputs") or data.get("output") or []
+        completed = [ns for ns in (iso_to_ns(o.get("completed_at")) for o in outputs if isinstance(o, dict)) if ns]
+        attributes = {
+            "mosaic.run_id": run_id,
+            "mosaic.flag": flag,
+            "mosaic.agent_id": data.get("agent_id"),
+            "mosaic.status": data.get("status"),
+            "mosaic.video_ids": [i["video_id"] for i in data.get("inputs") or []
+                                 if isinstance(i, dict) and i.get("video_id")] or None,
+            "mosaic.outputs": len(outputs) if outputs else None,
+            "mosaic.outputs_completed_at_ns": max(completed) if completed else None,
+            "mosaic.triggered_at_ns": iso_to_ns(triggered_by.get("triggered_at")),
+        }
+        failed = data.get("status") == "failed"
+        spans = [make_span(f"webhook {flag}", trace, new_span_id(), received_ns, handled_ns, attributes,
+                           parent_span_id=root, kind=SPAN_KIND_SERVER)]
+
+        with self.lock:
+            if flag == "RUN_STARTED":
+                if len(self.started) >= self.max_open_runs:
+                    self.started.pop(next(iter(self.started)))
+                self.started.setdefault(run_id, received_ns)
+            elif flag == "RUN_FINISHED":
+                started = self.started.pop(run_id, None)
+                start_ns = started or attributes["mosaic.triggered_at_ns"] or received_ns
+                spans.append(make_span(
+                    "mosaic.agent_run", trace, root, start_ns, handled_ns,
+                    {"mosaic.run_id": run_id, "mosaic.agent_id": data.get("agent_id"),
+                     "mosaic.status": data.get("status")},
+                    error="agent run failed" if failed else None,
+                ))
+        emit(spans, self.service)
+
+
+# --- summary -------------------------------------------------------------
+
+def _attr_dict(attributes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    result = {}
+    for attr in attributes or []:
+        value = attr.get("value", {})
+        if "arrayValue" in value:
+            result[attr["key"]] = [next(iter(v.values())) for v in value["arrayValue"].get("values", [])]
+        elif "intValue" in value:
+            result[attr["key"]] = int(value["intValue"])
+        elif value:
+            result[attr["key"]] = next(iter(value.values()))
+    return result
+
+
+def read_spans(path: str) -> Iterable[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # torn write
+            for resource in request.get("resourceSpans", []):
+                service = _attr_dict(resource.get("resource", {}).get("attributes")).get("service.name")
+                for scope in resource.get("scopeSpans", []):
+                    for span in scope.get("spans", []):
+                        yield {
+                            "service": service,
+                            "name": span.get("name"),
+                            "start": int(span.get("startTimeUnixNano", 0)),
+                            "end": int(span.get("endTimeUnixNano", 0)),
+                            "attributes": _attr_dict(span.get("attributes")),
+                        }
+
+
+def summarize(spans: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Per-run latency breakdown in seconds (None where a stage wasn't traced)."""
+    uploads: Dict[str, Dict[str, Any]] = {}
+    runs: Dict[str, Dict[str, Any]] = {}
+    for span in spans:
+        attrs = span["attributes"]
+        if span["name"] == "mosaic.upload" and attrs.get("mosaic.video_id"):
+            uploads[attrs["mosaic.video_id"]] = span
+            continue
+        run_id = attrs.get("mosaic.run_id")
+        if not run_id:
+            continue
+        run = runs.setdefault(run_id, {"events": {}})
+        if span["name"] == "mosaic.run.submit":
+            run["submit"] = span
+        elif span["name"] == "mosaic.agent_run":
+            run["closed"] = span
+        elif span["name"].startswith("webhook "):
+            flag = attrs.get("mosaic.flag")
+            # Keep the first delivery of each flag (retries arrive later)
+            if flag not in run["events"] or span["start"] < run["events"][flag]["start"]:
+                run["events"][flag] = span
+
+    def seconds(later: Optional[int], earlier: Optional[int]) -> Optional[float]:
+        if later is None or earlier is None:
+            return None
+        return round((later - earlier) / 1e9, 3)
+
+    rows = []
+    for run_id, run in runs.items():
+        submit = run.get("submit")
+        events = run["events"]
+        started = events.get("RUN_STARTED", {}).get("start")
+        outputs = events.get("OUTPUTS_FINISHED", {}).get("start")
+        finished_span = events.get("RUN_FINISHED")
+        finished = finished_span["start"] if finished_span else None
+
+        video_ids = (submit or {}).get("attributes", {}).get("mosaic.video_ids") or []
+        upload_spans = [uploads[v] for v in video_ids if v in uploads]
+        upload_start = min((u["start"] for u in upload_spans), default=None)
+        upload_end = max((u["end"] for u in upload_spans), default=None)
+
+        triggered_at = None
+        for span in events.values():
+            triggered_at = triggered_at or span["attributes"].get("mosaic.triggered_at_ns")
+        queued_since = submit["end"] if submit else triggered_at
+        completed_at = (finished_span or {}).get("attributes", {}).get("mosaic.outputs_completed_at_ns")
+        origin = upload_start or (submit["start"] if submit else None) or triggered_at or started
+
+        rows.append({
+            "run_id": run_id,
+            "agent_id": (submit or finished_span or {}).get("attributes", {}).get("mosaic.agent_id"),
+            "status": (finished_span or {}).get("attributes", {}).get("mosaic.status"),
+            "upload_s": seconds(upload_end, upload_start),
+            "upload_to_submit_s": seconds(submit["start"], upload_end) if submit else None,
+            "submit_s": seconds(submit["end"], submit["start"]) if submit else None,
+            "queue_wait_s": seconds(started, queued_since),
+            "first_output_s": seconds(outputs, started),
+            "processing_s": seconds(finished, started),
+            "delivery_lag_s": seconds(finished, completed_at),
+            "total_s": seconds(finished, origin),
+        })
+    rows.sort(key=lambda r: r["run_id"])
+    return rows
+
+
+def _stat_line(label: str, values: List[float]) -> str:
+    if not values:
+        return f"   {label:<20} -"
+    values = sorted(values)
+    p90 = values[min(len(values) - 1, int(round(0.9 * (len(values) - 1))))]
+    return (f"   {label:<20} n={len(values):<5} p50 {statistics.median(values):8.2f}s"
+            f"  p90 {p90:8.2f}s  max {values[-1]:8.2f}s")
+
+
+def print_summary(rows: List[Dict[str, Any]]) -> None:
+    def cell(value: Optional[float]) -> str:
+        return f"{value:>9.2f}" if value is not None else f"{'-':>9}"
+
+    columns = [("upload", "upload_s"), ("→submit", "upload_to_submit_s"), ("submit", "submit_s"),
+               ("queue", "queue_wait_s"), ("process", "processing_s"), ("delivery", "delivery_lag_s"),
+               ("total", "total_s")]
+    print(f"{'run_id':<28}{'status':<11}" + "".join(f"{name:>9}" for name, _ in columns))
+    for row in rows:
+        print(f"{row['run_id'][:27]:<28}{(row['status'] or 'open'):<11}"
+              + "".join(cell(row[key]) for _, key in columns))
+
+    def collect(key: str) -> List[float]:
+        return [r[key] for r in rows if r[key] is not None]
+
+    print("\n🧭 Our side")
+    print(_stat_line("upload", collect("upload_s")))
+    print(_stat_line("upload → submit", collect("upload_to_submit_s")))
+    print(_stat_line("submit request", collect("submit_s")))
+    print("☁️  Mosaic side")
+    print(_stat_line("queue wait", collect("queue_wait_s")))
+    print(_stat_line("processing", collect("processing_s")))
+    print(_stat_line("callback delivery", collect("delivery_lag_s")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize Mosaic cross-stage traces")
+    sub = parser.add_subparsers(dest="command", required=True)
+    summary = sub.add_parser("summary", help="Per-run queue-wait vs processing breakdown")
+    summary.add_argument("--file", default=trace_file(), help="Trace file (default: $MOSAIC_TRACE_FILE)")
+    summary.add_argument("--run-id", action="append", help="Only these runs (repeatable)")
+    summary.add_argument("--json", action="store_true", help="Print rows as JSON")
+    args = parser.parse_args()
+
+    if not args.file:
+        print("❌ No trace file. Use --file or set MOSAIC_TRACE_FILE")
+        sys.exit(1)
+    if not os.path.isfile(args.file):
+        print(f"❌ Trace file not found: {args.file}")
+        sys.exit(1)
+
+    rows = summarize(read_spans(args.file))
+    if args.run_id:
+        rows = [r for r in rows if r["run_id"] in args.run_id]
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    if not rows:
+        print("No runs traced yet")
+        return
+    print_summary(rows)
+
+
+if __name__ == "__main__":
+    main()
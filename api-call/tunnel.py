@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+ngrok tunnel management for the webhook listeners.
+
+start_tunnel(port) returns a public URL for a local port as fast as it can:
+
+  1. Reuse: an ngrok agent that already forwards this port (from an earlier
+     listener run, or started by hand) is found through its local API
+     (127.0.0.1:4040-4044) and reused. This takes a few milliseconds.
+  2. Binary: otherwise `ngrok http PORT` is started detached, logging to a
+     file, and the log and local API are polled until the tunnel reports its
+     URL. The agent keeps running after the listener exits, so the next
+     restart takes the reuse path (`python tunnel.py --port PORT --stop` ends
+     it, as does a listener started with --ngrok-stop-on-exit). That leaves
+     the port public, so listeners say so when they stop (release_tunnel).
+  3. pyngrok (backend="pyngrok", or "auto" when the binary isn't on PATH):
+     the tunnel is opened in-process through the optional `pyngrok` package,
+     which also downloads ngrok if needed, and is closed when the process exits.
+
+Readiness is polled with a deadline instead of a fixed sleep. If ngrok
+exits or logs an error first (bad authtoken, tunnel limit), or no URL shows up
+before the deadline, start_tunnel returns None and `last_error` says why.
+
+Usage:
+  python tunnel.py --port 3000            # print the tunnel URL (starting ngrok if needed)
+  python tunnel.py --port 3000 --stop     # stop the ngrok agent serving that port
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+from urllib.error import URLError
+from urllib.request import urlopen
+
+
+logger = logging.getLogger(__name__)
+
+API_PORTS = range(4040, 4045)  # ngrok moves its local API up when 4040 is taken
+BACKENDS = ("auto", "binary", "pyngrok")
+
+# Why the last start_tunnel call returned None
+last_error: Optional[str] = None
+
+_LOGFMT = re.compile(r'(\w+)=("(?:[^"\\]|\\.)*"|\S+)')
+
+
+def _get_tunnels(api_port: int, timeout: float = 0.3) -> Optional[List[Dict]]:
+    try:
+        with urlopen(f"http://127.0.0.1:{api_port}/api/tunnels", timeout=timeout) as resp:
+            return json.load(resp).get("tunnels", [])
+    except (URLError, OSError, ValueError):
+        return None
+
+
+def _forwards_port(tunnel: Dict, port: int) -> bool:
+    addr = str((tunnel.get("config") or {}).get("addr", ""))
+    # "http://localhost:3000", "localhost:3000" or "3000"
+    return re.search(rf"(^|:){port}/?$", addr) is not None
+
+
+def _pick_url(tunnels: List[Dict]) -> Optional[str]:
+    urls = [t.get("public_url") for t in tunnels if t.get("public_url")]
+    for url in urls:
+        if url.startswith("https"):
+            return url
+    return urls[0] if urls else None
+
+
+def find_tunnel(port: int) -> Optional[str]:
+    """Public URL of a running ngrok agent already forwarding `port`, if any."""
+    for api_port in API_PORTS:
+        tunnels = _get_tunnels(api_port)
+        if tunnels is None:
+            continue
+        url = _pick_url([t for t in tunnels if _forwards_port(t, port)])
+        if url:
+            return url
+    return None
+
+
+def _log_path(port: int) -> str:
+    return os.path.join(tempfile.gettempdir(), f"mosaic-ngrok-{port}.log")
+
+
+def _pid_path(port: int) -> str:
+    return os.path.join(tempfile.gettempdir(), f"mosaic-ngrok-{port}.pid")
+
+
+def _scan_log(path: str, offset: int) -> tuple:
+    """(url, fatal error, last error, new_offset) from ngrok log lines written since offset."""
+    url = fatal = error = None
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            f.seek(offset)
+            text = f.read()
+    except OSError:
+        return None, None, None, offset
+    # Only whole lines; a partial last line is read again next time
+    end = text.rfind("\n") + 1
+    for line in text[:end].splitlines():
+        fields = {k: v.strip('"') for k, v in _LOGFMT.findall(line)}
+        if fields.get("msg") == "started tunnel" and fields.get("url"):
+            if fields["url"].startswith("https") or not url:
+                url = fields["url"]
+        elif fields.get("lvl") in ("eror", "crit") and fields.get("err"):
+            error = fields["err"]
+            # Other errors (e.g. a failed update check) don't stop the tunnel
+            if fields["lvl"] == "crit" or fields.get("msg") == "session closing":
+                fatal = error
+        elif line.startswith("ERROR:"):
+            fatal = error = line[6:].strip()
+    return url, fatal, error, offset + len(text[:end].encode("utf-8"))
+
+
+def _abandon(port: int, proc: subprocess.Popen) -> None:
+    if proc.poll() is None:
+        proc.terminate()
+    try:
+        os.remove(_pid_path(port))
+    except OSError:
+        pass
+
+
+def _start_binary(port: int, timeout: float, ngrok: str) -> Optional[str]:
+    global last_error
+    log_path = _log_path(port)
+    with open(log_path, "w") as log:
+        # Its own session, so it survives the listener and a Ctrl+C aimed at it
+        proc = subprocess.Popen([ngrok, "http", str(port), "--log", "stdout", "--log-format", "logfmt"],
+                                stdout=log, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                start_new_session=True)
+    with open(_pid_path(port), "w") as f:
+        f.write(str(proc.pid))
+
+    deadline = time.monotonic() + timeout
+    delay, offset, url, hint = 0.02, 0, None, None
+    while True:
+        found, fatal, error, offset = _scan_log(log_path, offset)
+        url, hint = found or url, error or hint
+        if url and url.startswith("https"):
+            return url
+        if fatal:
+            last_error = f"ngrok: {fatal}"
+            _abandon(port, proc)
+            return None
+        if proc.poll() is not None:
+            error = _scan_log(log_path, 0)[2]
+            last_error = f"ngrok exited with code {proc.returncode}" + (f": {error}" if error else f" (see {log_path})")
+            _abandon(port, proc)
+            return None
+        # The log can lag the API on some ngrok versions
+        url = url or find_tunnel(port)
+        if url:
+            return url
+        if time.monotonic() >= deadline:
+            last_error = (f"ngrok started but reported no URL within {timeout:g}s"
+                          + (f" (last error: {hint})" if hint else f" (see {log_path})"))
+            _abandon(port, proc)
+            return None
+        time.sleep(delay)
+        delay = min(0.25, delay * 2)
+
+
+def _start_pyngrok(port: int, timeout: float) -> Optional[str]:
+    global last_error
+    try:
+        from pyngrok import conf, ngrok
+        from pyngrok.exception import PyngrokError
+    except ImportError:
+        last_error = "the pyngrok backend needs the 'pyngrok' package (pip install pyngrok)"
+        return None
+    config = conf.get_default()
+    config.startup_timeout = max(1, int(round(timeout)))
+    try:
+        for tunnel in ngrok.get_tunnels():
+            if _forwards_port({"config": tunnel.config}, port) and tunnel.public_url:
+                return tunnel.public_url
+        return ngrok.connect(port, "http").public_url
+    except PyngrokError as e:
+        last_error = f"pyngrok: {e}"
+        return None
+
+
+def start_tunnel(port: int, backend: str = "auto", timeout: float = 15.0, reuse: bool = True) -> Optional[str]:
+    """Public URL forwarding to `port`, or None (see last_error)."""
+    global last_error
+    last_error = None
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+
+    if reuse and backend != "pyngrok":
+        url = find_tunnel(port)
+        if url:
+            logger.info(f"Reusing running ngrok tunnel {url} -> :{port}")
+            return url
+
+    ngrok = shutil.which("ngrok")
+    if backend == "pyngrok" or (backend == "auto" and not ngrok):
+        url = _start_pyngrok(port, timeout)
+        if url or backend == "pyngrok":
+            return url
+    if not ngrok:
+        last_error = "ngrok not installed. Install from https://ngrok.com (or pip install pyngrok)"
+        return None
+    return _start_binary(port, timeout, ngrok)
+
+
+def stop_tunnel(port: int) -> bool:
+    """Stop the ngrok agent this module started for `port`; False if there was none."""
+    try:
+        with open(_pid_path(port)) as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return False
+    try:
+        os.kill(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return False
+    finally:
+        os.remove(_pid_path(port))
+    return True
+
+
+def running_agent(port: int) -> Optional[int]:
+    """PID of the detached ngrok agent this module started for `port`, if it is still running."""
+    try:
+        with open(_pid_path(port)) as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return None
+    except PermissionError:
+        pass  # alive, but another user's
+    return pid
+
+
+def stop_hint(port: int) -> str:
+    return f"python {os.path.relpath(os.path.abspath(__file__))} --port {port} --stop"
+
+
+def release_tunnel(port: int, stop: bool) -> Optional[str]:
+    """
+    For a listener that is exiting: stop the detached agent for `port` when
+    `stop`, otherwise leave it running. Returns the line to print, or None when
+    there is no agent of ours (pyngrok tunnels close with the process).
+    """
+    if running_agent(port) is None:
+        return None
+    if stop:
+        stop_tunnel(port)
+        return f"🛑 Stopped the ngrok tunnel to port {port}"
+    return (f"⚠️  The ngrok tunnel to port {port} is still running and publicly reachable. "
+            f"Stop it with: {stop_hint(port)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start or reuse an ngrok tunnel to a local port")
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument("--backend", choices=BACKENDS, default="auto")
+    parser.add_argument("--timeout", type=float, default=15.0, help="Seconds to wait for the tunnel URL (default: 15)")
+    parser.add_argument("--stop", action="store_true", help="Stop the ngrok agent started for this port")
+    args = parser.parse_args()
+
+    if args.stop:
+        print("✅ Stopped" if stop_tunnel(args.port) else f"⚠️  No ngrok agent started by this tool for port {args.port}")
+        return
+    started = time.monotonic()
+    url = start_tunnel(args.port, args.backend, args.timeout)
+    if not url:
+        print(f"❌ {last_error}")
+        sys.exit(1)
+    print(f"✅ {url} -> localhost:{args.port} ({(time.monotonic() - started) * 1000:.0f}ms)")
+
+
+if __name__ == "__main__":
+    main()
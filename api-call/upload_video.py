@@ -8,17 +8,40 @@ Upload a video file to Mosaic using the NEW 3-step process with upfront metadata
 
 Usage:
   python upload_video.py --file /path/to/video.mp4 [--api-key YOUR_KEY]
+
+  # Downscale/re-encode on the fly (ffmpeg output is streamed into the upload)
+  python upload_video.py --file master.mov --transcode [--max-resolution 1080] [--video-bitrate 6M]
+  # Remux only (no re-encode) into a streamable MP4
+  python upload_video.py --file video.mkv --faststart
+
+  # Per-phase timing report (metadata, get_upload_url, upload, finalize)
+  python upload_video.py --file video.mp4 --profile upload.profile.json
+
+  # Large files are offered as parallel byte-range parts when the server supports it
+  # (see multipart_upload.py); tune or disable with:
+  python upload_video.py --file master.mov --parallel-parts 16 --part-size 128M
+  python upload_video.py --file master.mov --parallel-parts 1
 """
 
 import argparse
 import json
+import math
 import os
 import mimetypes
+import shutil
+import subprocess
 import sys
-from typing import Optional, Tuple, Dict, Any
+import tempfile
+import time
+from typing import Optional, Tuple, Dict, Any, Iterable, Iterator, List
 
 import requests
-from moviepy.editor import VideoFileClip
+
+import tracing
+from multipart_upload import (MultipartError, complete_upload, default_part_size, parse_size, plan_parts,
+                              upload_parts)
+from profiling import add_profile_arguments, start_profiler
+from ratelimit import acquire
 
 
 DEFAULT_BASE_URL = "https://api.mosaic.so"
@@ -40,6 +63,8 @@ def get_video_metadata(file_path: str) -> Dict[str, Any]:
     """Extract metadata from video file using moviepy."""
     try:
         print("📊 Extracting video metadata...")
+        # Imported here so --help and argument errors don't pay for numpy/imageio
+        from moviepy.editor import VideoFileClip
         with VideoFileClip(file_path) as clip:
             metadata = {
                 "width": clip.w,
@@ -59,6 +84,118 @@ def get_video_metadata(file_path: str) -> Dict[str, Any]:
         sys.exit(1)
 
 
+def parse_bitrate(value: str) -> int:
+    """Parse a bitrate such as '6M', '800k' or '128000' into bits per second."""
+    value = value.strip().lower()
+    multiplier = 1
+    if value.endswith("m"):
+        multiplier, value = 1_000_000, value[:-1]
+    elif value.endswith("k"):
+        multiplier, value = 1_000, value[:-1]
+    return int(float(value) * multiplier)
+
+
+def find_ffmpeg() -> str:
+    """Locate the ffmpeg binary bundled with moviepy (imageio-ffmpeg), else one on PATH."""
+    try:
+        from imageio_ffmpeg import get_ffmpeg_exe
+        return get_ffmpeg_exe()
+    except Exception:
+        path = shutil.which("ffmpeg")
+        if not path:
+            raise RuntimeError("ffmpeg not found; install moviepy (imageio-ffmpeg) or put ffmpeg on PATH")
+        return path
+
+
+def plan_transcode(
+    metadata: Dict[str, Any],
+    max_resolution: int,
+    video_bitrate: int,
+    audio_bitrate: int,
+    remux_only: bool
+) -> Dict[str, Any]:
+    """
+    Work out the output metadata and ffmpeg arguments for the transcode stage.
+
+    Output is a fragmented MP4 (moov first, then fragments), the streamable
+    equivalent of faststart: an ordinary faststart remux has to rewrite the
+    file after encoding, which a pipe can't do. Because the output is never
+    on disk, file_size is an upper bound derived from the capped bitrates
+    (or the source size when only remuxing). Raises ValueError when a
+    transcode is asked for but the metadata has no usable frame size.
+    """
+    width, height = metadata["width"], metadata["height"]
+    duration_s = metadata["duration_ms"] / 1000
+
+    if remux_only:
+        codec_args = ["-c", "copy"]
+        # Fragment headers add a little over the original
+        file_size = int(metadata["file_size"] * 1.01) + 64 * 1024
+    else:
+        if not width or not height or width < 0 or height < 0:
+            raise ValueError(f"the source reports a {width}x{height} frame size, so it can't be scaled; "
+                             f"check the file, or upload it without --transcode")
+        # Cap the shorter side so portrait and landscape sources are treated alike
+        scale = min(1.0, max_resolution / min(width, height))
+        # libx264 needs even dimensions
+        width = max(2, int(width * scale) // 2 * 2)
+        height = max(2, int(height * scale) // 2 * 2)
+        codec_args = [
+            "-vf", f"scale={width}:{height}",
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+            "-maxrate", str(video_bitrate), "-bufsize", str(video_bitrate * 2),
+            "-pix_fmt", "yuv420p",
+            "-c:a", "aac", "-b:a", str(audio_bitrate),
+        ]
+        # maxrate is enforced over the buffer window; leave headroom for container overhead
+        file_size = math.ceil((video_bitrate + audio_bitrate) / 8 * duration_s * 1.05) + 256 * 1024
+
+    return {
+        "width": width,
+        "height": height,
+        "duration_ms": metadata["duration_ms"],
+        "file_size": file_size,
+        "ffmpeg_args": [
+            "-map", "0:v:0", "-map", "0:a:0?",
+            *codec_args,
+            "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+            "-f", "mp4",
+        ],
+    }
+
+
+def stream_transcode(file_path: str, plan: Dict[str, Any], stats: Dict[str, int],
+                     chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+    """Run ffmpeg and yield its output as it is produced; stats['bytes'] counts what was sent."""
+    cmd = [find_ffmpeg(), "-hide_banner", "-loglevel", "error", "-nostdin",
+           "-i", file_path, *plan["ffmpeg_args"], "pipe:1"]
+    # stderr goes to a file: a pipe read only after stdout ends would fill up on
+    # a noisy (e.g. corrupt) source and block ffmpeg, and the upload with it
+    with tempfile.TemporaryFile() as errors:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors)
+        stats["bytes"] = 0
+        try:
+            while True:
+                chunk = proc.stdout.read(chunk_size)
+                if not chunk:
+                    break
+                stats["bytes"] += len(chunk)
+                yield chunk
+            proc.stdout.close()
+            if proc.wait() != 0:
+                start = max(0, os.fstat(errors.fileno()).st_size - 500)
+                errors.seek(start)
+                stderr = errors.read().decode(errors="replace")
+                if start:
+                    stderr = stderr.split("\n", 1)[-1]  # from the first whole line
+                stderr = stderr.strip()
+                raise RuntimeError(f"ffmpeg failed (exit {proc.returncode}): {stderr}")
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+
+
 def determine_content_type(file_path: str, explicit: Optional[str]) -> str:
     """Determine content type from file extension or explicit parameter."""
     if explicit:
@@ -82,9 +219,14 @@ def get_upload_url_with_metadata(
     api_key: str, 
     filename: str, 
     content_type: str,
-    metadata: Dict[str, Any]
-) -> Tuple[str, str, str]:
-    """Get upload URL with immediate metadata validation."""
+    metadata: Dict[str, Any],
+    multipart: Optional[Dict[str, int]] = None
+) -> Tuple[str, Optional[str], str, Dict[str, Any]]:
+    """Get upload URL with immediate metadata validation.
+
+    `multipart` ({"part_size", "max_parts"}) offers a parallel part upload; the
+    full response is returned last so the caller can look for part URLs.
+    """
     print("📤 Step 1: Getting upload URL with validation...")
     
     headers = {
@@ -100,8 +242,11 @@ def get_upload_url_with_metadata(
         "height": metadata["height"],
         "duration_ms": metadata["duration_ms"]
     }
+    if multipart:
+        payload["multipart"] = multipart
     
     try:
+        acquire("upload")
         resp = requests.post(
             f"{base_url}/videos/get_upload_url",
             headers=headers,
@@ -136,8 +281,8 @@ def get_upload_url_with_metadata(
     
     data = resp.json()
     
-    # Validate response structure
-    required_fields = ["video_id", "upload_url", "method"]
+    # Validate response structure (a multi-part answer may carry only part URLs)
+    required_fields = ["video_id"] if data.get("parts") else ["video_id", "upload_url", "method"]
     for field in required_fields:
         if field not in data:
             print(f"❌ Missing field in response: {field}")
@@ -145,13 +290,48 @@ def get_upload_url_with_metadata(
             sys.exit(1)
     
     video_id = data["video_id"]
-    upload_url = data["upload_url"] 
-    method = data["method"]
+    upload_url = data.get("upload_url")
+    method = data.get("method", "PUT")
     
     print(f"   ✅ Got video_id: {video_id}")
-    print(f"   ✅ Upload method: {method}")
+    if data.get("parts"):
+        print(f"   ✅ Upload method: {len(data['parts'])} parallel parts")
+    else:
+        print(f"   ✅ Upload method: {method}")
     
-    return video_id, upload_url, method
+    return video_id, upload_url, method, data
+
+
+def send_upload_body(
+    upload_url: str,
+    method: str,
+    content_type: str,
+    body,
+    content_length: Optional[int]
+) -> requests.Response:
+    """Send the video bytes to the upload URL (a file object or an iterable of chunks)."""
+    if method.upper() == "POST":
+        # Resumable upload with proper headers
+        headers = {
+            "x-goog-resumable": "start",
+            "Content-Type": content_type,
+        }
+        if content_length is not None:
+            headers["Content-Length"] = str(content_length)
+        return requests.post(
+            upload_url,
+            headers=headers,
+            data=body,
+            timeout=1800  # 30 minute timeout for large files
+        )
+    # Fallback PUT method
+    headers = {"Content-Type": content_type}
+    return requests.put(
+        upload_url,
+        headers=headers,
+        data=body,
+        timeout=1800
+    )
 
 
 def upload_video_resumable(
@@ -159,37 +339,24 @@ def upload_video_resumable(
     method: str,
     file_path: str, 
     content_type: str,
-    file_size: int
+    file_size: int,
+    stream: Optional[Iterable[bytes]] = None
 ) -> None:
-    """Upload video using resumable upload method."""
+    """Upload video using resumable upload method.
+
+    When `stream` is given its chunks are sent instead of the file, using
+    chunked transfer encoding since the final size isn't known yet.
+    """
     print("⬆️  Step 2: Uploading video...")
     
     file_size_mb = file_size / (1024 * 1024)
-    print(f"   📦 Uploading {file_size_mb:.2f}MB...")
-    
-    with open(file_path, "rb") as f:
-        if method.upper() == "POST":
-            # Resumable upload with proper headers
-            headers = {
-                "x-goog-resumable": "start",
-                "Content-Type": content_type,
-                "Content-Length": str(file_size)
-            }
-            upload_response = requests.post(
-                upload_url,
-                headers=headers,
-                data=f,
-                timeout=1800  # 30 minute timeout for large files
-            )
-        else:
-            # Fallback PUT method
-            headers = {"Content-Type": content_type}
-            upload_response = requests.put(
-                upload_url,
-                headers=headers,
-                data=f,
-                timeout=1800
-            )
+    if stream is not None:
+        print(f"   📦 Streaming transcoded output (up to {file_size_mb:.2f}MB)...")
+        upload_response = send_upload_body(upload_url, method, content_type, stream, None)
+    else:
+        print(f"   📦 Uploading {file_size_mb:.2f}MB...")
+        with open(file_path, "rb") as f:
+            upload_response = send_upload_body(upload_url, method, content_type, f, file_size)
     
     # Check upload success
     if upload_response.status_code in [200, 201, 204]:
@@ -201,8 +368,9 @@ def upload_video_resumable(
         raise Exception(f"Upload failed: HTTP {upload_response.status_code}")
 
 
-def finalize_upload(base_url: str, api_key: str, video_id: str) -> None:
-    """Finalize upload."""
+def finalize_upload(base_url: str, api_key: str, video_id: str,
+                    parts: Optional[List[Dict[str, Any]]] = None) -> None:
+    """Finalize upload; `parts` asks the server to assemble a multi-part upload."""
     print("✅ Step 3: Finalizing upload...")
     
     headers = {
@@ -211,8 +379,11 @@ def finalize_upload(base_url: str, api_key: str, video_id: str) -> None:
     }
     
     payload = {"video_id": video_id}
+    if parts:
+        payload["parts"] = parts
     
     try:
+        acquire("upload")
         resp = requests.post(
             f"{base_url}/videos/finalize_upload",
             headers=headers,
@@ -240,33 +411,123 @@ def main():
     parser.add_argument("--content-type", help="Explicit Content-Type for the file (e.g., video/mp4)")
     parser.add_argument("--api-key", help="Mosaic API key (or use MOSAIC_API_KEY env var)")
     parser.add_argument("--base-url", default=DEFAULT_BASE_URL)
+    transcode = parser.add_argument_group("transcode stage (requires ffmpeg, bundled with moviepy)")
+    transcode.add_argument("--transcode", action="store_true",
+                           help="Downscale/re-encode to H.264/AAC MP4 while uploading")
+    transcode.add_argument("--faststart", action="store_true",
+                           help="Remux into a streamable MP4 without re-encoding (ignored with --transcode)")
+    transcode.add_argument("--max-resolution", type=int, default=1080,
+                           help="Maximum size of the shorter side in pixels (default: 1080)")
+    transcode.add_argument("--video-bitrate", default="8M", help="Maximum video bitrate (default: 8M)")
+    transcode.add_argument("--audio-bitrate", default="128k", help="Audio bitrate (default: 128k)")
+    parts_group = parser.add_argument_group("multi-part upload (when the server offers part URLs)")
+    parts_group.add_argument("--parallel-parts", type=int, default=8,
+                             help="Parts uploaded at once; 1 always uses a single stream (default: 8)")
+    parts_group.add_argument("--part-size", help="Requested part size, e.g. 64M (default: 64M, smaller for small files)")
+    parts_group.add_argument("--part-retries", type=int, default=5, help="Retries per part (default: 5)")
+    parts_group.add_argument("--multipart-threshold", default="256M",
+                             help="Only offer multi-part for files at least this big (default: 256M)")
+    add_profile_arguments(parser)
     args = parser.parse_args()
+    # Phase timings double as the child spans of the upload trace
+    profiler = start_profiler("upload_video", args.profile, args.profile_cprofile, timeline=tracing.enabled())
+    started_ns = time.time_ns()
 
     # Validate file exists
     if not os.path.isfile(args.file):
         print(f"❌ File not found: {args.file}")
         sys.exit(1)
 
+    try:
+        part_size = parse_size(args.part_size) if args.part_size else None
+        multipart_threshold = parse_size(args.multipart_threshold)
+    except ValueError:
+        print("❌ --part-size and --multipart-threshold take sizes like 64M or 1G")
+        sys.exit(1)
+
     api_key = resolve_api_key(args.api_key)
     filename = os.path.basename(args.file)
     content_type = determine_content_type(args.file, args.content_type)
 
     try:
         # Step 0: Extract metadata locally
-        metadata = get_video_metadata(args.file)
+        with profiler.phase("metadata"):
+            metadata = get_video_metadata(args.file)
+        
+        stream = None
+        stream_stats: Dict[str, int] = {}
+        if args.transcode or args.faststart:
+            try:
+                plan = plan_transcode(
+                    metadata,
+                    args.max_resolution,
+                    parse_bitrate(args.video_bitrate),
+                    parse_bitrate(args.audio_bitrate),
+                    remux_only=not args.transcode,
+                )
+            except ValueError as e:
+                print(f"❌ Cannot transcode: {e}")
+                sys.exit(1)
+            print(f"🎞️  {'Transcoding' if args.transcode else 'Remuxing'} while uploading: "
+                  f"{metadata['width']}x{metadata['height']} -> {plan['width']}x{plan['height']}, "
+                  f"at most {plan['file_size']/(1024**2):.1f}MB")
+            metadata = {key: plan[key] for key in ("width", "height", "duration_ms", "file_size")}
+            filename = os.path.splitext(filename)[0] + ".mp4"
+            content_type = "video/mp4"
+            stream = stream_transcode(args.file, plan, stream_stats)
+        
+        # A transcoded stream has no byte ranges to split
+        multipart = None
+        if stream is None and args.parallel_parts > 1 and metadata["file_size"] >= multipart_threshold:
+            multipart = {
+                "part_size": part_size or default_part_size(metadata["file_size"], args.parallel_parts),
+                "max_parts": 10000,
+            }
         
         # Step 1: Get upload URL with validation  
-        video_id, upload_url, method = get_upload_url_with_metadata(
-            args.base_url, api_key, filename, content_type, metadata
-        )
+        with profiler.phase("get_upload_url"):
+            video_id, upload_url, method, upload_info = get_upload_url_with_metadata(
+                args.base_url, api_key, filename, content_type, metadata, multipart
+            )
+        plan = plan_parts(upload_info, metadata["file_size"]) if multipart else None
         
         # Step 2: Upload video
-        upload_video_resumable(
-            upload_url, method, args.file, content_type, metadata["file_size"]
-        )
+        uploaded_parts = None
+        with profiler.phase("upload"):
+            if plan:
+                print("⬆️  Step 2: Uploading video in parts...")
+                uploaded_parts = upload_parts(
+                    args.file, plan, upload_info.get("part_method", "PUT"), content_type,
+                    args.parallel_parts, args.part_retries
+                )
+                if upload_info.get("complete_url"):
+                    complete_upload(upload_info["complete_url"], api_key, uploaded_parts)
+                    print(f"   ✅ {len(uploaded_parts)} parts assembled")
+                    uploaded_parts = None
+                else:
+                    print(f"   ✅ {len(uploaded_parts)} parts uploaded")
+            elif not upload_url:
+                raise MultipartError("server sent neither an upload_url nor usable part URLs")
+            else:
+                upload_video_resumable(
+                    upload_url, method, args.file, content_type, metadata["file_size"], stream
+                )
+            if stream is not None:
+                # Chunked body: the HTTP hook can't see its length
+                profiler.add_bytes(sent=stream_stats.get("bytes", 0))
+        if stream is not None:
+            sent_mb = stream_stats.get("bytes", 0) / (1024 ** 2)
+            source_mb = os.path.getsize(args.file) / (1024 ** 2)
+            print(f"   📉 Sent {sent_mb:.2f}MB instead of {source_mb:.2f}MB")
         
         # Step 3: Finalize upload
-        finalize_upload(args.base_url, api_key, video_id)
+        with profiler.phase("finalize"):
+            finalize_upload(args.base_url, api_key, video_id, uploaded_parts)
+        tracing.record_upload(
+            video_id, started_ns, time.time_ns(), profiler.timeline or (),
+            {"mosaic.filename": filename, "mosaic.file_size": metadata["file_size"],
+             "mosaic.transcoded": stream is not None},
+        )
         
         # Success!
         print(f"\n🎉 Upload complete!")
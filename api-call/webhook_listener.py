@@ -4,32 +4,48 @@ Webhook listener for Mosaic agent run callbacks.
 
 Usage:
   python webhook_listener.py [--port 3000] [--host 0.0.0.0] [--ngrok] [--debug]
+  python webhook_listener.py --workflow dag.json [--workflow-start VID1,VID2]   # chain agents (see workflow.py)
+  python webhook_listener.py --routes routes.json   # per-token handlers (see token_router.py)
+  python webhook_listener.py --capture traffic.cap  # record inbound requests for replay (see capture.py)
+  python webhook_listener.py --run-queue            # free run_queue.py slots on RUN_FINISHED
+  python webhook_listener.py --port 3001 --cluster cluster.db   # one of several behind a load balancer (see cluster.py)
+  python webhook_listener.py --artifact-cache       # serve run outputs from a local cache (see artifact_cache.py)
+  python webhook_listener.py --log-format json --log-sample OUTPUTS_FINISHED=0.1   # console output (see event_log.py)
 
 Environment:
   MOSAIC_WEBHOOK_SECRET=your_secret   # Optional: validate X-Mosaic-Signature
 """
 
 import argparse
-import json
 import logging
 import os
-import subprocess
+import signal
+import sqlite3
 import sys
 import time
-from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
 
-import requests
 from flask import Flask, jsonify, request
 
+import tracing
+import tunnel
+from batch_ingest import BatchError, decode_batch, summarize
+from event_log import DEFAULT_RATE, FORMATS, EventLog, parse_samples
+from event_stats import RollupStats
+from payload_store import COMPRESSIONS, DEFAULT_MAX_BYTES, PayloadStore
+
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)s | %(message)s')
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-webhook_history = []
-MAX_HISTORY = 100
+# Raw payloads, decoded only when served; replaced in main() from --history-mb
+webhook_history = PayloadStore(DEFAULT_MAX_BYTES, compression="zlib")
+event_stats = RollupStats()
+# Closes run traces when MOSAIC_TRACE_FILE / MOSAIC_TRACE_ENDPOINT is set (see tracing.py)
+run_tracer = tracing.WebhookTracer("webhook_listener")
 
 
 def format_ts(ts: Optional[str]) -> str:
@@ -74,6 +90,14 @@ def format_event(data: Dict[str, Any]) -> str:
     return "\n".join(lines)
 
 
+def render_event(data: Dict[str, Any], path: Optional[str], token: Optional[str], secret: Optional[str]) -> str:
+    return format_event(data)
+
+
+# Renders and writes events off the request thread; replaced in main() from the --log-* flags
+event_log = EventLog(renderer=render_event)
+
+
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({"status": "healthy"}), 200
@@ -81,7 +105,96 @@ def health():
 
 @app.route('/history', methods=['GET'])
 def history():
-    return jsonify({"total": len(webhook_history), "history": webhook_history[-10:]})
+    limit = request.args.get('limit', 10, type=int)
+    cluster = app.config.get('CLUSTER')
+    if cluster is not None:
+        return jsonify({
+            "node_id": cluster.node_id,
+            "store": cluster.store.counts(),
+            "history": cluster.store.latest(limit),
+        })
+    return jsonify({
+        "total": len(webhook_history),
+        "store": webhook_history.stats(),
+        "history": webhook_history.latest(limit),
+    })
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    cluster = app.config.get('CLUSTER')
+    if cluster is not None:
+        return jsonify(cluster.merged_stats())
+    return jsonify(event_stats.snapshot())
+
+
+@app.route('/cluster', methods=['GET'])
+def cluster_status():
+    cluster = app.config.get('CLUSTER')
+    if cluster is None:
+        return jsonify({"error": "Cluster mode not enabled (start with --cluster)"}), 404
+    return jsonify(cluster.snapshot(request.args.get('run_id')))
+
+
+@app.route('/routes', methods=['GET'])
+def routes():
+    router = app.config.get('ROUTER')
+    if router is None:
+        return jsonify({"error": "Routing not enabled (start with --routes)"}), 404
+    return jsonify(router.metrics())
+
+
+@app.route('/workflow', methods=['GET'])
+def workflow_status():
+    engine = app.config.get('WORKFLOW')
+    if engine is None:
+        return jsonify({"error": "Workflow mode not enabled (start with --workflow)"}), 404
+    return jsonify(engine.snapshot())
+
+
+@app.route('/workflow/start', methods=['POST'])
+def workflow_start():
+    engine = app.config.get('WORKFLOW')
+    if engine is None:
+        return jsonify({"error": "Workflow mode not enabled (start with --workflow)"}), 404
+    data = request.get_json(silent=True) or {}
+    video_ids = data.get('video_ids') or []
+    if isinstance(video_ids, str):
+        video_ids = [v.strip() for v in video_ids.split(',') if v.strip()]
+    try:
+        instance_id = engine.start_instance(video_ids, data.get('instance_id'))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"instance_id": instance_id}), 201
+
+
+@app.route('/artifacts', methods=['GET'])
+def artifact_stats():
+    cache = app.config.get('ARTIFACTS')
+    if cache is None:
+        return jsonify({"error": "Artifact cache not enabled (start with --artifact-cache)"}), 404
+    return jsonify(cache.stats())
+
+
+@app.route('/artifacts/<run_id>', methods=['GET'])
+def artifact_list(run_id: str):
+    cache = app.config.get('ARTIFACTS')
+    if cache is None:
+        return jsonify({"error": "Artifact cache not enabled (start with --artifact-cache)"}), 404
+    outputs = cache.describe_run(run_id)
+    if outputs is None:
+        return jsonify({"error": f"No outputs known for run {run_id}"}), 404
+    return jsonify({"run_id": run_id, "outputs": outputs})
+
+
+@app.route('/artifacts/<run_id>/<int:n>', methods=['GET'])
+@app.route('/artifacts/<run_id>/<int:n>/<any(video, thumbnail):kind>', methods=['GET'])
+def artifact(run_id: str, n: int, kind: str = 'video'):
+    cache = app.config.get('ARTIFACTS')
+    if cache is None:
+        return jsonify({"error": "Artifact cache not enabled (start with --artifact-cache)"}), 404
+    from artifact_cache import serve_artifact
+    return serve_artifact(cache, run_id, n, kind)
 
 
 @app.route('/', methods=['GET'])
@@ -94,71 +207,174 @@ def home():
             'webhook_with_token': '/webhook/<token>',
             'webhooks_mosaic': '/webhooks/mosaic',
             'webhooks_mosaic_with_token': '/webhooks/mosaic/<token>',
+            'batch': '/batch[/<token>]',
             'history': '/history',
+            'stats': '/stats',
+            'routes': '/routes',
+            'cluster': '/cluster[?run_id=RUN_ID]',
+            'artifacts': '/artifacts[/<run_id>[/<n>[/thumbnail]]]',
             'health': '/health',
         },
-        'webhooks_received': len(webhook_history)
+        'webhooks_received': webhook_history.received
     })
 
 
+def check_secret() -> bool:
+    """Validate X-Mosaic-Signature against the configured secret (if any)."""
+    expected_secret = app.config.get('WEBHOOK_SECRET') or os.environ.get('MOSAIC_WEBHOOK_SECRET')
+    received_secret = request.headers.get('X-Mosaic-Signature')
+    if not expected_secret:
+        return True
+    if not received_secret:
+        event_log.message("\n⚠️  WEBHOOK SECRET VALIDATION FAILED\n"
+                          "   Expected header: X-Mosaic-Signature\n"
+                          f"   Expected value:  {expected_secret}\n"
+                          "   Received:        (header not present)", key='secret', level='WARNING')
+        return False
+    if received_secret != expected_secret:
+        event_log.message("\n⚠️  WEBHOOK SECRET VALIDATION FAILED\n"
+                          f"   Expected: {expected_secret}\n"
+                          f"   Received: {received_secret}\n"
+                          "   Match:    ❌ MISMATCH", key='secret', level='WARNING')
+        return False
+    return True
+
+
+def ingest_event(data: Dict[str, Any], raw: bytes, token: Optional[str], path: str, secret_valid: bool,
+                 received_ns: int, display: bool = True) -> Tuple[Optional[str], bool]:
+    """Route, store, count and hand off one event. Returns (route, accepted)."""
+    cluster = app.config.get('CLUSTER')
+    if cluster is not None and secret_valid:
+        # Logged for the run's owner node, which calls handle_event (see cluster.py)
+        seq, owner = cluster.append(raw, data, path=path, token=token, received_ns=received_ns)
+        if display:
+            event_log.message(f"🧩 {data.get('flag', 'UNKNOWN')} run {data.get('run_id')} -> "
+                              + (f"#{seq} for {owner}" if seq else "duplicate, dropped"), key='cluster')
+        return None, True
+    return handle_event(data, raw, token, path, secret_valid, received_ns, display)
+
+
+def handle_event(data: Dict[str, Any], raw: bytes, token: Optional[str], path: str, secret_valid: bool,
+                 received_ns: int, display: bool = True) -> Tuple[Optional[str], bool]:
+    """What arriving at this listener means for an event; in cluster mode, run on its owner."""
+    # Hand off to the token's route first: enqueue only, never wait for the handler
+    route = None
+    router = app.config.get('ROUTER')
+    if router is not None and secret_valid:
+        route, accepted = router.dispatch(data, token)
+        if not accepted:
+            logger.warning(f"Route '{route}' queue full; asking for redelivery")
+            return route, False
+
+    webhook_history.append(raw, path=path, token=token)
+    if secret_valid:
+        event_stats.record(data)
+
+    if display:
+        # Queued, not printed: rendering and terminal I/O happen on the writer thread
+        event_log.event(data, path, token)
+
+    engine = app.config.get('WORKFLOW')
+    if engine is not None and secret_valid:
+        engine.on_event(data)
+    cache = app.config.get('ARTIFACTS')
+    if cache is not None and secret_valid:
+        cache.observe(data)
+    if secret_valid:
+        release_run_slot(data)
+        run_tracer.observe(data, received_ns)
+    return route, True
+
+
+def handle_cluster_event(event) -> bool:
+    """Owner side of cluster mode: handle one event from the shared log."""
+    _, accepted = handle_event(event.data, event.raw, event.token, event.path, True, event.received_ns,
+                               display=not event.path.startswith('/batch'))
+    return accepted
+
+
+def release_run_slot(data: Dict[str, Any]) -> None:
+    """Free the run's slot in the run queue (--run-queue) once it has finished."""
+    queue = app.config.get('RUN_QUEUE')
+    if queue is None or data.get('flag') != 'RUN_FINISHED' or not data.get('run_id'):
+        return
+    try:
+        queue.release(data['run_id'], data.get('status') or 'completed')
+    except sqlite3.Error as e:
+        # The dispatcher's status polling frees the slot instead
+        logger.warning(f"Could not release run {data['run_id']} in the run queue: {e}")
+
+
 @app.route('/webhooks/mosaic', methods=['POST'])
 @app.route('/webhooks/mosaic/<path:token>', methods=['POST'])
 def handle_webhook(token: Optional[str] = None):
+    received_ns = time.time_ns()
     try:
         # Simple webhook secret validation
-        expected_secret = app.config.get('WEBHOOK_SECRET') or os.environ.get('MOSAIC_WEBHOOK_SECRET')
-        received_secret = request.headers.get('X-Mosaic-Signature')
-        
-        secret_valid = True
-        if expected_secret:
-            if not received_secret:
-                logger.warning("Missing X-Mosaic-Signature header")
-                print("\n⚠️  WEBHOOK SECRET VALIDATION FAILED")
-                print(f"   Expected header: X-Mosaic-Signature")
-                print(f"   Expected value:  {expected_secret}")
-                print(f"   Received:        (header not present)")
-                secret_valid = False
-            elif received_secret != expected_secret:
-                logger.warning("Invalid webhook secret")
-                print("\n⚠️  WEBHOOK SECRET VALIDATION FAILED")
-                print(f"   Expected: {expected_secret}")
-                print(f"   Received: {received_secret}")
-                print(f"   Match:    ❌ MISMATCH")
-                secret_valid = False
+        secret_valid = check_secret()
 
         data = request.get_json()
         if not data:
             return jsonify({"error": "No JSON"}), 400
 
-        entry = {
-            'timestamp': datetime.now(timezone.utc).isoformat(),
-            'path': request.path,
-            'token': token,
-            'data': data,
-        }
-        webhook_history.append(entry)
-        if len(webhook_history) > MAX_HISTORY:
-            webhook_history.pop(0)
-
-        print(format_event(data))
-        # Also print raw JSON for debugging/inspection
-        try:
-            print(json.dumps(data, indent=2))
-        except Exception:
-            pass
-        
+        route, accepted = ingest_event(data, request.get_data(), token, request.path, secret_valid, received_ns)
+        if not accepted:
+            return jsonify({"error": f"Route '{route}' is busy", "route": route}), 503, {"Retry-After": "5"}
+
         # Return appropriate response based on validation
         if not secret_valid:
-            print("\n❌ Webhook rejected due to invalid secret (still displayed above for debugging)")
+            event_log.message("❌ Webhook rejected due to invalid secret (still displayed above for debugging)",
+                              key='secret', level='WARNING')
             return jsonify({"error": "Invalid webhook secret", "data": data}), 401
         
         # Echo raw payload back in response for convenience
-        return jsonify({"received": True, "data": data}), 200
+        response = {"received": True, "data": data}
+        if route:
+            response["route"] = route
+        return jsonify(response), 200
     except Exception as e:
         logger.exception("Webhook processing error")
         return jsonify({"error": str(e)}), 500
 
 
+@app.route('/batch', methods=['POST'])
+@app.route('/batch/<path:token>', methods=['POST'])
+def handle_batch(token: Optional[str] = None):
+    """NDJSON or JSON-array batch (optionally gzip); one signature check, a result per event."""
+    received_ns = time.time_ns()
+    if not check_secret():
+        return jsonify({"error": "Invalid webhook secret"}), 401
+    try:
+        items = decode_batch(request.get_data(), request.headers.get('Content-Encoding'), request.content_type)
+    except BatchError as e:
+        return jsonify({"error": str(e)}), e.status
+
+    started = time.perf_counter()
+    results = []
+    for index, (raw, data, error) in enumerate(items):
+        if error:
+            results.append({"index": index, "status": 400, "error": error})
+            continue
+        result = {"index": index, "status": 200, "run_id": data.get('run_id')}
+        try:
+            route, accepted = ingest_event(data, raw, token, request.path, True, received_ns, display=False)
+        except Exception as e:
+            logger.exception(f"Batch event {index} failed")
+            result.update(status=500, error=str(e))
+            results.append(result)
+            continue
+        if route:
+            result["route"] = route
+        if not accepted:
+            result.update(status=503, error=f"Route '{route}' is busy")
+        results.append(result)
+
+    summary = summarize(results)
+    event_log.message(f"\n📦 Batch of {summary['received']} events: {summary['accepted']} accepted, "
+                      f"{summary['failed']} failed ({(time.perf_counter() - started) * 1000:.1f} ms)", key='batch')
+    return jsonify(summary), 200
+
+
 @app.route('/', methods=['POST'])
 @app.route('/webhook', methods=['POST'])
 @app.route('/webhook/<path:token>', methods=['POST'])
@@ -167,60 +383,195 @@ def root_webhook(token: Optional[str] = None):
     return handle_webhook(token)
 
 
-def ngrok_available() -> bool:
-    try:
-        out = subprocess.run(['ngrok', 'version'], capture_output=True)
-        return out.returncode == 0
-    except FileNotFoundError:
-        return False
-
-
-def start_ngrok(port: int) -> Optional[str]:
-    if not ngrok_available():
-        logger.warning("ngrok not installed. Install from https://ngrok.com")
-        return None
-    proc = subprocess.Popen(['ngrok', 'http', str(port), '--log', 'stdout'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    time.sleep(2)
-    try:
-        r = requests.get('http://127.0.0.1:4040/api/tunnels', timeout=5)
-        tunnels = r.json().get('tunnels', [])
-        if not tunnels:
-            return None
-        https_url = None
-        for t in tunnels:
-            if t.get('public_url', '').startswith('https'):
-                https_url = t['public_url']
-                break
-        return https_url or tunnels[0].get('public_url')
-    except Exception:
-        return None
+def start_ngrok(port: int, backend: str = 'auto', timeout: float = 15.0) -> Optional[str]:
+    """Reuse or start an ngrok tunnel to port (see tunnel.py); None with a warning on failure."""
+    url = tunnel.start_tunnel(port, backend, timeout)
+    if not url:
+        logger.warning(tunnel.last_error)
+    return url
 
 
 def main():
     parser = argparse.ArgumentParser(description="Webhook listener for Mosaic agent runs")
     parser.add_argument('--port', type=int, default=3000)
     parser.add_argument('--host', default='0.0.0.0')
-    parser.add_argument('--ngrok', action='store_true')
+    parser.add_argument('--ngrok', action='store_true', help='Expose the listener through ngrok (reuses a running tunnel)')
+    parser.add_argument('--ngrok-backend', choices=tunnel.BACKENDS, default='auto',
+                        help='ngrok binary, in-process pyngrok, or auto (default)')
+    parser.add_argument('--ngrok-timeout', type=float, default=15.0, help='Seconds to wait for the tunnel URL (default: 15)')
+    parser.add_argument('--ngrok-stop-on-exit', action='store_true',
+                        help='Stop the ngrok agent when the listener exits (by default it keeps running for the next start)')
     parser.add_argument('--debug', action='store_true')
     parser.add_argument('--webhook-secret', help='Secret to validate X-Mosaic-Signature header (overrides MOSAIC_WEBHOOK_SECRET env var)')
+    parser.add_argument('--workflow', help='Workflow (agent DAG) JSON file; chains runs as events arrive')
+    parser.add_argument('--workflow-state', help='Durable workflow progress file (default: <workflow>.state.json)')
+    parser.add_argument('--workflow-start', help='Comma-separated video IDs to start a workflow instance with')
+    parser.add_argument('--workflow-retention-hours', type=float, default=168.0,
+                        help='Drop finished workflow instances from the state after this many hours (default 168)')
+    parser.add_argument('--workflow-callback-url', help='callback_url for workflow runs (overrides the workflow file)')
+    parser.add_argument('--api-key', help='Mosaic API key for workflow runs (or use MOSAIC_API_KEY env var)')
+    parser.add_argument('--base-url', default='https://api.mosaic.so')
+    parser.add_argument('--routes', help='Routing table JSON mapping token patterns to handlers (see token_router.py)')
+    parser.add_argument('--history-mb', type=float, default=DEFAULT_MAX_BYTES / (1024 * 1024),
+                        help='Memory budget for webhook history in MB (default: 64)')
+    parser.add_argument('--history-compression', choices=COMPRESSIONS, default='zlib',
+                        help='Compress stored payloads (default: zlib; zstd needs the zstandard package)')
+    parser.add_argument('--capture', metavar='FILE', help='Record every inbound POST to FILE for capture.py replay')
+    parser.add_argument('--run-queue', nargs='?', const='', metavar='QUEUE_DB',
+                        help='Free run_queue.py dispatcher slots when RUN_FINISHED arrives (default queue file if no path)')
+    parser.add_argument('--cluster', nargs='?', const='', metavar='STORE_DB',
+                        help='Run as one node of a listener cluster sharing STORE_DB (see cluster.py)')
+    parser.add_argument('--node-id', help='This node\'s id in the cluster (default: <hostname>-<port>)')
+    parser.add_argument('--cluster-ttl', type=float, default=5.0,
+                        help='Seconds without a heartbeat before a node\'s runs move to the others (default: 5)')
+    parser.add_argument('--cluster-retention', type=float, default=24.0,
+                        help='Hours handled events are kept for /history and duplicate detection (default: 24)')
+    parser.add_argument('--artifact-cache', nargs='?', const='', metavar='DIR',
+                        help='Cache run output videos/thumbnails in DIR and serve them at /artifacts (default: ~/.mosaic/artifacts)')
+    parser.add_argument('--artifact-cache-mb', type=float, default=10240,
+                        help='Disk budget for cached artifacts in MB; least recently used files go first (default: 10240)')
+    parser.add_argument('--artifact-max-object-mb', type=float,
+                        help='Larger files are redirected to their origin instead of cached (default: a quarter of the budget)')
+    parser.add_argument('--artifact-prefetch', choices=('none', 'thumbnails', 'all'), default='thumbnails',
+                        help='What to download as soon as outputs are announced (default: thumbnails)')
+    parser.add_argument('--log-format', choices=FORMATS, default='auto',
+                        help='Event output: pretty blocks, one line, or JSON per event (default: auto = pretty on a terminal, line otherwise)')
+    parser.add_argument('--log-payloads', action='store_true', help='Also dump every payload as JSON')
+    parser.add_argument('--log-sample', action='append', default=[], metavar='FLAG=FRACTION',
+                        help='Show this fraction of runs for a flag, e.g. OUTPUTS_FINISHED=0.1 or *=0 (repeatable)')
+    parser.add_argument('--log-rate', type=float, default=DEFAULT_RATE,
+                        help=f'Events shown per second per flag; the rest are counted (default: {DEFAULT_RATE:g}, 0 = no limit)')
     args = parser.parse_args()
+    if args.cluster is not None and args.workflow:
+        # The engine's state file is per process, but the runs it starts would be owned by every node
+        print("❌ --workflow needs a single listener; it can't be combined with --cluster")
+        sys.exit(1)
+
+    global webhook_history, event_log
+    try:
+        webhook_history = PayloadStore(int(args.history_mb * 1024 * 1024), args.history_compression)
+        event_log = EventLog(args.log_format, args.log_payloads, parse_samples(args.log_sample), args.log_rate,
+                             render_event)
+    except (RuntimeError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    event_log.install_logging()
+    # SIGTERM exits like Ctrl+C: queued output is written and a cluster node leaves the ring right away
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    if args.capture:
+        from capture import install_capture
+        try:
+            install_capture(app, args.capture)
+        except (OSError, ValueError) as e:
+            print(f"❌ Cannot open capture file {args.capture}: {e}")
+            sys.exit(1)
+        print(f"\n📼 Capturing inbound requests to {args.capture} (replay with: python capture.py replay {args.capture})")
+
+    if args.run_queue is not None:
+        from run_queue import RunQueue
+        try:
+            app.config['RUN_QUEUE'] = RunQueue(args.run_queue or None)
+        except (OSError, sqlite3.Error) as e:
+            print(f"❌ Cannot open run queue: {e}")
+            sys.exit(1)
+        print(f"\n🚦 Releasing run queue slots on RUN_FINISHED ({app.config['RUN_QUEUE'].path})")
+
+    if args.routes:
+        from token_router import RouteError, TokenRouter
+        try:
+            router = TokenRouter.from_file(args.routes)
+        except (OSError, ValueError, ImportError, RouteError) as e:
+            print(f"❌ Invalid routing table {args.routes}: {e}")
+            sys.exit(1)
+        router.start()
+        app.config['ROUTER'] = router
+        print(f"\n🔀 Routing {len(router.routes)} token patterns:")
+        for route in router.routes:
+            print(f"   {route.pattern:<24} -> {route.handler_spec} ({route.mode} x{route.workers}, "
+                  f"queue {route.queue.maxsize}, timeout {route.timeout:g}s)")
+        print(f"   Metrics: http://localhost:{args.port}/routes")
+
+    if args.workflow:
+        # Imported lazily so a plain listener doesn't need the API client modules
+        from workflow import WorkflowEngine, WorkflowError, load_workflow
+        api_key = args.api_key or os.environ.get('MOSAIC_API_KEY')
+        if not api_key or not api_key.startswith('mk_'):
+            print("❌ Workflow mode needs a valid API key. Use --api-key or set MOSAIC_API_KEY")
+            sys.exit(1)
+        try:
+            spec = load_workflow(args.workflow)
+        except (OSError, ValueError, WorkflowError) as e:
+            print(f"❌ Invalid workflow {args.workflow}: {e}")
+            sys.exit(1)
+        state_path = args.workflow_state or f"{os.path.splitext(args.workflow)[0]}.state.json"
+        engine = WorkflowEngine(spec, state_path, args.base_url, api_key, args.workflow_callback_url,
+                                args.workflow_retention_hours)
+        if not engine.callback_url:
+            print("⚠️  No callback_url for workflow runs; events only arrive if the agents have a webhook configured")
+        engine.start()
+        app.config['WORKFLOW'] = engine
+        print(f"\n🔗 Workflow: {len(spec['nodes'])} nodes, max {engine.max_in_flight} runs in flight")
+        print(f"   State:  {state_path}")
+        print(f"   Status: http://localhost:{args.port}/workflow")
+        if args.workflow_start:
+            instance_id = engine.start_instance([v.strip() for v in args.workflow_start.split(',') if v.strip()])
+            print(f"   Started instance {instance_id}")
+
+    if args.artifact_cache is not None:
+        from artifact_cache import ArtifactCache
+        max_object = int(args.artifact_max_object_mb * 1024 * 1024) if args.artifact_max_object_mb else None
+        try:
+            cache = ArtifactCache(args.artifact_cache or os.path.join(os.path.expanduser('~'), '.mosaic', 'artifacts'),
+                                  int(args.artifact_cache_mb * 1024 * 1024), max_object, args.artifact_prefetch,
+                                  args.base_url, args.api_key or os.environ.get('MOSAIC_API_KEY'))
+        except (OSError, ValueError) as e:
+            print(f"❌ Cannot open artifact cache: {e}")
+            sys.exit(1)
+        cache.start()
+        app.config['ARTIFACTS'] = cache
+        stats = cache.stats()
+        print(f"\n🗄️  Artifact cache {cache.root}: {stats['objects']} files, "
+              f"{stats['bytes'] / 1024 ** 2:,.0f}/{cache.max_bytes / 1024 ** 2:,.0f}MB, prefetch {cache.prefetch_mode}")
+        print(f"   Serving: http://localhost:{args.port}/artifacts/<run_id>/<n>[/thumbnail]")
+
+    if args.cluster is not None:
+        from cluster import ClusterError, ClusterStore, ListenerCluster, default_node_id
+        try:
+            cluster = ListenerCluster(ClusterStore(args.cluster or None), args.node_id or default_node_id(args.port),
+                                      handle_cluster_event, event_stats, args.cluster_ttl, args.cluster_retention)
+            cluster.start()
+        except (OSError, sqlite3.Error, ClusterError) as e:
+            print(f"❌ Cannot join cluster: {e}")
+            sys.exit(1)
+        app.config['CLUSTER'] = cluster
+        if app.config.get('ARTIFACTS') is not None:
+            # Outputs of runs another node handled are found in the shared log
+            app.config['ARTIFACTS'].event_source = cluster.store.finished_event
+        print(f"\n🧩 Cluster node {cluster.node_id} ({cluster.store.path})")
+        print(f"   Status: http://localhost:{args.port}/cluster")
 
     if args.ngrok:
         print("\n🌐 Starting ngrok tunnel...")
-        public = start_ngrok(args.port)
+        public = start_ngrok(args.port, args.ngrok_backend, args.ngrok_timeout)
         if public:
             print(f"✅ Public URL: {public}")
             print(f"   Webhook:   {public}/webhooks/mosaic")
             print(f"   With token:{public}/webhooks/mosaic/your-token")
+            if not args.ngrok_stop_on_exit and tunnel.running_agent(args.port):
+                print(f"   The tunnel stays up after the listener exits ({tunnel.stop_hint(args.port)} "
+                      f"or --ngrok-stop-on-exit)")
         else:
-            print("⚠️  Could not start ngrok. Continuing locally.")
+            print(f"⚠️  Could not start ngrok ({tunnel.last_error}). Continuing locally.")
 
     print("\n📡 Webhook listener starting...")
     print(f"   Local:   http://localhost:{args.port}")
     print(f"   Health:  http://localhost:{args.port}/health")
     print(f"   History: http://localhost:{args.port}/history")
+    print(f"   Stats:   http://localhost:{args.port}/stats")
     print(f"   Webhook: http://localhost:{args.port}/webhooks/mosaic")
     print(f"   Alt:     http://localhost:{args.port}/webhook")
+    print(f"   Batch:   http://localhost:{args.port}/batch (NDJSON / JSON array, gzip)")
     
     # Store webhook secret from flag or env
     app.config['WEBHOOK_SECRET'] = args.webhook_secret
@@ -236,7 +587,16 @@ def main():
         print("\n🔓 Webhook secret validation: DISABLED")
         print("   Set --webhook-secret flag or MOSAIC_WEBHOOK_SECRET env var to enable")
 
-    app.run(host=args.host, port=args.port, debug=args.debug, use_reloader=False)
+    try:
+        app.run(host=args.host, port=args.port, debug=args.debug, use_reloader=False)
+    finally:
+        if app.config.get('CLUSTER') is not None:
+            app.config['CLUSTER'].stop()
+        event_log.flush()
+        if args.ngrok:
+            notice = tunnel.release_tunnel(args.port, args.ngrok_stop_on_exit)
+            if notice:
+                print(notice)
 
 
 if __name__ == '__main__':
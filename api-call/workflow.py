@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Event-driven agent chaining for the webhook listener.
+
+A workflow file declares a DAG of agents; outputs of a node become the input
+videos of the nodes that list it in "after":
+
+  {
+    "callback_url": "https://your-tunnel.ngrok.io/webhooks/mosaic",
+    "max_in_flight": 4,
+    "nodes": {
+      "clips":    {"agent_id": "AGENT_A"},
+      "captions": {"agent_id": "AGENT_B", "after": ["clips"]},
+      "thumbs":   {"agent_id": "AGENT_C", "after": ["clips"], "advance_on": "OUTPUTS_FINISHED"}
+    }
+  }
+
+Each workflow instance starts its root nodes on the instance's video_ids.
+When RUN_FINISHED (or OUTPUTS_FINISHED for nodes with "advance_on") arrives
+for a node's run, every downstream node whose upstream nodes are all done is
+queued and started through the same /agent/{id}/run call run_agent.py uses
+(retrying 429/503 with its pacing; a 5xx or dropped connection fails the node
+instead, since the run may exist), with at most max_in_flight runs active at
+once. Each change appends the affected instance to a journal next to the JSON
+state file (<state>.journal); the journal is folded into the state file every
+COMPACT_EVERY records, so a restarted listener picks up where it left off and
+a save costs one small append however long the history is. Instances whose
+nodes are all done are dropped after --workflow-retention-hours.
+
+Usage (via the listener):
+  python webhook_listener.py --workflow dag.json [--workflow-state dag.state.json] [--workflow-start VID1,VID2]
+                             [--workflow-retention-hours 168]
+"""
+
+import json
+import logging
+import os
+import threading
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import requests
+
+from run_agent import AimdPacer, OutcomeUnknown, submit_shard
+
+
+logger = logging.getLogger(__name__)
+
+ADVANCE_FLAGS = ("RUN_FINISHED", "OUTPUTS_FINISHED")
+ACTIVE_STATES = ("submitting", "running")
+DONE_STATES = ("completed", "failed", "skipped")
+COMPACT_EVERY = 500  # journal records before they are folded into the state file
+DEFAULT_RETENTION_HOURS = 168.0
+
+
+class WorkflowError(Exception):
+    """Raised for an invalid workflow definition or request."""
+
+
+def load_workflow(path: str) -> Dict[str, Any]:
+    """Read and validate a workflow file; raises WorkflowError."""
+    with open(path, "r", encoding="utf-8") as f:
+        spec = json.load(f)
+
+    nodes = spec.get("nodes")
+    if not isinstance(nodes, dict) or not nodes:
+        raise WorkflowError("workflow needs a non-empty 'nodes' object")
+    for name, node in nodes.items():
+        if not node.get("agent_id"):
+            raise WorkflowError(f"node '{name}' has no agent_id")
+        for dep in node.get("after", []):
+            if dep not in nodes:
+                raise WorkflowError(f"node '{name}' runs after unknown node '{dep}'")
+        if node.get("advance_on", "RUN_FINISHED") not in ADVANCE_FLAGS:
+            raise WorkflowError(f"node '{name}': advance_on must be one of {', '.join(ADVANCE_FLAGS)}")
+
+    # Kahn's algorithm: anything left over sits on a cycle
+    indegree = {name: len(node.get("after", [])) for name, node in nodes.items()}
+    ready = deque(name for name, deg in indegree.items() if deg == 0)
+    visited = 0
+    while ready:
+        current = ready.popleft()
+        visited += 1
+        for name, node in nodes.items():
+            if current in node.get("after", []):
+                indegree[name] -= 1
+                if indegree[name] == 0:
+                    ready.append(name)
+    if visited != len(nodes):
+        raise WorkflowError("workflow nodes form a cycle")
+
+    spec.setdefault("max_in_flight", 4)
+    return spec
+
+
+def output_video_ids(outputs: List[Dict[str, Any]]) -> List[str]:
+    return [out["video_id"] for out in outputs or [] if out.get("video_id")]
+
+
+class WorkflowEngine:
+    """Advances workflow instances as webhook events arrive."""
+
+    def __init__(self, spec: Dict[str, Any], state_path: str, base_url: str, api_key: str,
+                 callback_url: Optional[str] = None, retention_hours: float = DEFAULT_RETENTION_HOURS):
+        self.spec = spec
+        self.nodes = spec["nodes"]
+        self.state_path = state_path
+        self.journal_path = f"{state_path}.journal"
+        self.retention = retention_hours * 3600
+        self.journal = None
+        self.journal_records = 0
+        self.base_url = base_url
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self.callback_url = callback_url or spec.get("callback_url")
+        self.max_in_flight = int(spec["max_in_flight"])
+        self.session = requests.Session()
+        # Same 429/Retry-After handling as run_agent.py's mass submission
+        self.pacer = AimdPacer(rate=2.0, min_rate=0.1, max_rate=20.0)
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.queue = deque()  # (instance_id, node_name) ready to submit
+        # Events that arrived before start_run returned the run_id they belong to
+        self.early_events: Dict[str, List[Dict[str, Any]]] = {}
+        self.state = self._load_state()
+        with self.lock:
+            for instance_id, instance in self.state["instances"].items():
+                for name, node in instance["nodes"].items():
+                    if node["status"] == "submitting":
+                        # The POST may or may not have reached Mosaic; never submit twice
+                        self._finish(instance_id, name, "failed",
+                                     "listener stopped during submission; check Mosaic before re-running")
+            self._compact()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._dispatch_loop, name="workflow-dispatch", daemon=True)
+
+    # --- persistence -----------------------------------------------------
+
+    def _load_state(self) -> Dict[str, Any]:
+        """The state file with the journal replayed over it; runs are rebuilt from the instances."""
+        instances: Dict[str, Any] = {}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                instances = json.load(f)["instances"]
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # torn last line from a crash mid-append
+                    if record["instance"] is None:
+                        instances.pop(record["id"], None)
+                    else:
+                        instances[record["id"]] = record["instance"]
+        runs = {}
+        for instance_id, instance in instances.items():
+            for name, node in instance["nodes"].items():
+                if node["run_id"]:
+                    runs[node["run_id"]] = [instance_id, name]
+                if node["status"] == "queued":
+                    self.queue.append((instance_id, name))
+        return {"instances": instances, "runs": runs}
+
+    def _save(self, instance_id: str) -> None:
+        """Journal one instance's current state. Caller holds the lock."""
+        if self.journal is None:
+            self.journal = open(self.journal_path, "a", encoding="utf-8")
+        instance = self.state["instances"].get(instance_id)
+        self.journal.write(json.dumps({"id": instance_id, "instance": instance}, separators=(",", ":")) + "\n")
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.journal_records += 1
+        if self.journal_records >= COMPACT_EVERY:
+            self._compact()
+
+    def _compact(self) -> None:
+        """Drop expired instances, write the state file atomically and start an empty journal. Caller holds the lock."""
+        self._prune()
+        tmp = f"{self.state_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"instances": self.state["instances"]}, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.state_path)
+        # Replaying a journal over the newer state file is harmless, so a crash here loses nothing
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(self.journal_path, "w", encoding="utf-8")
+        self.journal_records = 0
+
+    def _prune(self) -> None:
+        """Forget instances whose nodes all finished more than `retention` seconds ago."""
+        cutoff = datetime.now(timezone.utc).timestamp() - self.retention
+        expired = []
+        for instance_id, instance in self.state["instances"].items():
+            nodes = instance["nodes"].values()
+            if all(node["status"] in DONE_STATES for node in nodes) and max(
+                    datetime.fromisoformat(node["finished_at"]).timestamp() for node in nodes) < cutoff:
+                expired.append(instance_id)
+        for instance_id in expired:
+            for node in self.state["instances"].pop(instance_id)["nodes"].values():
+                self.state["runs"].pop(node["run_id"], None)
+        if expired:
+            logger.info(f"Workflow: dropped {len(expired)} finished instances older than the retention")
+
+    # --- public API ------------------------------------------------------
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        with self.wakeup:
+            self.stopped = True
+            self.wakeup.notify_all()
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+
+    def start_instance(self, video_ids: List[str], instance_id: Optional[str] = None) -> str:
+        """Create a workflow instance and queue its root nodes."""
+        if not video_ids:
+            raise WorkflowError("video_ids required")
+        instance_id = instance_id or uuid.uuid4().hex[:12]
+        with self.wakeup:
+            if instance_id in self.state["instances"]:
+                raise WorkflowError(f"instance '{instance_id}' already exists")
+            self.state["instances"][instance_id] = {
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "video_ids": list(video_ids),
+                "nodes": {
+                    name: {"status": "waiting", "run_id": None, "inputs": [], "outputs": [], "error": None}
+                    for name in self.nodes
+                },
+            }
+            for name, node in self.nodes.items():
+                if not node.get("after"):
+                    self._queue(instance_id, name, list(video_ids))
+            self._save(instance_id)
+            self.wakeup.notify_all()
+        logger.info(f"Workflow instance {instance_id} started with {len(video_ids)} videos")
+        return instance_id
+
+    def on_event(self, data: Dict[str, Any]) -> None:
+        """Feed a webhook payload; events for runs we didn't start are ignored."""
+        flag = data.get("flag")
+        run_id = data.get("run_id")
+        if flag not in ADVANCE_FLAGS:
+            return
+        with self.wakeup:
+            owner = self.state["runs"].get(run_id)
+            if owner is None:
+                if run_id and self._submitting():
+                    early = self.early_events.setdefault(run_id, [])
+                    early.append(data)
+                    if len(self.early_events) > 1000:
+                        self.early_events.pop(next(iter(self.early_events)))
+                return
+            instance_id, name = owner
+            node = self.state["instances"][instance_id]["nodes"][name]
+            if node["status"] in DONE_STATES:
+                return  # duplicate delivery
+
+            if flag == "OUTPUTS_FINISHED":
+                node["outputs"].extend(data.get("output") or [])
+                if self.nodes[name].get("advance_on") != "OUTPUTS_FINISHED":
+                    self._save(instance_id)
+                    return
+            else:
+                node["outputs"] = data.get("outputs") or node["outputs"]
+                if data.get("status") == "failed":
+                    self._finish(instance_id, name, "failed", "agent run failed")
+                    self._save(instance_id)
+                    self.wakeup.notify_all()
+                    return
+
+            self._finish(instance_id, name, "completed")
+            self._save(instance_id)
+            self.wakeup.notify_all()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            in_flight = self._in_flight()
+            return {
+                "max_in_flight": self.max_in_flight,
+                "in_flight": in_flight,
+                "queued": len(self.queue),
+                "instances": json.loads(json.dumps(self.state["instances"])),
+            }
+
+    # --- internals (caller holds the lock) -------------------------------
+
+    def _queue(self, instance_id: str, name: str, inputs: List[str]) -> None:
+        node = self.state["instances"][instance_id]["nodes"][name]
+        node["status"] = "queued"
+        node["inputs"] = inputs
+        self.queue.append((instance_id, name))
+
+    def _in_flight(self) -> int:
+        return sum(
+            1
+            for instance in self.state["instances"].values()
+            for node in instance["nodes"].values()
+            if node["status"] in ACTIVE_STATES
+        )
+
+    def _submitting(self) -> bool:
+        return any(
+            node["status"] == "submitting"
+            for instance in self.state["instances"].values()
+            for node in instance["nodes"].values()
+        )
+
+    def _finish(self, instance_id: str, name: str, status: str, error: Optional[str] = None) -> None:
+        """Mark a node done and queue or skip whatever depends on it."""
+        instance = self.state["instances"][instance_id]
+        node = instance["nodes"][name]
+        node["status"] = status
+        node["error"] = error
+        node["finished_at"] = datetime.now(timezone.utc).isoformat()
+
+        for child, spec in self.nodes.items():
+            parents = spec.get("after", [])
+            child_state = instance["nodes"][child]
+            if name not in parents or child_state["status"] != "waiting":
+                continue
+            parent_states = [instance["nodes"][p]["status"] for p in parents]
+            if any(s in ("failed", "skipped") for s in parent_states):
+                self._finish(instance_id, child, "skipped", f"upstream node '{name}' {status}")
+            elif all(s == "completed" for s in parent_states):
+                inputs = []
+                for parent in parents:
+                    inputs.extend(output_video_ids(instance["nodes"][parent]["outputs"]))
+                if inputs:
+                    self._queue(instance_id, child, inputs)
+                else:
+                    self._finish(instance_id, child, "skipped", "upstream outputs carry no video_id")
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            with self.wakeup:
+                while not self.stopped and (not self.queue or self._in_flight() >= self.max_in_flight):
+                    self.wakeup.wait()
+                if self.stopped:
+                    return
+                instance_id, name = self.queue.popleft()
+                node = self.state["instances"][instance_id]["nodes"][name]
+                node["status"] = "submitting"
+                self._save(instance_id)
+                agent_id = self.nodes[name]["agent_id"]
+                inputs = list(node["inputs"])
+
+            try:
+                run_id = submit_shard(self.session, self.pacer, self.base_url, self.headers, agent_id,
+                                      inputs, self.callback_url, max_retries=8)
+                error = None
+            except requests.HTTPError as e:
+                run_id, error = None, f"{e} {e.response.text if e.response is not None else ''}".strip()
+            except OutcomeUnknown as e:
+                run_id, error = None, f"outcome unknown, check Mosaic for the run: {e}"
+            except (requests.RequestException, RuntimeError, ValueError) as e:
+                run_id, error = None, str(e)
+
+            with self.wakeup:
+                if run_id:
+                    node["status"] = "running"
+                    node["run_id"] = run_id
+                    self.state["runs"][run_id] = [instance_id, name]
+                    logger.info(f"Workflow {instance_id}: node '{name}' started run {run_id}")
+                else:
+                    logger.error(f"Workflow {instance_id}: node '{name}' failed to start: {error}")
+                    self._finish(instance_id, name, "failed", error)
+                self._save(instance_id)
+                self.wakeup.notify_all()
+                early = self.early_events.pop(run_id, []) if run_id else []
+
+            for event in early:
+                self.on_event(event)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Memory cost of webhook history: parsed dicts vs. api-call/payload_store.py.
+
+Synthetic RUN_STARTED / OUTPUTS_FINISHED / RUN_FINISHED payloads (with
+--outputs outputs each on RUN_FINISHED) are stored N times in both layouts
+and the Python heap growth is measured with tracemalloc. The dict baseline
+is measured on at most --dict-sample events and scaled linearly, since a
+million parsed payloads would not fit on a small machine.
+
+A second pass fills a store with a fixed --budget-mb and reports how many
+events it retains.
+
+Usage:
+  python benchmarks/history_memory.py                       # 100k and 1M events, zlib
+  python benchmarks/history_memory.py --events 100000 --compression none zlib zstd --json
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "api-call"))
+
+from payload_store import PayloadStore  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def make_payloads(count: int, outputs: int, seed: int = 7) -> List[bytes]:
+    """A rotating set of distinct payload bodies, as the listener would receive them."""
+    rng = random.Random(seed)
+    bodies = []
+    for i in range(count):
+        run_id = f"{rng.getrandbits(64):016x}-{i:06d}"
+        agent_id = f"agent-{rng.randrange(20):02d}"
+        flag = ("RUN_STARTED", "OUTPUTS_FINISHED", "RUN_FINISHED")[i % 3]
+        payload: Dict[str, Any] = {
+            "flag": flag,
+            "agent_id": agent_id,
+            "run_id": run_id,
+            "status": "completed" if flag == "RUN_FINISHED" else "running",
+            "triggered_by": {"type": "youtube", "channel_id": f"UC{rng.getrandbits(96):024x}"},
+            "inputs": [{"video_id": f"vid_{rng.getrandbits(48):012x}", "url": f"https://cdn.example.com/in/{i}.mp4"}],
+        }
+        if flag != "RUN_STARTED":
+            payload["outputs"] = [
+                {
+                    "video_id": f"out_{rng.getrandbits(48):012x}",
+                    "video_url": f"https://cdn.example.com/out/{run_id}/{n}.mp4",
+                    "thumbnail_url": f"https://cdn.example.com/out/{run_id}/{n}.jpg",
+                    "completed_at": "2026-01-01T00:00:00Z",
+                    "duration_seconds": rng.randrange(10, 600),
+                }
+                for n in range(outputs)
+            ]
+        bodies.append(json.dumps(payload).encode())
+    return bodies
+
+
+def measure(fill) -> int:
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    keep = fill()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del keep
+    return used
+
+
+def dict_history(bodies: List[bytes], events: int):
+    def fill():
+        history = []
+        for i in range(events):
+            history.append({
+                "timestamp": "2026-01-01T00:00:00.000000+00:00",
+                "path": "/webhooks/mosaic",
+                "token": None,
+                "data": json.loads(bodies[i % len(bodies)]),
+            })
+        return history
+    return fill
+
+
+def store_history(bodies: List[bytes], events: int, compression: str, max_bytes=None):
+    def fill():
+        store = PayloadStore(max_bytes=max_bytes, compression=compression)
+        for i in range(events):
+            # A fresh bytes object per event, like request.get_data()
+            store.append(bytearray(bodies[i % len(bodies)]), path="/webhooks/mosaic")
+        return store
+    return fill
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark webhook history memory use")
+    parser.add_argument("--events", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--compression", nargs="+", default=["zlib"], choices=["none", "zlib", "zstd"])
+    parser.add_argument("--outputs", type=int, default=5, help="Outputs per RUN_FINISHED payload (default: 5)")
+    parser.add_argument("--distinct", type=int, default=5000, help="Distinct payload bodies cycled through (default: 5000)")
+    parser.add_argument("--dict-sample", type=int, default=50_000, help="Max events measured for the dict baseline")
+    parser.add_argument("--budget-mb", type=float, default=64.0, help="Budget for the retention pass (default: 64)")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    bodies = make_payloads(args.distinct, args.outputs)
+    avg_json = sum(len(b) for b in bodies) / len(bodies)
+    results = []
+
+    for events in args.events:
+        sample = min(events, args.dict_sample)
+        dict_bytes = measure(dict_history(bodies, sample)) * events / sample
+        row = {"events": events, "avg_json_bytes": round(avg_json), "dict_bytes": int(dict_bytes),
+               "dict_extrapolated": sample < events, "stores": {}}
+        for compression in args.compression:
+            started = time.perf_counter()
+            used = measure(store_history(bodies, events, compression))
+            elapsed = time.perf_counter() - started
+            row["stores"][compression] = {
+                "bytes": used,
+                "bytes_per_event": round(used / events, 1),
+                "vs_dict": round(dict_bytes / used, 2) if used else None,
+                "append_us": round(elapsed / events * 1e6, 2),
+            }
+        results.append(row)
+
+    budget = int(args.budget_mb * MB)
+    retention = {}
+    for compression in args.compression:
+        store = store_history(bodies, max(args.events), compression, budget)()
+        retention[compression] = store.stats()
+
+    if args.json:
+        print(json.dumps({"results": results, "retention": retention}, indent=2))
+        return
+
+    print(f"Payloads: {args.distinct} distinct, avg {avg_json:.0f} B JSON, {args.outputs} outputs on RUN_FINISHED\n")
+    for row in results:
+        note = " (extrapolated)" if row["dict_extrapolated"] else ""
+        print(f"{row['events']:,} events")
+        print(f"   dict history     {row['dict_bytes'] / MB:10.1f} MB  {row['dict_bytes'] / row['events']:8.0f} B/event{note}")
+        for compression, s in row["stores"].items():
+            print(f"   store ({compression:<5})    {s['bytes'] / MB:10.1f} MB  {s['bytes_per_event']:8.0f} B/event"
+                  f"  {s['vs_dict']:5.1f}x smaller  {s['append_us']:.1f} us/append")
+        print()
+    print(f"Retention within a {args.budget_mb:g} MB budget after {max(args.events):,} events:")
+    for compression, s in retention.items():
+        print(f"   {compression:<5} {s['entries']:>10,} entries kept  ({s['evicted']:,} evicted, {s['bytes'] / MB:.1f} MB accounted)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmarks for the hot pure-Python paths, with a regression gate.
+
+Cases:
+  - WebhookHandler.format_webhook (youtube-automation) and format_event
+    (api-call) on a small payload and on a RUN_FINISHED with 1,000 outputs
+  - a POST through each listener's Flask test client, with and without a
+    secret (api-call validates it; youtube-automation only logs it)
+  - parse_channels, parse_ids and determine_content_type on large inputs
+  - get_video_metadata on small generated clips (needs moviepy and an ffmpeg
+    binary; skipped otherwise)
+
+Each case is timed timeit-style: the loop count is calibrated to roughly
+--min-time seconds and the loop is repeated --repeat times. Listener output
+(print/logging) goes to /dev/null while timing.
+
+Results are compared with the stored baseline (benchmarks/micro_baseline.json
+by default) and the script exits non-zero when any case is slower than its
+baseline by more than --threshold. On shared machines and CI runners raw
+timings swing by tens of percent within a minute, even best-of-N, so the gate
+compares each case relative to a fixed yardstick loop instead: every repeat
+is bracketed by two yardstick runs of the same length, divided by their mean,
+and the median of those ratios is kept. --absolute compares raw best-of-N
+us/op, which only holds up on a quiet, dedicated machine.
+Baselines are still best recorded on the machine that checks them; refresh
+them with --save-baseline after an intentional change or on a new runner.
+
+Usage:
+  python benchmarks/micro.py                         # run, compare with the baseline
+  python benchmarks/micro.py --threshold 0.10        # fail on >10% regressions
+  python benchmarks/micro.py -k format -k parse      # only matching cases
+  python benchmarks/micro.py --save-baseline         # record a new baseline
+  python benchmarks/micro.py --json
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_CALL = os.path.join(ROOT, "api-call")
+YOUTUBE = os.path.join(ROOT, "youtube-automation")
+sys.path.insert(0, API_CALL)
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "micro_baseline.json")
+
+# name -> (benchmark callable, operations per call) or a skip reason
+Case = Tuple[Callable[[], Any], int]
+
+
+def load_module(name: str, path: str):
+    """Import a script by path; both listeners are called webhook_listener.py."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_finished(outputs: int) -> Dict[str, Any]:
+    return {
+        "flag": "RUN_FINISHED",
+        "agent_id": "agent-bench",
+        "run_id": "run-bench-0001",
+        "status": "completed",
+        "triggered_by": {"type": "youtube", "channel_id": "UC" + "x" * 22},
+        "outputs": [
+            {
+                "video_id": f"out_{n:06d}",
+                "video_url": f"https://cdn.example.com/out/run-bench-0001/{n}.mp4",
+                "thumbnail_url": f"https://cdn.example.com/out/run-bench-0001/{n}.jpg",
+                "completed_at": "2026-01-01T00:00:00Z",
+            }
+            for n in range(outputs)
+        ],
+    }
+
+
+SMALL_EVENT = {
+    "flag": "RUN_STARTED",
+    "agent_id": "agent-bench",
+    "run_id": "run-bench-0001",
+    "status": "running",
+    "inputs": [{"video_id": "vid_0001", "video_url": "https://cdn.example.com/in/1.mp4"}],
+    "triggered_by": {
+        "type": "youtube",
+        "youtube": {"title": "Bench", "channel": "Bench", "id": "abc", "url": "https://youtu.be/abc"},
+    },
+}
+LARGE_EVENT = run_finished(1000)
+
+
+def listener_cases(api_listener, yt_listener) -> Dict[str, Case]:
+    small_body = json.dumps(SMALL_EVENT)
+    large_body = json.dumps(LARGE_EVENT)
+    api_client = api_listener.app.test_client()
+    yt_client = yt_listener.app.test_client()
+
+    def api_post(body: str, secret: Optional[str]):
+        def call():
+            api_listener.app.config["WEBHOOK_SECRET"] = secret
+            headers = {"X-Mosaic-Signature": secret} if secret else {}
+            response = api_client.post("/webhooks/mosaic/bench", data=body,
+                                       content_type="application/json", headers=headers)
+            assert response.status_code == 200, response.status_code
+        return call
+
+    def yt_post(body: str, secret: Optional[str]):
+        def call():
+            headers = {"X-Mosaic-Signature": secret} if secret else {}
+            response = yt_client.post("/webhook/bench", data=body, content_type="application/json", headers=headers)
+            assert response.status_code == 200, response.status_code
+        return call
+
+    format_webhook = yt_listener.WebhookHandler.format_webhook
+    format_event = api_listener.format_event
+    return {
+        "format_webhook/small": (lambda: format_webhook(SMALL_EVENT), 1),
+        "format_webhook/1000_outputs": (lambda: format_webhook(LARGE_EVENT), 1),
+        "format_event/small": (lambda: format_event(SMALL_EVENT), 1),
+        "format_event/1000_outputs": (lambda: format_event(LARGE_EVENT), 1),
+        "api_listener/post_small": (api_post(small_body, None), 1),
+        "api_listener/post_small_secret": (api_post(small_body, "whsec_bench"), 1),
+        "api_listener/post_1000_outputs": (api_post(large_body, None), 1),
+        "yt_listener/post_small": (yt_post(small_body, None), 1),
+        "yt_listener/post_small_secret": (yt_post(small_body, "whsec_bench"), 1),
+        "yt_listener/post_1000_outputs": (yt_post(large_body, None), 1),
+    }
+
+
+def parser_cases(run_agent, add_triggers, upload_video) -> Dict[str, Case]:
+    ids = ",".join(f" vid_{n:08d} " for n in range(10_000)) + ",,"
+    channels = ",".join(
+        ("UC" + f"{n:022d}", f"@handle{n}", f"https://www.youtube.com/@chan{n}")[n % 3] for n in range(10_000)
+    )
+    paths = [f"/media/batch/{n:05d}/clip{n}{('.mp4', '.MOV', '.mkv', '.webm', '.avi', '.bin')[n % 6]}"
+             for n in range(10_000)]
+
+    def content_types():
+        determine = upload_video.determine_content_type
+        for path in paths:
+            determine(path, None)
+
+    return {
+        "parse_ids/10k": (lambda: run_agent.parse_ids(ids), 1),
+        "parse_channels/10k": (lambda: add_triggers.parse_channels(channels), 1),
+        "determine_content_type/10k": (content_types, len(paths)),
+    }
+
+
+def find_ffmpeg() -> Optional[str]:
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except (ImportError, RuntimeError):
+        return shutil.which("ffmpeg")
+
+
+def metadata_cases(upload_video, workdir: str, samples: List[str]) -> Dict[str, Any]:
+    if importlib.util.find_spec("moviepy") is None:
+        return {"get_video_metadata": "moviepy is not installed"}
+    if not samples:
+        ffmpeg = find_ffmpeg()
+        if ffmpeg is None:
+            return {"get_video_metadata": "no ffmpeg binary to generate sample clips (pass --sample-video)"}
+        for size, seconds in (("320x240", 1), ("1280x720", 5)):
+            path = os.path.join(workdir, f"sample_{size}_{seconds}s.mp4")
+            subprocess.run([ffmpeg, "-y", "-loglevel", "error", "-f", "lavfi",
+                            "-i", f"testsrc=size={size}:rate=30:duration={seconds}",
+                            "-pix_fmt", "yuv420p", path], check=True)
+            samples.append(path)
+    return {
+        f"get_video_metadata/{os.path.basename(path)}": (lambda path=path: upload_video.get_video_metadata(path), 1)
+        for path in samples
+    }
+
+
+_YARD_DOC = {"items": [{"id": i, "name": f"item-{i}", "tags": ["a", "b"], "ok": i % 2 == 0} for i in range(40)]}
+
+
+def _yardstick() -> int:
+    """Fixed pure-Python workload (arithmetic, strings, JSON) used as a measure of the machine's current speed."""
+    total = 0
+    for i in range(1000):
+        total += len(str(i)) * (i & 7)
+    json.loads(json.dumps(_YARD_DOC))
+    "-".join(str(i) for i in range(200)).split("-")
+    return total
+
+
+def _calibrate_loops(fn: Callable[[], Any], min_time: float) -> int:
+    fn()  # warm up caches and lazy imports
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time or loops >= 1_000_000:
+            return loops
+        loops = max(loops * 2, int(loops * min_time / max(elapsed, 1e-9) * 1.1))
+
+
+def _time_loops(fn: Callable[[], Any], loops: int) -> float:
+    start = time.perf_counter()
+    for _ in range(loops):
+        fn()
+    return time.perf_counter() - start
+
+
+def time_case(fn: Callable[[], Any], ops: int, repeat: int, min_time: float) -> Dict[str, Any]:
+    """
+    Best and median time per operation over `repeat` repeats, plus the median
+    ratio of each repeat to the yardstick runs around it.
+
+    Slowdowns on a shared machine come and go over seconds and hit the repeat
+    and the yardstick runs on either side of it alike, so they cancel out of
+    the ratio; the median drops the few repeats a burst caught unevenly.
+    """
+    loops = _calibrate_loops(fn, min_time)
+    yard_loops = _calibrate_loops(_yardstick, min_time)
+    per_op, ratios = [], []
+    after = _time_loops(_yardstick, yard_loops) / yard_loops
+    for _ in range(repeat):
+        before = after
+        op = _time_loops(fn, loops) / (loops * ops)
+        after = _time_loops(_yardstick, yard_loops) / yard_loops
+        per_op.append(op * 1e6)
+        ratios.append(op / ((before + after) / 2))
+    return {
+        "us_per_op": round(min(per_op), 3),
+        "us_median": round(statistics.median(per_op), 3),
+        "relative": round(statistics.median(ratios), 6),
+        "loops": loops,
+        "ops_per_call": ops,
+    }
+
+
+def environment() -> Dict[str, str]:
+    return {"python": platform.python_version(), "machine": platform.machine(), "platform": platform.platform()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks with a regression gate")
+    parser.add_argument("-k", "--filter", action="append", default=[], help="Only run cases containing this text")
+    parser.add_argument("--repeat", type=int, default=15, help="Timed repeats per case (default: 15)")
+    parser.add_argument("--min-time", type=float, default=0.05, help="Seconds per repeat (default: 0.05)")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline file (default: benchmarks/micro_baseline.json)")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Fail when a case is this much slower than its baseline (default: 0.25 = 25%%)")
+    parser.add_argument("--absolute", action="store_true",
+                        help="Compare raw best-of-N us/op instead of timings relative to the yardstick "
+                             "(only reliable on a quiet, dedicated machine)")
+    parser.add_argument("--sample-video", action="append", default=[], help="Video file for get_video_metadata (repeatable)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="mosaic-bench-") as workdir, \
+            contextlib.redirect_stdout(io.StringIO()):
+        # Keep the listeners' log lines and the tracer out of the measurements
+        os.environ.pop("MOSAIC_TRACE_FILE", None)
+        os.environ.pop("MOSAIC_TRACE_ENDPOINT", None)
+        os.environ.pop("MOSAIC_WEBHOOK_SECRET", None)
+        os.environ.pop("DEBUG", None)
+        api_listener = load_module("bench_api_listener", os.path.join(API_CALL, "webhook_listener.py"))
+        yt_listener = load_module("bench_yt_listener", os.path.join(YOUTUBE, "webhook_listener.py"))
+        logging.disable(logging.CRITICAL)
+        run_agent = load_module("bench_run_agent", os.path.join(API_CALL, "run_agent.py"))
+        add_triggers = load_module("bench_add_triggers", os.path.join(YOUTUBE, "add_triggers.py"))
+        upload_video = load_module("bench_upload_video", os.path.join(API_CALL, "upload_video.py"))
+
+        cases: Dict[str, Any] = {}
+        cases.update(listener_cases(api_listener, yt_listener))
+        cases.update(parser_cases(run_agent, add_triggers, upload_video))
+        cases.update(metadata_cases(upload_video, workdir, list(args.sample_video)))
+
+        results: Dict[str, Dict[str, Any]] = {}
+        skipped: Dict[str, str] = {}
+        devnull = open(os.devnull, "w")
+        for name, case in cases.items():
+            if args.filter and not any(text in name for text in args.filter):
+                continue
+            if isinstance(case, str):
+                skipped[name] = case
+                continue
+            fn, ops = case
+            with contextlib.redirect_stdout(devnull):
+                results[name] = time_case(fn, ops, args.repeat, args.min_time)
+        devnull.close()
+
+    baseline: Dict[str, Any] = {}
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    env = environment()
+    failures = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        if args.absolute or "relative" not in base:
+            change = result["us_per_op"] / base["us_per_op"] - 1
+        else:
+            change = result["relative"] / base["relative"] - 1
+        result["baseline_us"] = base["us_per_op"]
+        result["change"] = round(change, 4)
+        if change > args.threshold:
+            failures.append(f"{name}: {result['us_per_op']:.1f}us vs {base['us_per_op']:.1f}us baseline "
+                            f"(+{change:.0%} > {args.threshold:.0%})")
+    mismatch = baseline and {k: v for k, v in baseline.get("environment", {}).items() if env.get(k) != v}
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"environment": env, "results": results, "skipped": skipped}, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.json:
+        print(json.dumps({"environment": env, "results": results, "skipped": skipped,
+                          "failures": failures}, indent=2))
+    else:
+        print(f"{'case':<44} {'us/op':>11} {'baseline':>11} {'change':>8}")
+        for name, r in results.items():
+            base = f"{r['baseline_us']:.2f}" if "baseline_us" in r else "-"
+            change = f"{r['change']:+.0%}" if "change" in r else ""
+            print(f"{name:<44} {r['us_per_op']:>11.2f} {base:>11} {change:>8}")
+        for name, reason in skipped.items():
+            print(f"⏭️  {name}: skipped ({reason})")
+        if mismatch:
+            print(f"⚠️  Baseline was recorded on a different environment: {mismatch}")
+        if args.save_baseline:
+            print(f"💾 Baseline written to {args.baseline}")
+        elif not baseline:
+            print(f"ℹ️  No baseline at {args.baseline}; record one with --save-baseline")
+        for failure in failures:
+            print(f"❌ {failure}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Parse time and memory of /agent_run/{id} responses: resp.json() dicts vs.
+api-call/run_models.py RunStatus.
+
+Synthetic completed-run responses with --outputs outputs each are parsed the
+way get_status.py --watch reads them (status, then every output URL), and
+with "status" placed after "outputs" to show the cost of a late key. Memory
+is measured with tracemalloc twice: the peak while parsing one response, and
+the heap kept when --keep responses are held at once, as a watcher would.
+
+Usage:
+  python benchmarks/run_models.py                          # 100, 1k and 10k outputs
+  python benchmarks/run_models.py --outputs 50000 --keep 20 --json
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "api-call"))
+
+from run_models import RunStatus  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def make_response(outputs: int, status_last: bool = False, seed: int = 7) -> bytes:
+    rng = random.Random(seed)
+    run_id = f"{rng.getrandbits(64):016x}"
+    body: Dict[str, Any] = {
+        "run_id": run_id,
+        "agent_id": "agent-01",
+        "triggered_by": {"type": "youtube", "channel_id": f"UC{rng.getrandbits(96):024x}"},
+        "inputs": [{"video_id": f"vid_{rng.getrandbits(48):012x}", "file_name": "in.mp4"}],
+        "outputs": [
+            {
+                "video_id": f"out_{rng.getrandbits(48):012x}",
+                "video_url": f"https://cdn.example.com/out/{run_id}/{n}.mp4",
+                "thumbnail_url": f"https://cdn.example.com/out/{run_id}/{n}.jpg",
+                "completed_at": "2026-01-01T00:00:00Z",
+                "duration_seconds": rng.randrange(10, 600),
+            }
+            for n in range(outputs)
+        ],
+    }
+    if status_last:
+        body["status"] = "completed"
+    else:
+        body = {"status": "completed", **body}
+    return json.dumps(body).encode()
+
+
+def read_dict(body: bytes):
+    data = json.loads(body)
+    urls = [o.get("video_url") or o.get("url") for o in data.get("outputs") or []]
+    return data.get("status"), urls
+
+
+def read_model(body: bytes):
+    run = RunStatus(body)
+    return run.status, run.output_urls()
+
+
+def read_dict_status(body: bytes):
+    return json.loads(body).get("status")
+
+
+def read_model_status(body: bytes):
+    return RunStatus(body).status
+
+
+def best_ms(fn: Callable, body: bytes, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(body)
+        times.append(time.perf_counter() - started)
+    return min(times) * 1000
+
+
+def peak_bytes(fn: Callable, body: bytes) -> int:
+    gc.collect()
+    tracemalloc.start()
+    fn(body)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def kept_bytes(make: Callable[[bytes], Any], bodies: List[bytes]) -> int:
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    # A fresh bytes object per response, like resp.content
+    keep = [make(bytes(bytearray(b))) for b in bodies]
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del keep
+    return used
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark run response parsing: dicts vs. RunStatus")
+    parser.add_argument("--outputs", type=int, nargs="+", default=[100, 1000, 10_000])
+    parser.add_argument("--keep", type=int, default=50, help="Responses held at once for the retained-memory pass (default: 50)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timing repeats, best is reported (default: 5)")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    results = []
+    for outputs in args.outputs:
+        body = make_response(outputs)
+        late = make_response(outputs, status_last=True)
+        assert read_dict(body) == read_model(body) == read_model(late)
+        bodies = [make_response(outputs, seed=i) for i in range(args.keep)]
+        row = {
+            "outputs": outputs,
+            "json_bytes": len(body),
+            "parse_ms": {
+                "dict": round(best_ms(read_dict, body, args.repeat), 3),
+                "model": round(best_ms(read_model, body, args.repeat), 3),
+                "model_status_last": round(best_ms(read_model, late, args.repeat), 3),
+            },
+            "status_only_ms": {
+                "dict": round(best_ms(read_dict_status, body, args.repeat), 3),
+                "model": round(best_ms(read_model_status, body, args.repeat), 3),
+            },
+            "peak_bytes": {"dict": peak_bytes(read_dict, body), "model": peak_bytes(read_model, body)},
+            "kept_bytes": {"dict": kept_bytes(json.loads, bodies), "model": kept_bytes(RunStatus, bodies)},
+        }
+        results.append(row)
+
+    if args.json:
+        print(json.dumps({"keep": args.keep, "results": results}, indent=2))
+        return
+
+    for row in results:
+        p, s, peak, kept = row["parse_ms"], row["status_only_ms"], row["peak_bytes"], row["kept_bytes"]
+        print(f"{row['outputs']:,} outputs ({row['json_bytes'] / 1024:.0f} KB JSON)")
+        print(f"   status + urls    dict {p['dict']:9.2f} ms   model {p['model']:9.2f} ms"
+              f"   (status last {p['model_status_last']:.2f} ms)")
+        print(f"   status only      dict {s['dict']:9.2f} ms   model {s['model']:9.2f} ms")
+        print(f"   peak while parse dict {peak['dict'] / MB:9.2f} MB   model {peak['model'] / MB:9.2f} MB")
+        print(f"   {args.keep} kept        dict {kept['dict'] / MB:9.2f} MB   model {kept['model'] / MB:9.2f} MB"
+              f"   {kept['dict'] / kept['model']:.1f}x smaller")
+        print()
+
+
+if __name__ == "__main__":
+    main()
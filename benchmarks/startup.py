@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Measure `mosaic <command> --help` startup cost using `python -X importtime`.
+
+For every subcommand the CLI is started a few times; the wall time and the
+cumulative import time reported by the interpreter are recorded, together
+with the heaviest top-level imports. With --max-import-ms / --max-wall-ms or
+--forbid the script exits non-zero when a budget is exceeded, so CI or a test
+can assert against it.
+
+Usage:
+  python benchmarks/startup.py [--runs 5] [--json]
+  python benchmarks/startup.py --max-import-ms 150 --forbid moviepy --forbid numpy
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MOSAIC = os.path.join(ROOT, "mosaic.py")
+COMMANDS = ["", "upload", "run", "status", "triggers", "listen", "auth"]
+
+
+def parse_importtime(stderr: str) -> Tuple[int, List[Tuple[str, int]], List[str]]:
+    """
+    Parse `-X importtime` output.
+
+    Returns:
+        (total cumulative microseconds of top-level imports,
+         [(module, cumulative_us)] for top-level imports,
+         every imported module name)
+    """
+    total_us = 0
+    top_level = []
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            cumulative_us = int(parts[1].strip())
+        except ValueError:
+            continue
+        raw_name = parts[2].rstrip()
+        name = raw_name.strip()
+        modules.append(name)
+        # Top-level imports have a single leading space before the name
+        if len(raw_name) - len(raw_name.lstrip()) == 1:
+            total_us += cumulative_us
+            top_level.append((name, cumulative_us))
+    return total_us, top_level, modules
+
+
+def measure(command: str, runs: int) -> Dict[str, Any]:
+    argv = [sys.executable, "-X", "importtime", MOSAIC]
+    if command:
+        argv.append(command)
+    argv.append("--help")
+
+    walls, imports = [], []
+    top_level, modules = [], []
+    for _ in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.run(argv, capture_output=True, text=True, cwd=ROOT)
+        walls.append((time.perf_counter() - start) * 1000)
+        total_us, top_level, modules = parse_importtime(proc.stderr)
+        imports.append(total_us / 1000)
+        if proc.returncode != 0:
+            raise RuntimeError(f"'{' '.join(argv)}' exited with {proc.returncode}:\n{proc.stderr[-2000:]}")
+
+    heaviest = sorted(top_level, key=lambda item: item[1], reverse=True)[:5]
+    return {
+        "command": command or "(none)",
+        "runs": runs,
+        "wall_ms_median": round(statistics.median(walls), 2),
+        "wall_ms_min": round(min(walls), 2),
+        "import_ms_median": round(statistics.median(imports), 2),
+        "heaviest_imports": [{"module": m, "ms": round(us / 1000, 2)} for m, us in heaviest],
+        "modules": sorted(set(modules)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark mosaic CLI startup time")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per command (default: 5)")
+    parser.add_argument("--command", action="append", help="Only measure these subcommands")
+    parser.add_argument("--max-import-ms", type=float, help="Fail if median import time exceeds this")
+    parser.add_argument("--max-wall-ms", type=float, help="Fail if median wall time exceeds this")
+    parser.add_argument("--forbid", action="append", default=[],
+                        help="Fail if this top-level package is imported by `--help` (repeatable)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    commands = args.command or COMMANDS
+    results = [measure(cmd, args.runs) for cmd in commands]
+
+    failures = []
+    for result in results:
+        if args.max_import_ms is not None and result["import_ms_median"] > args.max_import_ms:
+            failures.append(f"{result['command']}: import {result['import_ms_median']}ms > {args.max_import_ms}ms")
+        if args.max_wall_ms is not None and result["wall_ms_median"] > args.max_wall_ms:
+            failures.append(f"{result['command']}: wall {result['wall_ms_median']}ms > {args.max_wall_ms}ms")
+        loaded = {m.split(".")[0] for m in result["modules"]}
+        for pkg in args.forbid:
+            if pkg in loaded:
+                failures.append(f"{result['command']}: imports forbidden package '{pkg}'")
+
+    if args.json:
+        print(json.dumps({"results": results, "failures": failures}, indent=2))
+    else:
+        print(f"{'command':<10} {'wall ms':>9} {'import ms':>10}  heaviest imports")
+        for r in results:
+            heavy = ", ".join(f"{h['module']} {h['ms']}" for h in r["heaviest_imports"][:3])
+            print(f"{r['command']:<10} {r['wall_ms_median']:>9.1f} {r['import_ms_median']:>10.1f}  {heavy}")
+        for failure in failures:
+            print(f"❌ {failure}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Single `mosaic` entry point for the scripts in api-call/ and youtube-automation/.
+
+Each subcommand runs the matching script exactly as `python <script> ...` would,
+but nothing heavier than the standard library is imported until a subcommand
+has been chosen, so `mosaic --help` and typos return almost immediately.
+
+Usage:
+  python mosaic.py <command> [options]
+  python mosaic.py upload --file video.mp4
+  python mosaic.py run --agent-id AGENT_ID --video-ids VID1,VID2
+  python mosaic.py queue dispatch --max-in-flight 8
+  python mosaic.py status --run-id RUN_ID --watch
+  python mosaic.py batch --input commands.ndjson --concurrency 16
+  python mosaic.py triggers --agent-id AGENT_ID --channels @mkbhd
+  python mosaic.py listen --port 3000 [--youtube]
+  python mosaic.py auth
+  python mosaic.py trace summary --file traces.jsonl
+  python mosaic.py capture replay incident.cap --target http://localhost:3000 --speed 10
+"""
+
+import os
+import sys
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# command -> (directory, script, summary)
+COMMANDS = {
+    "upload": ("api-call", "upload_video.py", "Upload a video file"),
+    "run": ("api-call", "run_agent.py", "Run an agent on uploaded videos"),
+    "queue": ("api-call", "run_queue.py", "Dispatch queued runs with a max-in-flight budget"),
+    "status": ("api-call", "get_status.py", "Get or watch an agent run status"),
+    "batch": ("api-call", "batch.py", "Run NDJSON batches of run/status operations"),
+    "proxy": ("api-call", "api_proxy.py", "Run the local caching API proxy"),
+    "triggers": ("youtube-automation", "add_triggers.py", "Add YouTube channel triggers to an agent"),
+    "listen": ("api-call", "webhook_listener.py", "Start a webhook listener (--youtube for the trigger listener)"),
+    "auth": ("youtube-automation", "test_auth.py", "Test API key authentication"),
+    "trace": ("api-call", "tracing.py", "Summarize upload -> run -> webhook traces"),
+    "capture": ("api-call", "capture.py", "Inspect or replay captured webhook traffic"),
+    "tunnel": ("api-call", "tunnel.py", "Start, reuse or stop an ngrok tunnel to a local port"),
+    "cluster": ("api-call", "cluster.py", "Inspect the shared store of clustered listeners"),
+    "artifacts": ("api-call", "artifact_cache.py", "Inspect or clear the listener artifact cache"),
+}
+
+YOUTUBE_LISTENER = ("youtube-automation", "webhook_listener.py")
+
+
+def print_usage(out=sys.stdout) -> None:
+    lines = ["usage: mosaic <command> [options]", "", "commands:"]
+    for name, (_, _, summary) in COMMANDS.items():
+        lines.append(f"  {name:<10}{summary}")
+    lines.append("")
+    lines.append("Run 'mosaic <command> --help' for command options.")
+    print("\n".join(lines), file=out)
+
+
+def resolve_script(command: str, args: list) -> tuple:
+    """Return (script_path, remaining_args) for a subcommand."""
+    directory, script, _ = COMMANDS[command]
+    if command == "listen" and "--youtube" in args:
+        directory, script = YOUTUBE_LISTENER
+        args = [a for a in args if a != "--youtube"]
+    return os.path.join(ROOT, directory, script), args
+
+
+def run_script(script_path: str, args: list) -> None:
+    """Execute a script as __main__, the same way the interpreter would."""
+    import runpy
+
+    sys.path.insert(0, os.path.dirname(script_path))
+    sys.argv = [script_path, *args]
+    runpy.run_path(script_path, run_name="__main__")
+
+
+def main(argv=None) -> None:
+    argv = list(sys.argv[1:] if argv is None else argv)
+
+    if not argv or argv[0] in ("-h", "--help", "help"):
+        print_usage()
+        return
+
+    command, args = argv[0], argv[1:]
+    if command not in COMMANDS:
+        print(f"❌ Unknown command: {command}\n", file=sys.stderr)
+        print_usage(sys.stderr)
+        sys.exit(2)
+
+    script_path, args = resolve_script(command, args)
+    run_script(script_path, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,15 +7,29 @@ Usage:
     
 Example:
     python add_triggers.py --agent-id abc123 --api-key mk_your_key --channels UCxxxxxx,@channelname --webhook https://your-app.com/webhook
+
+Sync a large roster (only channels missing from the agent's trigger are sent):
+    python add_triggers.py --agent-id abc123 --channels-file channels.csv --sync
 """
 
 import argparse
+import csv
 import requests
 import json
+import os
 import sys
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
 from urllib.parse import urlparse
 
+# The host-wide rate limiter is shared with the scripts in ../api-call
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api-call'))
+from profiling import add_profile_arguments, start_profiler
+from ratelimit import acquire
+
+
+REQUEST_TIMEOUT = 30  # seconds
+
 
 class MosaicTriggerManager:
     """Manages YouTube triggers for Mosaic agents."""
@@ -27,6 +41,7 @@ class MosaicTriggerManager:
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json"
         }
+        self.session = requests.Session()
     
     def add_youtube_channels(
         self, 
@@ -60,10 +75,12 @@ class MosaicTriggerManager:
             print(f"   Webhook URL: {callback_url}")
         
         try:
-            response = requests.post(
+            acquire("triggers")
+            response = self.session.post(
                 endpoint,
                 headers=self.headers,
-                json=payload
+                json=payload,
+                timeout=REQUEST_TIMEOUT
             )
             response.raise_for_status()
             return response.json() if response.text else {"status": "ok"}
@@ -91,7 +108,8 @@ class MosaicTriggerManager:
         print(f"\n🔍 Fetching triggers for agent {agent_id}...")
         
         try:
-            response = requests.get(endpoint, headers=self.headers)
+            acquire("triggers")
+            response = self.session.get(endpoint, headers=self.headers, timeout=REQUEST_TIMEOUT)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.HTTPError as e:
@@ -103,6 +121,99 @@ class MosaicTriggerManager:
             print(f"\n❌ Unexpected error: {e}")
             raise
     
+    def sync_youtube_channels(
+        self,
+        agent_id: str,
+        channels: List[str],
+        callback_url: Optional[str] = None,
+        chunk_size: int = 100,
+        concurrency: int = 4,
+        skip_existing: bool = True
+    ) -> Dict[str, list]:
+        """
+        Add only the channels the agent's trigger doesn't already monitor.
+        
+        Channels are compared by normalize_channel(), the current triggers are
+        fetched once, and missing channels are posted in chunks with bounded
+        concurrency. When nothing is missing but a callback_url is given, one
+        already-present channel is re-sent with it so the URL still gets applied.
+        
+        Args:
+            agent_id: The ID of the agent
+            channels: Channel IDs, handles or URLs (duplicates are ignored)
+            callback_url: Optional webhook URL for notifications
+            chunk_size: Maximum channels per request
+            concurrency: Maximum requests in flight
+            skip_existing: Fetch current triggers and skip channels already present
+            
+        Returns:
+            Report with 'added', 'already_present' and 'failed' lists; failed
+            entries are {'channel': ..., 'error': ...}. With a callback_url,
+            'callback_updated' says whether a request carrying it succeeded
+        """
+        wanted = dedupe_channels(channels)
+        existing = set()
+        if skip_existing:
+            existing = {normalize_channel(ch) for ch in trigger_channels(self.get_triggers(agent_id))}
+        
+        report = {"added": [], "already_present": [], "failed": []}
+        missing = []
+        for channel in wanted:
+            if channel in existing:
+                report["already_present"].append(channel)
+            else:
+                missing.append(channel)
+        
+        chunks = [missing[i:i + chunk_size] for i in range(0, len(missing), chunk_size)]
+        print(f"\n📡 Sending {len(wanted)} channels to agent {agent_id}: "
+              f"{len(report['already_present'])} already present, {len(missing)} to add "
+              f"in {len(chunks)} request(s)")
+        endpoint = f"{self.base_url}/agent/{agent_id}/triggers/add_youtube_channels"
+        
+        def post_chunk(chunk: List[str]) -> None:
+            payload = {"youtube_channels": chunk}
+            if callback_url is not None:
+                payload["trigger_callback_url"] = callback_url
+            acquire("triggers")
+            response = self.session.post(endpoint, headers=self.headers, json=payload, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+        
+        if not chunks:
+            if callback_url is not None:
+                # Re-adding a channel the trigger already has changes nothing but the URL
+                print("   Nothing to add; applying the webhook URL with one request")
+                try:
+                    post_chunk(report["already_present"][:1])
+                    report["callback_updated"] = True
+                except Exception as e:
+                    report["callback_updated"] = False
+                    print(f"   ❌ Webhook URL not updated: {e}")
+            return report
+        
+        # The session's pool must hold one connection per worker
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = {pool.submit(post_chunk, chunk): chunk for chunk in chunks}
+            for done, future in enumerate(as_completed(futures), 1):
+                chunk = futures[future]
+                try:
+                    future.result()
+                    report["added"].extend(chunk)
+                    print(f"   ✅ {done}/{len(chunks)}: added {len(chunk)} channels")
+                except Exception as e:
+                    error = str(e)
+                    if isinstance(e, requests.exceptions.HTTPError) and e.response is not None and e.response.text:
+                        error = f"{e} - {e.response.text}"
+                    report["failed"].extend({"channel": ch, "error": error} for ch in chunk)
+                    print(f"   ❌ {done}/{len(chunks)}: {len(chunk)} channels failed: {error}")
+        
+        if callback_url is not None:
+            report["callback_updated"] = bool(report["added"])
+        return report
+    
     def validate_webhook_url(self, url: str) -> bool:
         """
         Validate that a webhook URL is properly formatted.
@@ -154,6 +265,115 @@ def parse_channels(channels_str: str) -> List[str]:
     return channels
 
 
+def normalize_channel(channel: str) -> str:
+    """
+    Reduce a channel reference to a canonical form for comparison.
+    
+    Recognizes the same formats as parse_channels:
+      - UC channel IDs are kept as-is (they are case-sensitive)
+      - @handles are lowercased (YouTube handles are case-insensitive)
+      - youtube.com/channel/UC... becomes the UC ID and youtube.com/@name the handle
+      - other youtube.com / youtu.be URLs become https:// without www./m., query or trailing slash
+    
+    Args:
+        channel: Channel ID, handle or URL
+        
+    Returns:
+        Canonical channel string (unrecognized values are returned stripped)
+    """
+    channel = channel.strip()
+    if channel.startswith('UC') and len(channel) == 24:
+        return channel
+    if channel.startswith('@'):
+        return channel.lower()
+    
+    if 'youtube.com' in channel or 'youtu.be' in channel:
+        parsed = urlparse(channel if '://' in channel else f"https://{channel}")
+        host = parsed.netloc.lower()
+        for prefix in ('www.', 'm.'):
+            if host.startswith(prefix):
+                host = host[len(prefix):]
+        parts = [p for p in parsed.path.split('/') if p]
+        if host == 'youtube.com' and parts:
+            if parts[0] == 'channel' and len(parts) > 1:
+                return parts[1]
+            if parts[0].startswith('@'):
+                return parts[0].lower()
+        return 'https://' + '/'.join([host] + parts)
+    
+    return channel
+
+
+def dedupe_channels(channels: List[str]) -> List[str]:
+    """
+    Normalize channels and drop duplicates, keeping first-seen order.
+    
+    Args:
+        channels: Channel IDs, handles or URLs
+        
+    Returns:
+        Unique canonical channels
+    """
+    seen = set()
+    unique = []
+    for channel in channels:
+        key = normalize_channel(channel)
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(key)
+    return unique
+
+
+def trigger_channels(triggers) -> List[str]:
+    """
+    Collect monitored channels from a get_triggers response.
+    
+    Args:
+        triggers: Single trigger dict, list of triggers, or None
+        
+    Returns:
+        Channels from every YouTube trigger
+    """
+    if isinstance(triggers, dict):
+        triggers = [triggers]
+    channels = []
+    for trigger in triggers or []:
+        if isinstance(trigger, dict) and trigger.get('type') == 'youtube':
+            channels.extend(trigger.get('youtube_channels') or [])
+    return channels
+
+
+def read_channels_file(path: str) -> List[str]:
+    """
+    Read channels from a CSV or plain-text file.
+    
+    CSV files use the column named channel, channel_id, handle or url when a
+    header is present, otherwise the first column. Text files take one or more
+    comma-separated channels per line; lines starting with # are skipped.
+    
+    Args:
+        path: Path to the file
+        
+    Returns:
+        List of channel IDs/URLs (validated like parse_channels)
+    """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if path.lower().endswith('.csv'):
+            rows = [row for row in csv.reader(f) if row and not row[0].startswith('#')]
+            column = 0
+            if rows:
+                header = [cell.strip().lower() for cell in rows[0]]
+                for name in ('channel', 'channel_id', 'handle', 'url'):
+                    if name in header:
+                        column = header.index(name)
+                        rows = rows[1:]
+                        break
+            values = [row[column] for row in rows if len(row) > column]
+        else:
+            values = [line for line in f if not line.lstrip().startswith('#')]
+    return parse_channels(','.join(values))
+
+
 def main():
     parser = argparse.ArgumentParser(
         description='Add YouTube channel triggers to a Mosaic agent',
@@ -171,6 +391,9 @@ Examples:
   # Use environment variable for API key
   export MOSAIC_API_KEY=mk_xxx
   python add_triggers.py --agent-id abc123 --channels UCxxxxxx
+  
+  # Per-phase timing report (JSON)
+  python add_triggers.py --agent-id abc123 --channels-file channels.csv --sync --profile sync.json
         '''
     )
     
@@ -185,12 +408,42 @@ Examples:
         help='Mosaic API key (or set MOSAIC_API_KEY env var)'
     )
     
-    parser.add_argument(
+    channel_source = parser.add_mutually_exclusive_group(required=True)
+    channel_source.add_argument(
         '--channels',
-        required=True,
         help='Comma-separated list of YouTube channel IDs, handles (@name), or URLs'
     )
     
+    channel_source.add_argument(
+        '--channels-file',
+        help='CSV or text file of channels (one per line); implies chunked requests'
+    )
+    
+    parser.add_argument(
+        '--sync',
+        action='store_true',
+        help='Only send channels not already on the agent\'s trigger'
+    )
+    
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=100,
+        help='Channels per request in sync/file mode (default: 100)'
+    )
+    
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=4,
+        help='Concurrent requests in sync/file mode (default: 4)'
+    )
+    
+    parser.add_argument(
+        '--report',
+        help='Write the sync report (added/already present/failed) as JSON to this file'
+    )
+    
     parser.add_argument(
         '--webhook',
         help='Optional webhook URL for trigger notifications'
@@ -208,10 +461,12 @@ Examples:
         help='Remove the webhook URL from the trigger (sets it to null)'
     )
     
+    add_profile_arguments(parser)
+    
     args = parser.parse_args()
+    profiler = start_profiler('add_triggers', args.profile, args.profile_cprofile)
     
     # Get API key from args or environment
-    import os
     api_key = args.api_key or os.environ.get('MOSAIC_API_KEY')
     
     if not api_key:
@@ -223,7 +478,14 @@ Examples:
         sys.exit(1)
     
     # Parse channels
-    channels = parse_channels(args.channels)
+    if args.channels_file:
+        if not os.path.isfile(args.channels_file):
+            print(f"❌ Error: Channels file not found: {args.channels_file}")
+            sys.exit(1)
+        with profiler.phase('read_channels'):
+            channels = read_channels_file(args.channels_file)
+    else:
+        channels = parse_channels(args.channels)
     
     if not channels:
         print("❌ Error: No valid channels provided")
@@ -245,13 +507,45 @@ Examples:
     # Initialize manager
     manager = MosaicTriggerManager(api_key, args.base_url)
     
+    if args.sync or args.channels_file:
+        if args.chunk_size < 1 or args.concurrency < 1:
+            print("❌ Error: --chunk-size and --concurrency must be at least 1")
+            sys.exit(1)
+        try:
+            with profiler.phase('sync'):
+                report = manager.sync_youtube_channels(
+                    args.agent_id, channels, webhook_url,
+                    args.chunk_size, args.concurrency, skip_existing=args.sync
+                )
+        except Exception as e:
+            print(f"\n❌ Failed to sync triggers: {e}")
+            sys.exit(1)
+        
+        print("\n" + "="*60)
+        print(f"✅ Added:           {len(report['added'])}")
+        print(f"➖ Already present: {len(report['already_present'])}")
+        print(f"❌ Failed:          {len(report['failed'])}")
+        if 'callback_updated' in report:
+            print(f"🔗 Webhook URL:     {'updated' if report['callback_updated'] else 'NOT updated'}")
+        for failure in report['failed'][:20]:
+            print(f"     • {failure['channel']}: {failure['error']}")
+        if len(report['failed']) > 20:
+            print(f"     … and {len(report['failed']) - 20} more")
+        if args.report:
+            with open(args.report, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print(f"\n📝 Report written to {args.report}")
+        print("="*60)
+        sys.exit(1 if report['failed'] or report.get('callback_updated') is False else 0)
+    
     try:
         # Add channels to trigger
-        result = manager.add_youtube_channels(
-            args.agent_id,
-            channels,
-            webhook_url
-        )
+        with profiler.phase('add_channels'):
+            result = manager.add_youtube_channels(
+                args.agent_id,
+                channels,
+                webhook_url
+            )
         
         print("\n✅ Successfully added YouTube channels to trigger!")
         if result and result != {"status": "ok"}:
@@ -259,7 +553,8 @@ Examples:
         
         # Verify by fetching triggers
         print("\n" + "="*60)
-        triggers = manager.get_triggers(args.agent_id)
+        with profiler.phase('get_triggers'):
+            triggers = manager.get_triggers(args.agent_id)
         
         if triggers:
             print("\n✅ Trigger configuration verified!")
@@ -14,14 +14,46 @@ Example:
     
     # Using command line argument
     python test_auth.py --api-key mk_your_key
+    
+    # Latency breakdown (DNS / TCP / TLS / TTFB / total) for triaging slow API incidents
+    python test_auth.py --diagnose --samples 10
 """
 
 import argparse
 import os
+import socket
+import ssl
 import sys
 import json
+import queue
+import threading
+import time
 import requests
-from typing import Optional, Dict, Any
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional, Dict, Any, List
+from urllib.parse import urlparse
+
+
+# Endpoints probed when /whoami doesn't exist
+ALTERNATIVE_ENDPOINTS = [
+    ('/me', 'GET'),
+    ('/user', 'GET'),
+    ('/account', 'GET'),
+    ('/auth/verify', 'GET'),
+    ('/auth/validate', 'GET'),
+    ('/api/whoami', 'GET'),
+    ('/api/me', 'GET'),
+    ('/videos/get_upload_url', 'GET'),  # Known endpoint from docs
+]
+
+LATENCY_PHASES = ['dns_ms', 'connect_ms', 'tls_ms', 'ttfb_ms', 'total_ms']
+PHASE_LABELS = {
+    'dns_ms': 'DNS',
+    'connect_ms': 'TCP connect',
+    'tls_ms': 'TLS',
+    'ttfb_ms': 'TTFB',
+    'total_ms': 'Total',
+}
 
 
 class MosaicAuthTester:
@@ -77,51 +109,61 @@ class MosaicAuthTester:
         Test alternative endpoints to verify authentication.
         Try common API endpoints that might reveal auth status.
         
+        All endpoints are probed concurrently and the first successful one is
+        returned without waiting for the rest. Probes run on daemon threads,
+        so ones still in flight don't hold up the process exiting either.
+        
         Returns:
             Response data from successful endpoint
         """
-        # Alternative endpoints to try
-        test_endpoints = [
-            ('/me', 'GET'),
-            ('/user', 'GET'),
-            ('/account', 'GET'),
-            ('/auth/verify', 'GET'),
-            ('/auth/validate', 'GET'),
-            ('/api/whoami', 'GET'),
-            ('/api/me', 'GET'),
-            ('/videos/get_upload_url', 'GET'),  # Known endpoint from docs
-        ]
-        
         results = []
+        done: "queue.Queue" = queue.Queue()
         
-        for endpoint_path, method in test_endpoints:
+        def probe(endpoint_path: str, method: str):
             endpoint = f"{self.base_url}{endpoint_path}"
-            
+            start = time.perf_counter()
             try:
                 if method == 'GET':
                     response = requests.get(endpoint, headers=self.headers, timeout=5)
                 else:
                     response = requests.post(endpoint, headers=self.headers, json={}, timeout=5)
-                
-                # If we get a 200 or 401/403, it means the endpoint exists
-                if response.status_code in [200, 201, 204]:
-                    return {
-                        'success': True,
-                        'endpoint': endpoint_path,
-                        'status_code': response.status_code,
-                        'data': response.json() if response.text else {},
-                        'note': f'Successfully authenticated via {endpoint_path}'
-                    }
-                elif response.status_code in [401, 403]:
-                    results.append({
-                        'endpoint': endpoint_path,
-                        'status_code': response.status_code,
-                        'exists': True,
-                        'authenticated': False
-                    })
-                    
-            except:
+            except requests.exceptions.RequestException as e:
+                done.put((endpoint_path, e, None))
+                return
+            done.put((endpoint_path, response, (time.perf_counter() - start) * 1000))
+        
+        # Daemon threads rather than an executor: the interpreter joins executor
+        # threads at exit, which would wait out the slowest probe's timeout
+        for path, method in ALTERNATIVE_ENDPOINTS:
+            threading.Thread(target=probe, args=(path, method), name=f"probe{path}", daemon=True).start()
+        for _ in ALTERNATIVE_ENDPOINTS:
+            endpoint_path, response, elapsed_ms = done.get()
+            if isinstance(response, Exception):
+                results.append({
+                    'endpoint': endpoint_path,
+                    'exists': False,
+                    'error': str(response)
+                })
                 continue
+            
+            # If we get a 200 or 401/403, it means the endpoint exists
+            if response.status_code in [200, 201, 204]:
+                return {
+                    'success': True,
+                    'endpoint': endpoint_path,
+                    'status_code': response.status_code,
+                    'elapsed_ms': round(elapsed_ms, 1),
+                    'data': response.json() if response.text else {},
+                    'note': f'Successfully authenticated via {endpoint_path}'
+                }
+            elif response.status_code in [401, 403]:
+                results.append({
+                    'endpoint': endpoint_path,
+                    'status_code': response.status_code,
+                    'elapsed_ms': round(elapsed_ms, 1),
+                    'exists': True,
+                    'authenticated': False
+                })
         
         # If no successful auth, return summary of what we found
         return {
@@ -130,6 +172,123 @@ class MosaicAuthTester:
             'tested_endpoints': results
         }
     
+    def measure_latency(self, endpoint_path: str, timeout: float = 10) -> Dict[str, Any]:
+        """
+        Time one GET request phase by phase on a fresh connection.
+        
+        Args:
+            endpoint_path: Path to request, e.g. '/whoami'
+            timeout: Socket timeout in seconds for each phase
+            
+        Returns:
+            Dictionary with dns_ms, connect_ms, tls_ms, ttfb_ms, total_ms and
+            status_code, or an 'error' describing the phase that failed
+        """
+        parsed = urlparse(self.base_url)
+        host = parsed.hostname
+        secure = parsed.scheme == 'https'
+        port = parsed.port or (443 if secure else 80)
+        path = (parsed.path.rstrip('/') + endpoint_path) or '/'
+        
+        timings: Dict[str, Any] = {'endpoint': endpoint_path}
+        phase = 'dns'
+        sock = None
+        start = time.perf_counter()
+        try:
+            family, socktype, proto, _, sockaddr = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)[0]
+            t_dns = time.perf_counter()
+            
+            phase = 'connect'
+            sock = socket.socket(family, socktype, proto)
+            sock.settimeout(timeout)
+            sock.connect(sockaddr)
+            t_connect = time.perf_counter()
+            
+            phase = 'tls'
+            if secure:
+                sock = ssl.create_default_context().wrap_socket(sock, server_hostname=host)
+            t_tls = time.perf_counter()
+            
+            phase = 'request'
+            request_lines = [
+                f"GET {path} HTTP/1.1",
+                f"Host: {parsed.netloc}",
+                f"Authorization: {self.headers['Authorization']}",
+                "Accept: application/json",
+                "User-Agent: mosaic-test-auth",
+                "Connection: close",
+            ]
+            sock.sendall(("\r\n".join(request_lines) + "\r\n\r\n").encode())
+            first = sock.recv(1)
+            t_ttfb = time.perf_counter()
+            
+            phase = 'body'
+            chunks = [first]
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            t_total = time.perf_counter()
+        except (OSError, IndexError) as e:
+            timings['error'] = f"{phase}: {e}"
+            return timings
+        finally:
+            if sock is not None:
+                sock.close()
+        
+        status_line = b''.join(chunks).split(b'\r\n', 1)[0].decode(errors='replace')
+        parts = status_line.split(' ', 2)
+        timings.update({
+            'status_code': int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None,
+            'dns_ms': (t_dns - start) * 1000,
+            'connect_ms': (t_connect - t_dns) * 1000,
+            'tls_ms': (t_tls - t_connect) * 1000,
+            'ttfb_ms': (t_ttfb - t_tls) * 1000,
+            'total_ms': (t_total - start) * 1000,
+        })
+        return timings
+    
+    def diagnose(self, endpoint_paths: List[str], samples: int = 5) -> Dict[str, Any]:
+        """
+        Sample per-phase latency for several endpoints concurrently.
+        
+        Each endpoint is sampled sequentially (so samples don't compete with
+        each other), while different endpoints run in parallel.
+        
+        Args:
+            endpoint_paths: Paths to measure
+            samples: Requests per endpoint
+            
+        Returns:
+            Mapping of endpoint path to {'samples', 'errors', 'status_codes',
+            and p50/p90/p99/max for every phase}
+        """
+        def sample(endpoint_path: str) -> List[Dict[str, Any]]:
+            return [self.measure_latency(endpoint_path) for _ in range(samples)]
+        
+        report = {}
+        with ThreadPoolExecutor(max_workers=len(endpoint_paths)) as pool:
+            futures = {pool.submit(sample, path): path for path in endpoint_paths}
+            for future in as_completed(futures):
+                runs = future.result()
+                ok = [r for r in runs if 'error' not in r]
+                summary: Dict[str, Any] = {
+                    'samples': len(runs),
+                    'errors': [r['error'] for r in runs if 'error' in r],
+                    'status_codes': sorted({r['status_code'] for r in ok if r.get('status_code')}),
+                }
+                for phase in LATENCY_PHASES:
+                    values = [r[phase] for r in ok]
+                    summary[phase] = {
+                        'p50': percentile(values, 50),
+                        'p90': percentile(values, 90),
+                        'p99': percentile(values, 99),
+                        'max': max(values) if values else None,
+                    }
+                report[futures[future]] = summary
+        return report
+    
     def validate_api_key_format(self) -> Dict[str, bool]:
         """
         Validate the API key format.
@@ -147,6 +306,55 @@ class MosaicAuthTester:
         return validations
 
 
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """
+    Linear-interpolated percentile of a list of numbers.
+    
+    Args:
+        values: Samples
+        pct: Percentile between 0 and 100
+        
+    Returns:
+        The percentile, or None when there are no samples
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def print_diagnostics(base_url: str, report: Dict[str, Any]):
+    """
+    Pretty print a latency breakdown from MosaicAuthTester.diagnose.
+    
+    Args:
+        base_url: API base URL that was measured
+        report: Per-endpoint latency summary
+    """
+    print("\n" + "="*60)
+    print("⏱️  MOSAIC API LATENCY BREAKDOWN")
+    print("="*60)
+    print(f"\n🌐 API URL: {base_url}")
+    
+    def fmt(value: Optional[float]) -> str:
+        return f"{value:8.1f}" if value is not None else "       -"
+    
+    for endpoint, summary in report.items():
+        codes = ', '.join(str(c) for c in summary['status_codes']) or 'none'
+        print(f"\n📍 {endpoint}  ({summary['samples']} samples, status: {codes})")
+        print(f"   {'phase':<12}{'p50 ms':>8}{'p90 ms':>8}{'p99 ms':>8}{'max ms':>8}")
+        for phase in LATENCY_PHASES:
+            stats = summary[phase]
+            print(f"   {PHASE_LABELS[phase]:<12}{fmt(stats['p50'])}{fmt(stats['p90'])}{fmt(stats['p99'])}{fmt(stats['max'])}")
+        for error in sorted(set(summary['errors'])):
+            print(f"   ❌ {summary['errors'].count(error)}x {error}")
+    
+    print("\n" + "="*60 + "\n")
+
+
 def print_results(api_key: str, results: Dict[str, Any], validations: Dict[str, bool]):
     """
     Pretty print the test results.
@@ -282,6 +490,9 @@ Examples:
   
   # Verbose output
   python test_auth.py --verbose
+  
+  # Where does the time go? Per-phase latency percentiles over 10 samples
+  python test_auth.py --diagnose --samples 10
         '''
     )
     
@@ -302,6 +513,25 @@ Examples:
         help='Show verbose output including all tested endpoints'
     )
     
+    parser.add_argument(
+        '--diagnose',
+        action='store_true',
+        help='Measure DNS/TCP/TLS/TTFB/total latency for /whoami and the alternative endpoints'
+    )
+    
+    parser.add_argument(
+        '--samples',
+        type=int,
+        default=5,
+        help='Requests per endpoint in --diagnose mode (default: 5)'
+    )
+    
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='Print the --diagnose report as JSON'
+    )
+    
     args = parser.parse_args()
     
     # Get API key from args or environment
@@ -317,6 +547,22 @@ Examples:
     # Create tester
     tester = MosaicAuthTester(api_key, args.base_url)
     
+    if args.diagnose:
+        if args.samples < 1:
+            print("❌ Error: --samples must be at least 1")
+            sys.exit(1)
+        print(f"\n🔄 Sampling API latency ({args.samples} requests per endpoint)...")
+        endpoints = ['/whoami'] + [path for path, _ in ALTERNATIVE_ENDPOINTS]
+        report = tester.diagnose(endpoints, args.samples)
+        # Keep the probe order stable in the output
+        report = {path: report[path] for path in endpoints}
+        if args.json:
+            print(json.dumps({'base_url': args.base_url, 'endpoints': report}, indent=2))
+        else:
+            print_diagnostics(args.base_url, report)
+        failed = all(not summary['status_codes'] for summary in report.values())
+        sys.exit(1 if failed else 0)
+    
     # Validate API key format
     validations = tester.validate_api_key_format()
     
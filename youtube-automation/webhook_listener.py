@@ -17,21 +17,46 @@ Example:
     
     # With ngrok tunnel (requires ngrok installed)
     python webhook_listener.py --ngrok
+    
+    # Route tokens to per-tenant handlers (see ../api-call/token_router.py)
+    python webhook_listener.py --routes routes.json
+    
+    # Record inbound traffic for offline replay (see ../api-call/capture.py)
+    python webhook_listener.py --capture traffic.cap
+    
+    # One of several listeners behind a load balancer (see ../api-call/cluster.py)
+    python webhook_listener.py --port 3001 --cluster /var/lib/mosaic/cluster.db
+    
+    # Serve output videos/thumbnails from a local cache (see ../api-call/artifact_cache.py)
+    python webhook_listener.py --artifact-cache --artifact-cache-mb 20480
+    
+    # One JSON line per event, every 10th run's OUTPUTS_FINISHED (see ../api-call/event_log.py)
+    python webhook_listener.py --log-format json --log-sample OUTPUTS_FINISHED=0.1
 """
 
 import argparse
-import json
 import logging
 import os
+import signal
+import sqlite3
 import sys
-import subprocess
+import shutil
 import time
 import threading
 from datetime import datetime
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 from flask import Flask, request, jsonify
 from urllib.parse import urlparse
 
+# Event rollups are shared with the listener in ../api-call
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api-call'))
+import tracing
+import tunnel
+from batch_ingest import BatchError, decode_batch, summarize
+from event_log import DEFAULT_RATE, FORMATS, EventLog, parse_samples
+from event_stats import RollupStats
+from payload_store import COMPRESSIONS, DEFAULT_MAX_BYTES, PayloadStore
+
 
 # Configure logging
 logging.basicConfig(
@@ -44,9 +69,15 @@ logger = logging.getLogger(__name__)
 # Create Flask app
 app = Flask(__name__)
 
-# Store webhook history
-webhook_history = []
-MAX_HISTORY = 100  # Keep last 100 webhooks
+# Store webhook history as raw (compressed) payloads within a byte budget;
+# replaced in main() from --history-mb / --history-compression
+webhook_history = PayloadStore(DEFAULT_MAX_BYTES, compression="zlib")
+
+# Per-flag/agent/channel counts, run outcomes and durations, updated once per event
+event_stats = RollupStats()
+
+# Emits a span per callback and closes run traces when tracing is enabled
+run_tracer = tracing.WebhookTracer('youtube_webhook_listener')
 
 
 class WebhookHandler:
@@ -168,6 +199,32 @@ class WebhookHandler:
         
         output.append("\n" + "="*80)
         return "\n".join(output)
+    
+    @staticmethod
+    def render(data: Dict[str, Any], path: Optional[str], token: Optional[str], secret: Optional[str]) -> str:
+        """
+        Format a webhook and where it arrived for the console (pretty mode of the event log).
+        
+        Args:
+            data: Parsed event payload
+            path: Request path the event arrived on
+            token: Token from the URL path, if any
+            secret: X-Mosaic-Signature header value, if any (shown truncated)
+            
+        Returns:
+            The formatted block followed by path, token and secret lines
+        """
+        lines = [WebhookHandler.format_webhook(data), f"📥 Received at: {path}"]
+        if token:
+            lines.append(f"   Token/Path: {token}")
+        if secret:
+            lines.append(f"   Webhook Secret: {secret[:10]}..." if len(secret) > 10 else f"   Webhook Secret: {secret}")
+        return "\n".join(lines)
+
+
+# Renders and writes events on a background thread, so requests never wait on
+# the terminal; replaced in main() from the --log-* flags
+event_log = EventLog(payloads=os.environ.get('DEBUG') == '1', renderer=WebhookHandler.render)
 
 
 @app.route('/', methods=['GET'])
@@ -179,10 +236,15 @@ def home():
         'endpoints': {
             'webhook': '/webhook',
             'webhook_with_token': '/webhook/<token>',
+            'batch': '/batch[/<token>]',
             'history': '/history',
+            'stats': '/stats',
+            'routes': '/routes',
+            'cluster': '/cluster[?run_id=RUN_ID]',
+            'artifacts': '/artifacts[/<run_id>[/<n>[/thumbnail]]]',
             'health': '/health'
         },
-        'webhooks_received': len(webhook_history)
+        'webhooks_received': webhook_history.received
     })
 
 
@@ -194,13 +256,202 @@ def health():
 
 @app.route('/history', methods=['GET'])
 def history():
-    """Get webhook history."""
+    """Get webhook history (last 10 webhooks, or ?limit=N); the shared log in cluster mode."""
+    limit = request.args.get('limit', 10, type=int)
+    cluster = app.config.get('CLUSTER')
+    if cluster is not None:
+        return jsonify({
+            'node_id': cluster.node_id,
+            'store': cluster.store.counts(),
+            'history': cluster.store.latest(limit, include_secret=True)
+        })
     return jsonify({
         'total': len(webhook_history),
-        'history': webhook_history[-10:]  # Last 10 webhooks
+        'store': webhook_history.stats(),
+        'history': webhook_history.latest(limit, include_secret=True)
     })
 
 
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Get rollup statistics over every webhook received (by every node in cluster mode)."""
+    cluster = app.config.get('CLUSTER')
+    if cluster is not None:
+        return jsonify(cluster.merged_stats())
+    return jsonify(event_stats.snapshot())
+
+
+@app.route('/cluster', methods=['GET'])
+def cluster_status():
+    """Get cluster membership, ring shares and event log counts (?run_id=X adds its owner)."""
+    cluster = app.config.get('CLUSTER')
+    if cluster is None:
+        return jsonify({'error': 'Cluster mode not enabled (start with --cluster)'}), 404
+    return jsonify(cluster.snapshot(request.args.get('run_id')))
+
+
+@app.route('/routes', methods=['GET'])
+def routes():
+    """Get per-route handler metrics."""
+    router = app.config.get('ROUTER')
+    if router is None:
+        return jsonify({'error': 'Routing not enabled (start with --routes)'}), 404
+    return jsonify(router.metrics())
+
+
+@app.route('/artifacts', methods=['GET'])
+def artifact_stats():
+    """Get artifact cache hit/miss counters and disk usage."""
+    cache = app.config.get('ARTIFACTS')
+    if cache is None:
+        return jsonify({'error': 'Artifact cache not enabled (start with --artifact-cache)'}), 404
+    return jsonify(cache.stats())
+
+
+@app.route('/artifacts/<run_id>', methods=['GET'])
+def artifact_list(run_id: str):
+    """List a run's outputs with their local URLs and whether each is cached."""
+    cache = app.config.get('ARTIFACTS')
+    if cache is None:
+        return jsonify({'error': 'Artifact cache not enabled (start with --artifact-cache)'}), 404
+    outputs = cache.describe_run(run_id)
+    if outputs is None:
+        return jsonify({'error': f'No outputs known for run {run_id}'}), 404
+    return jsonify({'run_id': run_id, 'outputs': outputs})
+
+
+@app.route('/artifacts/<run_id>/<int:n>', methods=['GET'])
+@app.route('/artifacts/<run_id>/<int:n>/<any(video, thumbnail):kind>', methods=['GET'])
+def artifact(run_id: str, n: int, kind: str = 'video'):
+    """
+    Serve output n (1-based) of a run from the artifact cache.
+    
+    Fetched from its origin on first access; Range requests are supported so
+    players can seek. Files over the per-object limit redirect to the origin.
+    """
+    cache = app.config.get('ARTIFACTS')
+    if cache is None:
+        return jsonify({'error': 'Artifact cache not enabled (start with --artifact-cache)'}), 404
+    from artifact_cache import serve_artifact
+    return serve_artifact(cache, run_id, n, kind)
+
+
+def ingest_event(data: Dict[str, Any], raw: bytes, token: Optional[str], path: str,
+                 webhook_secret: Optional[str], received_ns: int, display: bool = True) -> Tuple[Optional[str], bool]:
+    """
+    Accept one webhook event from the single-event endpoint or /batch.
+    
+    In cluster mode the event is only appended to the shared log; the node
+    owning its run_id handles it (see ../api-call/cluster.py). Otherwise it
+    is handled here right away.
+    
+    Args:
+        data: Parsed event payload
+        raw: Raw JSON bytes of the event, kept in history
+        token: Token from the URL path, if any
+        path: Request path the event arrived on
+        webhook_secret: X-Mosaic-Signature header value, if any
+        received_ns: Arrival time in nanoseconds (for tracing)
+        display: Show the event in the console (through the event log)
+        
+    Returns:
+        (route name or None, accepted); not accepted means the route's queue is full
+    """
+    cluster = app.config.get('CLUSTER')
+    if cluster is not None:
+        seq, owner = cluster.append(raw, data, path=path, token=token, secret=webhook_secret,
+                                    received_ns=received_ns)
+        if display:
+            if seq:
+                event_log.message(f"🧩 {data.get('flag', 'UNKNOWN')} for run {data.get('run_id')} logged as #{seq} "
+                                  f"for {owner}", key='cluster')
+            else:
+                event_log.message(f"🧩 Duplicate {data.get('flag', 'UNKNOWN')} for run {data.get('run_id')} dropped",
+                                  key='cluster')
+        return None, True
+    return handle_event(data, raw, token, path, webhook_secret, received_ns, display)
+
+
+def handle_event(data: Dict[str, Any], raw: bytes, token: Optional[str], path: str,
+                 webhook_secret: Optional[str], received_ns: int, display: bool = True) -> Tuple[Optional[str], bool]:
+    """
+    Route, store, count and display one webhook event.
+    
+    Runs on the listener that received the event, or in cluster mode on the
+    node that owns the event's run.
+    
+    Args:
+        data: Parsed event payload
+        raw: Raw JSON bytes of the event, kept in history
+        token: Token from the URL path, if any
+        path: Request path the event arrived on
+        webhook_secret: X-Mosaic-Signature header value, if any
+        received_ns: Arrival time in nanoseconds (for tracing)
+        display: Show the event in the console (through the event log)
+        
+    Returns:
+        (route name or None, accepted); not accepted means the route's queue is full
+    """
+    # Hand off to the token's route (enqueue only, so the ack never waits on a handler)
+    route = None
+    router = app.config.get('ROUTER')
+    if router is not None:
+        route, accepted = router.dispatch(data, token)
+        if not accepted:
+            logger.warning(f"Route '{route}' queue full; asking for redelivery")
+            return route, False
+    
+    # Store the raw body in history; it is only parsed again when served
+    webhook_history.append(raw, path=path, token=token, secret=webhook_secret)
+    event_stats.record(data)
+    
+    if display:
+        # Only queued here (subject to --log-sample / --log-rate); formatted on the writer thread
+        event_log.event(data, path, token, webhook_secret)
+    
+    # Learn output URLs for /artifacts and queue prefetches (never waits on a download)
+    if app.config.get('ARTIFACTS') is not None:
+        app.config['ARTIFACTS'].observe(data)
+    
+    release_run_slot(data)
+    run_tracer.observe(data, received_ns)
+    return route, True
+
+
+def handle_cluster_event(event) -> bool:
+    """
+    Handle one event taken from the shared log by this node (cluster mode).
+    
+    Args:
+        event: cluster.ClusterEvent for a run this node owns
+        
+    Returns:
+        True once handled; False asks for it to be offered again (route queue full)
+    """
+    _, accepted = handle_event(event.data, event.raw, event.token, event.path, event.secret,
+                               event.received_ns, display=not event.path.startswith('/batch'))
+    return accepted
+
+
+def release_run_slot(data: Dict[str, Any]) -> None:
+    """
+    Free the run's slot in the run queue once the run has finished.
+    
+    Only active when started with --run-queue. Errors are logged, not raised:
+    the dispatcher's status polling frees the slot instead.
+    
+    Args:
+        data: Parsed event payload
+    """
+    queue = app.config.get('RUN_QUEUE')
+    if queue is None or data.get('flag') != 'RUN_FINISHED' or not data.get('run_id'):
+        return
+    try:
+        queue.release(data['run_id'], data.get('status') or 'completed')
+    except sqlite3.Error as e:
+        logger.warning(f"Could not release run {data['run_id']} in the run queue: {e}")
+
+
 @app.route('/webhook', methods=['POST'])
 @app.route('/webhook/<path:token>', methods=['POST'])
 def webhook(token=None):
@@ -208,6 +459,7 @@ def webhook(token=None):
     Main webhook endpoint.
     Accepts webhooks at /webhook or /webhook/{any-path}
     """
+    received_ns = time.time_ns()
     try:
         # Get webhook data
         data = request.get_json()
@@ -220,37 +472,15 @@ def webhook(token=None):
         headers = dict(request.headers)
         webhook_secret = headers.get('X-Mosaic-Signature')
         
-        # Store in history
-        webhook_entry = {
-            'timestamp': datetime.utcnow().isoformat(),
-            'path': request.path,
-            'token': token,
-            'webhook_secret': webhook_secret,
-            'data': data
-        }
-        
-        webhook_history.append(webhook_entry)
-        if len(webhook_history) > MAX_HISTORY:
-            webhook_history.pop(0)
-        
-        # Format and display webhook
-        formatted = WebhookHandler.format_webhook(data)
-        print(formatted)
-        
-        # Log additional info
-        logger.info(f"Webhook received at: {request.path}")
-        if token:
-            logger.info(f"Token/Path: {token}")
-        if webhook_secret:
-            logger.info(f"Webhook Secret: {webhook_secret[:10]}..." if len(webhook_secret) > 10 else webhook_secret)
-        
-        # Log raw JSON for debugging
-        if os.environ.get('DEBUG') == '1':
-            logger.debug("Raw webhook data:")
-            print(json.dumps(data, indent=2))
+        route, accepted = ingest_event(data, request.get_data(), token, request.path, webhook_secret, received_ns)
+        if not accepted:
+            return jsonify({'error': f"Route '{route}' is busy", 'route': route}), 503, {'Retry-After': '5'}
         
         # Return success response
-        return jsonify({'received': True, 'message': 'Webhook processed successfully'}), 200
+        response = {'received': True, 'message': 'Webhook processed successfully'}
+        if route:
+            response['route'] = route
+        return jsonify(response), 200
         
     except Exception as e:
         logger.error(f"Error processing webhook: {e}")
@@ -259,57 +489,79 @@ def webhook(token=None):
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/batch', methods=['POST'])
+@app.route('/batch/<path:token>', methods=['POST'])
+def batch(token=None):
+    """
+    Batched webhook endpoint for relays and re-delivery.
+    
+    Accepts NDJSON or a JSON array of events, optionally gzip-compressed
+    (Content-Encoding: gzip). The X-Mosaic-Signature header applies to the
+    whole batch; each event goes through the same path as /webhook and the
+    response carries one result per event (see ../api-call/batch_ingest.py).
+    """
+    received_ns = time.time_ns()
+    try:
+        items = decode_batch(request.get_data(), request.headers.get('Content-Encoding'), request.content_type)
+    except BatchError as e:
+        logger.warning(f"Rejected batch: {e}")
+        return jsonify({'error': str(e)}), e.status
+    
+    webhook_secret = request.headers.get('X-Mosaic-Signature')
+    started = time.perf_counter()
+    results = []
+    for index, (raw, data, error) in enumerate(items):
+        if error:
+            results.append({'index': index, 'status': 400, 'error': error})
+            continue
+        result = {'index': index, 'status': 200, 'run_id': data.get('run_id')}
+        try:
+            route, accepted = ingest_event(data, raw, token, request.path, webhook_secret, received_ns, display=False)
+        except Exception as e:
+            logger.error(f"Error processing batch event {index}: {e}")
+            result.update(status=500, error=str(e))
+            results.append(result)
+            continue
+        if route:
+            result['route'] = route
+        if not accepted:
+            result.update(status=503, error=f"Route '{route}' is busy")
+        results.append(result)
+    
+    summary = summarize(results)
+    logger.info(f"📦 Batch of {summary['received']} events at {request.path}: {summary['accepted']} accepted, "
+                f"{summary['failed']} failed ({(time.perf_counter() - started) * 1000:.1f} ms)")
+    return jsonify(summary), 200
+
+
 class NgrokManager:
     """Manages ngrok tunnel for local development."""
     
     @staticmethod
     def check_ngrok_installed() -> bool:
-        """Check if ngrok is installed."""
-        try:
-            result = subprocess.run(['ngrok', 'version'], capture_output=True, text=True)
-            return result.returncode == 0
-        except FileNotFoundError:
-            return False
+        """Check if the ngrok binary is on PATH."""
+        return shutil.which('ngrok') is not None
     
     @staticmethod
-    def start_tunnel(port: int) -> Optional[str]:
-        """Start ngrok tunnel and return public URL."""
-        if not NgrokManager.check_ngrok_installed():
-            logger.warning("ngrok is not installed. Install it from https://ngrok.com")
-            return None
+    def start_tunnel(port: int, backend: str = 'auto', timeout: float = 15.0) -> Optional[str]:
+        """
+        Reuse or start an ngrok tunnel and return its public URL.
         
-        try:
-            # Start ngrok in a subprocess
-            process = subprocess.Popen(
-                ['ngrok', 'http', str(port), '--log', 'stdout'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            # Give ngrok time to start
-            time.sleep(2)
+        A tunnel already forwarding this port is reused; otherwise ngrok is
+        started and polled until it reports a URL (see ../api-call/tunnel.py).
+        
+        Args:
+            port: Local port to expose
+            backend: 'binary', 'pyngrok' (in-process) or 'auto'
+            timeout: Seconds to wait for the tunnel URL
             
-            # Get tunnel info using ngrok API
-            import requests
-            try:
-                response = requests.get('http://127.0.0.1:4040/api/tunnels')
-                tunnels = response.json()
-                if tunnels['tunnels']:
-                    public_url = tunnels['tunnels'][0]['public_url']
-                    # Prefer HTTPS URL
-                    for tunnel in tunnels['tunnels']:
-                        if tunnel['public_url'].startswith('https'):
-                            public_url = tunnel['public_url']
-                            break
-                    return public_url
-            except:
-                logger.warning("Could not retrieve ngrok URL. Check http://127.0.0.1:4040")
-                return None
-                
-        except Exception as e:
-            logger.error(f"Failed to start ngrok: {e}")
-            return None
+        Returns:
+            Public URL, or None (the reason is logged and kept in tunnel.last_error)
+        """
+        url = tunnel.start_tunnel(port, backend, timeout)
+        if not url:
+            logger.warning(f"Could not start ngrok: {tunnel.last_error}")
+        return url
 
 
 def main():
@@ -327,8 +579,11 @@ Examples:
   # Start with ngrok tunnel (requires ngrok installed)
   python webhook_listener.py --ngrok
   
-  # Enable debug mode for raw JSON output
+  # Enable debug mode for raw JSON output (same as --log-payloads)
   DEBUG=1 python webhook_listener.py
+  
+  # One JSON object per event, for log shippers
+  python webhook_listener.py --log-format json > events.jsonl
         '''
     )
     
@@ -348,7 +603,27 @@ Examples:
     parser.add_argument(
         '--ngrok',
         action='store_true',
-        help='Start ngrok tunnel for public URL'
+        help='Start ngrok tunnel for public URL (reuses one already running for the port)'
+    )
+    
+    parser.add_argument(
+        '--ngrok-backend',
+        choices=tunnel.BACKENDS,
+        default='auto',
+        help='ngrok binary, in-process pyngrok, or auto (default: auto)'
+    )
+    
+    parser.add_argument(
+        '--ngrok-timeout',
+        type=float,
+        default=15.0,
+        help='Seconds to wait for the tunnel URL (default: 15)'
+    )
+    
+    parser.add_argument(
+        '--ngrok-stop-on-exit',
+        action='store_true',
+        help='Stop the ngrok agent when the listener exits (by default it keeps running for the next start)'
     )
     
     parser.add_argument(
@@ -357,8 +632,192 @@ Examples:
         help='Enable Flask debug mode'
     )
     
+    parser.add_argument(
+        '--history-mb',
+        type=float,
+        default=DEFAULT_MAX_BYTES / (1024 * 1024),
+        help='Memory budget for webhook history in MB (default: 64)'
+    )
+    
+    parser.add_argument(
+        '--history-compression',
+        choices=COMPRESSIONS,
+        default='zlib',
+        help='Compress stored payloads (default: zlib; zstd needs the zstandard package)'
+    )
+    
+    parser.add_argument(
+        '--routes',
+        help='Routing table JSON mapping token patterns to handlers (see ../api-call/token_router.py)'
+    )
+    
+    parser.add_argument(
+        '--capture',
+        metavar='FILE',
+        help='Record every inbound POST to FILE for replay with ../api-call/capture.py'
+    )
+    
+    parser.add_argument(
+        '--run-queue',
+        nargs='?',
+        const='',
+        metavar='QUEUE_DB',
+        help='Free ../api-call/run_queue.py dispatcher slots when RUN_FINISHED arrives'
+    )
+    
+    parser.add_argument(
+        '--cluster',
+        nargs='?',
+        const='',
+        metavar='STORE_DB',
+        help='Run as one node of a listener cluster sharing STORE_DB (see ../api-call/cluster.py)'
+    )
+    
+    parser.add_argument(
+        '--node-id',
+        help='This node\'s id in the cluster (default: <hostname>-<port>)'
+    )
+    
+    parser.add_argument(
+        '--cluster-ttl',
+        type=float,
+        default=5.0,
+        help='Seconds without a heartbeat before a node\'s runs move to the others (default: 5)'
+    )
+    
+    parser.add_argument(
+        '--cluster-retention',
+        type=float,
+        default=24.0,
+        help='Hours handled events are kept for /history and duplicate detection (default: 24)'
+    )
+    
+    parser.add_argument(
+        '--artifact-cache',
+        nargs='?',
+        const='',
+        metavar='DIR',
+        help='Cache run output videos/thumbnails in DIR and serve them at /artifacts (default: ~/.mosaic/artifacts)'
+    )
+    
+    parser.add_argument(
+        '--artifact-cache-mb',
+        type=float,
+        default=10240,
+        help='Disk budget for cached artifacts in MB; least recently used files go first (default: 10240)'
+    )
+    
+    parser.add_argument(
+        '--artifact-max-object-mb',
+        type=float,
+        help='Larger files are redirected to their origin instead of cached (default: a quarter of the budget)'
+    )
+    
+    parser.add_argument(
+        '--artifact-prefetch',
+        choices=('none', 'thumbnails', 'all'),
+        default='thumbnails',
+        help='What to download as soon as outputs are announced (default: thumbnails)'
+    )
+    
+    parser.add_argument(
+        '--log-format',
+        choices=FORMATS,
+        default='auto',
+        help='Event output: pretty blocks, one line, or JSON per event (default: auto = pretty on a terminal, line otherwise)'
+    )
+    
+    parser.add_argument(
+        '--log-payloads',
+        action='store_true',
+        help='Also dump every payload as JSON (same as DEBUG=1 or --debug)'
+    )
+    
+    parser.add_argument(
+        '--log-sample',
+        action='append',
+        default=[],
+        metavar='FLAG=FRACTION',
+        help='Show this fraction of runs for a flag, e.g. OUTPUTS_FINISHED=0.1 or *=0 (repeatable)'
+    )
+    
+    parser.add_argument(
+        '--log-rate',
+        type=float,
+        default=DEFAULT_RATE,
+        help=f'Events shown per second per flag; the rest are counted (default: {DEFAULT_RATE:g}, 0 = no limit)'
+    )
+    
     args = parser.parse_args()
     
+    global webhook_history, event_log
+    try:
+        webhook_history = PayloadStore(int(args.history_mb * 1024 * 1024), args.history_compression)
+        event_log = EventLog(args.log_format, args.log_payloads or args.debug or os.environ.get('DEBUG') == '1',
+                             parse_samples(args.log_sample), args.log_rate, WebhookHandler.render)
+    except (RuntimeError, ValueError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    # Log records (ours, Flask's, werkzeug's) are written by the same background thread
+    event_log.install_logging()
+    # SIGTERM exits like Ctrl+C, so queued output is written and a cluster node leaves the ring right away
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    
+    if args.routes:
+        from token_router import RouteError, TokenRouter
+        try:
+            router = TokenRouter.from_file(args.routes)
+        except (OSError, ValueError, ImportError, RouteError) as e:
+            print(f"❌ Invalid routing table {args.routes}: {e}")
+            sys.exit(1)
+        router.start()
+        app.config['ROUTER'] = router
+    
+    if args.capture:
+        from capture import install_capture
+        try:
+            install_capture(app, args.capture)
+        except (OSError, ValueError) as e:
+            print(f"❌ Cannot open capture file {args.capture}: {e}")
+            sys.exit(1)
+    
+    if args.run_queue is not None:
+        from run_queue import RunQueue
+        try:
+            app.config['RUN_QUEUE'] = RunQueue(args.run_queue or None)
+        except (OSError, sqlite3.Error) as e:
+            print(f"❌ Cannot open run queue: {e}")
+            sys.exit(1)
+    
+    if args.artifact_cache is not None:
+        from artifact_cache import ArtifactCache
+        max_object = int(args.artifact_max_object_mb * 1024 * 1024) if args.artifact_max_object_mb else None
+        try:
+            # MOSAIC_API_KEY lets the cache look up outputs of runs this listener never saw
+            cache = ArtifactCache(args.artifact_cache or os.path.join(os.path.expanduser('~'), '.mosaic', 'artifacts'),
+                                  int(args.artifact_cache_mb * 1024 * 1024), max_object, args.artifact_prefetch,
+                                  'https://api.mosaic.so', os.environ.get('MOSAIC_API_KEY'))
+        except (OSError, ValueError) as e:
+            print(f"❌ Cannot open artifact cache: {e}")
+            sys.exit(1)
+        cache.start()
+        app.config['ARTIFACTS'] = cache
+    
+    # Join the cluster last, so backlog events find the router and run queue ready
+    if args.cluster is not None:
+        from cluster import ClusterError, ClusterStore, ListenerCluster, default_node_id
+        try:
+            cluster = ListenerCluster(ClusterStore(args.cluster or None), args.node_id or default_node_id(args.port),
+                                      handle_cluster_event, event_stats, args.cluster_ttl, args.cluster_retention)
+            cluster.start()
+        except (OSError, sqlite3.Error, ClusterError) as e:
+            print(f"❌ Cannot join cluster: {e}")
+            sys.exit(1)
+        app.config['CLUSTER'] = cluster
+        if app.config.get('ARTIFACTS') is not None:
+            # Outputs of runs another node handled are found in the shared log
+            app.config['ARTIFACTS'].event_source = cluster.store.finished_event
+    
     # Set debug env if flag is set
     if args.debug:
         os.environ['DEBUG'] = '1'
@@ -371,16 +830,19 @@ Examples:
     ngrok_url = None
     if args.ngrok:
         print(f"\n🌐 Starting ngrok tunnel...")
-        ngrok_url = NgrokManager.start_tunnel(args.port)
+        ngrok_url = NgrokManager.start_tunnel(args.port, args.ngrok_backend, args.ngrok_timeout)
         if ngrok_url:
             print(f"✅ Ngrok tunnel started!")
             print(f"   Public URL: {ngrok_url}")
             print(f"   Webhook URL: {ngrok_url}/webhook")
             print(f"   With token: {ngrok_url}/webhook/your-secret-token")
+            if not args.ngrok_stop_on_exit and tunnel.running_agent(args.port):
+                print(f"   The tunnel stays up after the listener exits ({tunnel.stop_hint(args.port)} "
+                      f"or --ngrok-stop-on-exit)")
             print(f"\n💡 Use this URL in add_triggers.py:")
             print(f"   python add_triggers.py --agent-id YOUR_ID --channels CHANNEL_ID --webhook {ngrok_url}/webhook")
         else:
-            print("⚠️  Could not start ngrok tunnel. Continuing with local server only.")
+            print(f"⚠️  Could not start ngrok tunnel ({tunnel.last_error}). Continuing with local server only.")
     
     # Display local URLs
     print(f"\n📡 Starting webhook listener...")
@@ -389,7 +851,25 @@ Examples:
     print(f"\n🔗 Endpoints:")
     print(f"   Webhook: http://localhost:{args.port}/webhook")
     print(f"   With token: http://localhost:{args.port}/webhook/your-secret-token")
+    print(f"   Batch: http://localhost:{args.port}/batch (NDJSON / JSON array, gzip)")
     print(f"   History: http://localhost:{args.port}/history")
+    print(f"   Stats: http://localhost:{args.port}/stats")
+    if app.config.get('ROUTER') is not None:
+        print(f"   Routes: http://localhost:{args.port}/routes")
+        for route in app.config['ROUTER'].routes:
+            print(f"      {route.pattern} -> {route.handler_spec} ({route.mode} x{route.workers})")
+    if args.capture:
+        print(f"   Capture: {args.capture} (replay with ../api-call/capture.py)")
+    if app.config.get('RUN_QUEUE') is not None:
+        print(f"   Run queue: {app.config['RUN_QUEUE'].path} (slots freed on RUN_FINISHED)")
+    if app.config.get('ARTIFACTS') is not None:
+        cache = app.config['ARTIFACTS']
+        print(f"   Artifacts: http://localhost:{args.port}/artifacts/<run_id>/<n>[/thumbnail] "
+              f"({cache.root}, {cache.bytes / 1024 ** 2:,.0f}/{cache.max_bytes / 1024 ** 2:,.0f}MB, "
+              f"prefetch {cache.prefetch_mode})")
+    if app.config.get('CLUSTER') is not None:
+        print(f"   Cluster: http://localhost:{args.port}/cluster "
+              f"(node {app.config['CLUSTER'].node_id}, store {app.config['CLUSTER'].store.path})")
     print(f"   Health: http://localhost:{args.port}/health")
     
     print("\n⏳ Waiting for webhooks... (Press Ctrl+C to stop)")
@@ -404,12 +884,21 @@ Examples:
             use_reloader=False  # Disable reloader to avoid duplicate messages
         )
     except KeyboardInterrupt:
+        event_log.flush()
         print("\n\n🛑 Webhook listener stopped")
-        print(f"📊 Total webhooks received: {len(webhook_history)}")
+        print(f"📊 Total webhooks received: {webhook_history.received}")
         sys.exit(0)
     except Exception as e:
         logger.error(f"Failed to start webhook listener: {e}")
         sys.exit(1)
+    finally:
+        if app.config.get('CLUSTER') is not None:
+            app.config['CLUSTER'].stop()
+        event_log.flush()
+        if args.ngrok:
+            notice = tunnel.release_tunnel(args.port, args.ngrok_stop_on_exit)
+            if notice:
+                print(notice)
 
 
 if __name__ == '__main__':